@@ -0,0 +1,972 @@
+"""
+下载器基准测试
+
+在本机启动一个模拟下载服务器（独立进程，asyncio实现），用不同的下载方式
+下载同一批文件，对比吞吐量、CPU和内存峰值。每个测试用例都在独立子进程中
+运行，这样各用例的内存峰值互不影响。
+
+场景:
+    engines       线程引擎 (PDFDownloader) 与异步引擎 (AsyncPDFDownloader)
+                  在不同并发数下的对比
+    backpressure  10万个URL时，一次性提交全部任务与按需分发任务的内存峰值对比
+    adaptive      服务器同时只能处理 --capacity 个请求、超出时返回429，
+                  对比固定并发数与自适应并发的吞吐量和最终收敛的并发数
+    segmented     服务器限制每个连接的带宽 (--bandwidth)，对比大文件单连接下载
+                  与分成 --segments 段并行下载的速度
+    writepath     大文件写入路径对比：改造前每8KB一个bytes对象的iter_content循环，
+                  与readinto到可复用缓冲区的写入路径，比较MB/秒和每GB的CPU秒
+    sniff         文件类型识别：改造前逐个扫描签名表与预先建好索引的识别器，
+                  比较每秒识别次数和识别正确率（不需要模拟服务器）
+    startup       启动耗时：Python解释器本身、导入pdf_downloader、从启动到发出第一个
+                  请求，指定 --exe 时同样测试打包后的exe（不需要共用的模拟服务器）
+    dns           任务分布在 --hosts 个主机名上（模拟解析器都解析到本机，每次解析耗时
+                  --dns-latency 秒），对比每个新连接都解析、使用DNS缓存、下载前预热，
+                  输出每个文件平均的DNS解析和建立连接时间
+    sharded       sharded_runner.py 本机多进程分片下载，对比 --shards 个进程
+                  （每个进程并发 --concurrency）的总吞吐量
+    suite         回归基准：小文件、大小和类型混合、缺少响应头、临时/永久错误、
+                  限流、限速大文件等负载，分别通过 download_from_list_with_names 和
+                  download_from_excel（生成对应的 urls.xlsx）下载，输出文件/秒、MB/秒、
+                  每个文件耗时的p50/p99、CPU和内存峰值，结果可保存为JSON用于前后对比
+
+用法:
+    python benchmark.py
+    python benchmark.py engines --files 2000 --size 65536 --latency 0.2 --concurrency 10 100 1000
+    python benchmark.py backpressure --files 100000
+    python benchmark.py adaptive --capacity 8 --concurrency 2 8 32
+    python benchmark.py segmented --size 67108864 --bandwidth 8388608 --segments 1 4 8
+    python benchmark.py writepath --files 8 --size 268435456
+    python benchmark.py sniff --files 200000
+    python benchmark.py startup --files 10 --exe dist/PDF_Downloader.exe
+    python benchmark.py dns --files 2000 --hosts 500 --dns-latency 0.03
+    python benchmark.py sharded --files 20000 --shards 1 2 4 --concurrency 32
+    python benchmark.py suite --json before.json
+    python benchmark.py suite --json after.json --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import http.server
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs, urlencode
+
+from openpyxl import Workbook
+
+from pdf_downloader import PDFDownloader, AsyncPDFDownloader
+import sharded_runner
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# ---------------------------------------------------------------------------
+# 模拟下载服务器
+# ---------------------------------------------------------------------------
+
+_body_cache = {}
+_inflight = 0  # 服务器正在处理的请求数（用于模拟限流）
+_hits = Counter()  # 每个路径收到的请求数（用于模拟前几次请求失败）
+
+# 模拟的文件类型：类型 -> (Content-Type, 生成文件开头字节的函数, 文件结尾)
+BODY_TYPES = {
+    'pdf': ('application/pdf', lambda: b'%PDF-1.4\n', b'\n%%EOF\n'),
+    'png': ('image/png', lambda: b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR', b'IEND\xaeB`\x82'),
+    'docx': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+             lambda: ooxml('word', 'document.xml'), b''),
+    'html': ('text/html; charset=utf-8', lambda: b'<!DOCTYPE html><html><body>', b'</body></html>'),
+    # 服务器没有给出具体类型，需要从内容识别
+    'bin': ('application/octet-stream', lambda: b'%PDF-1.4\n', b'\n%%EOF\n'),
+}
+
+
+def make_body(size, kind='pdf'):
+    """生成指定大小和类型的模拟文件内容（相同大小和类型只生成一次）"""
+    if (size, kind) not in _body_cache:
+        head, tail = BODY_TYPES[kind][1](), BODY_TYPES[kind][2]
+        filler = max(size - len(head) - len(tail), 0)
+        _body_cache[size, kind] = head + b'0' * filler + tail
+    return _body_cache[size, kind]
+
+
+async def write_body(writer, body, bandwidth=None):
+    """发送响应体，bandwidth（字节/秒）不为空时按这个速度限制单个连接"""
+    if not bandwidth:
+        writer.write(body)
+        await writer.drain()
+        return
+    view = memoryview(body)
+    step = 64 * 1024
+    for start in range(0, len(view), step):
+        piece = view[start:start + step]
+        writer.write(piece)
+        await writer.drain()
+        await asyncio.sleep(len(piece) / bandwidth)
+
+
+async def handle_connection(reader, writer, options):
+    """处理一个连接上的请求，支持keep-alive"""
+    global _inflight
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            request_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+            method, target = request_line.split(' ')[:2]
+            query = parse_qs(urlparse(target).query)
+
+            size = int(query.get('size', [options['size']])[0])
+            latency = float(query.get('latency', [options['latency']])[0])
+            kind = query.get('type', ['pdf'])[0]
+            path = urlparse(target).path
+            _hits[path] += 1
+
+            capacity = options.get('capacity')
+            if capacity and _inflight >= capacity:
+                # 超过服务器处理能力，模拟限流
+                writer.write(b'HTTP/1.1 429 Too Many Requests\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+                continue
+
+            _inflight += 1
+            try:
+                if latency:
+                    await asyncio.sleep(latency)
+
+                # status=404 模拟永久错误，fail=N 模拟前N次请求返回503的临时错误
+                error = query.get('status', [None])[0]
+                if error is None and _hits[path] <= int(query.get('fail', [0])[0]):
+                    error = '503'
+                if error:
+                    writer.write(f'HTTP/1.1 {error} Error\r\nRetry-After: 0\r\nContent-Length: 0\r\n\r\n'.encode())
+                    await writer.drain()
+                    continue
+
+                body = make_body(size, kind)
+                status = b'200 OK'
+                extra = b''
+                match = re.search(rb'\r\nrange: bytes=(\d+)-(\d*)', head.lower())
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or len(body) - 1), len(body) - 1)
+                    status = b'206 Partial Content'
+                    extra = f'Content-Range: bytes {start}-{end}/{len(body)}\r\n'.encode()
+                    body = memoryview(body)[start:end + 1]
+                # notype=1 不返回Content-Type；nolength=1 不返回Content-Length，发送完关闭连接
+                if 'notype' not in query:
+                    extra += f'Content-Type: {BODY_TYPES[kind][0]}\r\n'.encode()
+                close = 'nolength' in query
+                if close:
+                    extra += b'Connection: close\r\n'
+                else:
+                    extra += b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                writer.write(
+                    b'HTTP/1.1 ' + status + b'\r\n'
+                    b'Accept-Ranges: bytes\r\n'
+                    b'ETag: "' + f'{kind}-{size}'.encode() + b'"\r\n' + extra +
+                    b'\r\n'
+                )
+                if method != 'HEAD':
+                    await write_body(writer, body, options.get('bandwidth'))
+                await writer.drain()
+            finally:
+                _inflight -= 1
+
+            if close or b'connection: close' in head.lower():
+                break
+    except ConnectionError:
+        # 客户端提前关闭连接（如分段下载时第一段读够后关闭整个响应）
+        pass
+    finally:
+        writer.close()
+
+
+def run_server(port_queue, options):
+    """服务器进程入口"""
+    raise_fd_limit()
+
+    async def main():
+        server = await asyncio.start_server(
+            lambda r, w: handle_connection(r, w, options),
+            '127.0.0.1', 0, backlog=4096,
+        )
+        port_queue.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_server(**options):
+    """在独立进程中启动模拟服务器，返回(进程, base_url)"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_server, args=(port_queue, options), daemon=True)
+    process.start()
+    port = port_queue.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}"
+
+
+# ---------------------------------------------------------------------------
+# 测试用例
+# ---------------------------------------------------------------------------
+
+def raise_fd_limit():
+    """上千并发需要同样数量的socket和文件句柄，尽量提高文件描述符上限"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    with contextlib.suppress(ValueError, OSError):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def peak_rss_mb():
+    """当前进程的内存峰值(MB)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS单位为字节
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return None
+
+
+class UnboundedDownloader(PDFDownloader):
+    """
+    重现改造前的批量循环：先为每个URL提交一个Future，全部提交后再统一收集结果，
+    作为backpressure场景的对照组
+    """
+
+    def run_batch(self, tasks, on_result=None, total=None):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_url = {
+                executor.submit(self.download_task, url, filename): url
+                for url, filename in tasks
+            }
+            for future in as_completed(future_to_url):
+                url = future_to_url[future]
+                success, result = future.result()
+                self.record_result(url, success)
+                if on_result:
+                    on_result(url, success, result)
+
+
+class IterContentDownloader(PDFDownloader):
+    """重现改造前的写入路径：iter_content每8KB创建一个bytes对象，不预分配文件空间，作为writepath场景的对照组"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs['preallocate'] = False
+        super().__init__(*args, **kwargs)
+
+    def _iter_body(self, response):
+        return response.iter_content(chunk_size=8192)
+
+
+ENGINES = {
+    'thread': PDFDownloader,
+    'async': AsyncPDFDownloader,
+    'unbounded': UnboundedDownloader,
+    'itercontent': IterContentDownloader,
+}
+
+
+def make_workload(base_url, workload, run=''):
+    """
+    按负载描述生成下载任务 [(文件名, URL)]，同一个描述总是生成同样的文件
+
+    run 加在URL路径前面，同一个服务器上先后运行的用例不会共用"前几次请求失败"的计数
+
+    Args:
+        workload (dict): files 文件数；sizes 文件大小列表（每个文件从中随机选一个，
+            重复的大小即权重）；types 文件类型列表（见BODY_TYPES）；latency/jitter
+            每个请求的响应延迟为 latency + [0, jitter) 的随机值；missing_type/missing_length
+            不返回Content-Type/Content-Length的文件比例；transient_errors 前一次请求返回503的
+            文件比例；permanent_errors 返回404的文件比例；seed 随机种子
+    """
+    rng = random.Random(workload.get('seed', 0))
+    sizes = workload.get('sizes', [64 * 1024])
+    types = workload.get('types', ['pdf'])
+    tasks = []
+    for i in range(workload['files']):
+        params = {
+            'size': rng.choice(sizes),
+            'type': rng.choice(types),
+            'latency': round(workload.get('latency', 0.0) + rng.random() * workload.get('jitter', 0.0), 4),
+        }
+        if rng.random() < workload.get('missing_type', 0.0):
+            params['notype'] = 1
+        if rng.random() < workload.get('missing_length', 0.0):
+            params['nolength'] = 1
+        roll = rng.random()
+        if roll < workload.get('permanent_errors', 0.0):
+            params['status'] = 404
+        elif roll < workload.get('permanent_errors', 0.0) + workload.get('transient_errors', 0.0):
+            params['fail'] = 1
+        tasks.append((f"file_{i}", f"{base_url}{run}/file/{i}?{urlencode(params)}"))
+    return tasks
+
+
+def write_sheet(path, tasks):
+    """把任务写成与 urls.xlsx 相同格式的表格：第一列文件名，第二列URL，没有表头"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for filename, url in tasks:
+        sheet.append([filename, url])
+    workbook.save(path)
+
+
+def percentile(values, percent):
+    """已排序列表的百分位数（最近秩）"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))]
+
+
+def file_latencies(event_log):
+    """从事件日志中取出每个从网络下载的文件的耗时（DNS解析+建立连接+首字节+传输），已排序"""
+    latencies = []
+    with open(event_log, encoding='utf-8') as f:
+        for line in f:
+            event = json.loads(line)
+            if event['event'] == 'file_done' and 'transfer' in event:
+                latencies.append(event['dns'] + event['connect'] + event['ttfb'] + event['transfer'])
+    return sorted(latencies)
+
+
+def stub_resolver(latency):
+    """模拟DNS解析：任何主机名都解析到本机，每次解析耗时latency秒"""
+    def resolve(host, port, family=0, type=0, proto=0, flags=0):
+        time.sleep(latency)
+        return socket.getaddrinfo('127.0.0.1', port, socket.AF_INET, type)
+    return resolve
+
+
+def run_case(spec):
+    """
+    在当前进程中运行一个测试用例，返回结果字典
+
+    Args:
+        spec (dict): engine、concurrency、base_url，以及 files（下载 base_url/file/0..files-1）
+            或 workload（见make_workload），可选的 streaming（以生成器而不是列表传入任务）、
+            adaptive（开启自适应并发，concurrency为上限）、
+            segments（大文件分段数，默认1即不分段）、
+            mode（'list' 调用 download_from_list_with_names，'excel' 先生成 urls.xlsx
+            再调用 download_from_excel；默认直接调用 download_batch）、
+            latencies（记录事件日志，统计每个文件耗时的p50/p99）、
+            hosts（任务分布在这么多个主机名上，需要同时提供dns_latency）、
+            dns_latency（用模拟解析器解析主机名，每次解析的秒数）、dns_ttl、warmup（同下载器参数）
+    """
+    raise_fd_limit()
+    engine, concurrency = spec['engine'], spec['concurrency']
+    base_url = spec['base_url']
+    mode = spec.get('mode')
+
+    if spec.get('workload'):
+        tasks = make_workload(base_url, spec['workload'], f"/run{os.getpid()}")
+        names = [filename for filename, _ in tasks]
+        urls = [url for _, url in tasks]
+    elif spec.get('hosts'):
+        port = urlparse(base_url).port
+        urls = [f"http://h{i % spec['hosts']}.bench.test:{port}/file/{i}" for i in range(spec['files'])]
+        names = [f"file_{i}" for i in range(spec['files'])]
+    elif spec.get('streaming'):
+        urls = (f"{base_url}/file/{i}" for i in range(spec['files']))
+        names = (f"file_{i}" for i in range(spec['files']))
+    else:
+        urls = [f"{base_url}/file/{i}" for i in range(spec['files'])]
+        names = [f"file_{i}" for i in range(spec['files'])]
+    files = len(urls) if isinstance(urls, list) else spec['files']
+
+    with tempfile.TemporaryDirectory() as workspace:
+        folder = os.path.join(workspace, 'downloads')
+        event_log = os.path.join(workspace, 'events.jsonl') if spec.get('latencies') else None
+        sheet = os.path.join(workspace, 'urls.xlsx')
+        if mode == 'excel':
+            write_sheet(sheet, zip(names, urls))
+
+        dns_options = {}
+        if spec.get('dns_latency') is not None:
+            dns_options = {'resolver': stub_resolver(spec['dns_latency']), 'dns_ttl': spec.get('dns_ttl', 300.0),
+                           'warmup': spec.get('warmup', False)}
+        downloader = ENGINES[engine](download_folder=folder, max_workers=concurrency,
+                                     adaptive=spec.get('adaptive', False),
+                                     segments=spec.get('segments', 1), segment_threshold=0,
+                                     event_log=event_log, **dns_options)
+        first_result = []
+
+        def on_result(url, success, result):
+            if not first_result:
+                first_result.append(time.perf_counter())
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        # 逐文件的进度输出会严重干扰计时，测试期间丢弃
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            if mode == 'excel':
+                downloader.download_from_excel(sheet)
+            elif mode == 'list':
+                downloader.download_from_list_with_names(urls, names)
+            else:
+                downloader.download_batch(zip(urls, names), "benchmark", on_result=on_result)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        total_bytes = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+        latencies = file_latencies(event_log) if event_log else []
+    timed = downloader.timed_files
+
+    return {
+        'engine': engine,
+        'mode': mode or 'batch',
+        'concurrency': concurrency,
+        'files': files,
+        'succeeded': downloader.success_count,
+        'failed': downloader.failed_count,
+        'seconds': round(elapsed, 3),
+        'first_result_seconds': round(first_result[0] - start, 3) if first_result else None,
+        'files_per_sec': round(files / elapsed, 1),
+        'mb_per_sec': round(total_bytes / elapsed / (1024 * 1024), 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        'cpu_seconds': round(cpu, 3),
+        'cpu_seconds_per_gb': round(cpu / (total_bytes / 1024 ** 3), 3) if total_bytes else None,
+        'peak_rss_mb': round(peak_rss_mb() or 0, 1),
+        'retries': sum(downloader.retry_reasons.values()),
+        'adaptive_limits': downloader.adaptive_limits,
+        'dns_ms': round(downloader.phase_seconds['dns'] / timed * 1000, 2) if timed else None,
+        'connect_ms': round(downloader.phase_seconds['connect'] / timed * 1000, 2) if timed else None,
+    }
+
+
+def run_case_in_subprocess(spec):
+    """在子进程中运行测试用例，保证内存峰值独立统计"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', json.dumps(spec)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_row(result, label):
+    first_result = result['first_result_seconds']
+    print(f"{label:<12}{result['concurrency']:>6}{result['files']:>9}{result['files_per_sec']:>10}"
+          f"{result['mb_per_sec']:>9}{result['cpu_seconds']:>8}{result['peak_rss_mb']:>10}"
+          f"{'-' if first_result is None else first_result:>10}{result['failed']:>6}")
+
+
+def print_header():
+    print(f"{'用例':<12}{'并发':>6}{'文件数':>9}{'文件/秒':>10}{'MB/秒':>9}{'CPU秒':>8}"
+          f"{'内存峰值MB':>10}{'首个完成s':>10}{'失败':>6}")
+    print("-" * 80)
+
+
+def scenario_engines(args, base_url):
+    """线程引擎与异步引擎在不同并发数下的吞吐量和内存对比"""
+    for concurrency in args.concurrency:
+        for engine in args.engines:
+            spec = {'engine': engine, 'concurrency': concurrency, 'base_url': base_url, 'files': args.files}
+            print_row(run_case_in_subprocess(spec), engine)
+
+
+def scenario_backpressure(args, base_url):
+    """
+    大列表下批量循环的内存对比：
+    unbounded = 改造前先提交全部Future的做法（任务以列表传入）
+    bounded   = 当前按需读取任务、限制待分发数量的调度（任务以生成器传入）
+    """
+    concurrency = args.concurrency[0]
+    for engine, label, streaming in (('unbounded', 'unbounded', False), ('thread', 'bounded', True)):
+        spec = {'engine': engine, 'concurrency': concurrency, 'base_url': base_url,
+                'files': args.files, 'streaming': streaming}
+        print_row(run_case_in_subprocess(spec), label)
+
+
+def scenario_adaptive(args, base_url):
+    """
+    限流服务器下的并发对比：固定并发数过低浪费带宽、过高触发429重试，
+    自适应并发以最大并发数为上限运行，应收敛到服务器的处理能力附近
+    """
+    for concurrency in args.concurrency:
+        spec = {'engine': 'thread', 'concurrency': concurrency, 'base_url': base_url, 'files': args.files}
+        result = run_case_in_subprocess(spec)
+        print_row(result, 'fixed')
+        print(f"{'':<12}重试 {result['retries']} 次")
+    spec = {'engine': 'thread', 'concurrency': max(args.concurrency), 'base_url': base_url,
+            'files': args.files, 'adaptive': True}
+    result = run_case_in_subprocess(spec)
+    print_row(result, 'adaptive')
+    limits = ", ".join(str(limit) for limit in result['adaptive_limits'].values())
+    print(f"{'':<12}重试 {result['retries']} 次, 最终并发 {limits} (服务器处理能力 {args.capacity})")
+
+
+def scenario_segmented(args, base_url):
+    """每个连接限速时，大文件单连接下载与分段并行下载的速度对比"""
+    for segments in args.segments:
+        spec = {'engine': 'thread', 'concurrency': args.concurrency[0], 'base_url': base_url,
+                'files': args.files, 'segments': segments}
+        print_row(run_case_in_subprocess(spec), f"segments={segments}")
+
+
+def scenario_writepath(args, base_url):
+    """大文件写入路径的吞吐量和每GB的CPU开销对比"""
+    for engine, label in (('itercontent', 'iter_content'), ('thread', 'readinto')):
+        spec = {'engine': engine, 'concurrency': args.concurrency[0], 'base_url': base_url,
+                'files': args.files}
+        result = run_case_in_subprocess(spec)
+        print_row(result, label)
+        print(f"{'':<12}每GB CPU {result['cpu_seconds_per_gb']} 秒")
+
+
+def scenario_dns(args, base_url):
+    """
+    主机很多时DNS解析的影响：uncached = 每个新连接都重新解析（缓存立即过期），
+    cached = 进程内DNS缓存，warmup = 下载前并发解析全部主机并为最忙的主机预先建立连接
+    """
+    for label, options in (('uncached', {'dns_ttl': 1e-6}), ('cached', {}), ('warmup', {'warmup': True})):
+        spec = {'engine': 'thread', 'concurrency': args.concurrency[0], 'base_url': base_url,
+                'files': args.files, 'hosts': args.hosts, 'dns_latency': args.dns_latency, **options}
+        result = run_case_in_subprocess(spec)
+        print_row(result, label)
+        print(f"{'':<12}平均每个文件: DNS解析 {result['dns_ms']} ms, 建立连接 {result['connect_ms']} ms")
+
+
+def scenario_sharded(args, base_url):
+    """
+    本机多进程分片下载的总吞吐量：单个进程的CPU跑满（GIL）后，增加进程数的效果。
+    CPU秒和内存峰值为所有分片进程的合计和其中最大的一个
+    """
+    concurrency = args.concurrency[0]
+    with tempfile.TemporaryDirectory() as folder:
+        urls_file = os.path.join(folder, 'urls.txt')
+        with open(urls_file, 'w', encoding='utf-8') as f:
+            f.writelines(f"{base_url}/file/{i}\n" for i in range(args.files))
+        for shards in args.shards:
+            output = os.path.join(folder, f'shards_{shards}')
+            children_start = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+            start = time.perf_counter()
+            with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+                total = sharded_runner.run_local(urls_file, output, shards, workers=concurrency, verbosity='quiet')
+            elapsed = time.perf_counter() - start
+            cpu = peak = 0
+            if resource:
+                usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+                cpu = usage.ru_utime + usage.ru_stime - children_start.ru_utime - children_start.ru_stime
+                peak = usage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+            print_row({
+                'concurrency': concurrency * shards,
+                'files': args.files,
+                'files_per_sec': round(args.files / elapsed, 1),
+                'mb_per_sec': round(total['bytes'] / elapsed / (1024 * 1024), 2),
+                'cpu_seconds': round(cpu, 3),
+                'peak_rss_mb': round(peak, 1),
+                'first_result_seconds': None,
+                'failed': total['failed'],
+            }, f"shards={shards}")
+
+
+# suite场景的负载（字段见make_workload），server为这个负载使用的模拟服务器参数
+SUITE_WORKLOADS = {
+    'small': {'files': 2000, 'sizes': [16 * 1024], 'latency': 0.02},
+    'mixed': {'files': 1000, 'sizes': [4 * 1024] * 4 + [64 * 1024] * 4 + [1024 ** 2] * 2 + [8 * 1024 ** 2],
+              'types': ['pdf', 'png', 'docx', 'html', 'bin'], 'latency': 0.02, 'jitter': 0.1},
+    'headers': {'files': 1000, 'sizes': [64 * 1024], 'types': ['pdf', 'png', 'docx'], 'latency': 0.02,
+                'missing_type': 0.5, 'missing_length': 0.5},
+    'errors': {'files': 1000, 'sizes': [64 * 1024], 'latency': 0.02, 'transient_errors': 0.05,
+               'permanent_errors': 0.01},
+    'throttled': {'files': 1000, 'sizes': [64 * 1024], 'latency': 0.05, 'server': {'capacity': 8}},
+    'large': {'files': 4, 'sizes': [32 * 1024 ** 2], 'server': {'bandwidth': 16 * 1024 ** 2}},
+}
+
+
+def scenario_suite(args):
+    """
+    回归基准：每个负载各启动一个模拟服务器，分别用 download_from_list_with_names 和
+    download_from_excel（先生成 urls.xlsx）下载，输出吞吐量、每个文件耗时的p50/p99、
+    CPU和内存峰值。--json 把结果保存为JSON，--compare 与之前保存的结果对比
+    """
+    results = []
+    print(f"{'负载':<10}{'方式':<7}{'引擎':<8}{'文件/秒':>9}{'MB/秒':>9}{'p50ms':>9}{'p99ms':>9}"
+          f"{'CPU秒':>8}{'内存峰值MB':>10}{'失败':>6}{'重试':>6}")
+    print("-" * 92)
+    for name in args.workloads:
+        workload = dict(SUITE_WORKLOADS[name])
+        if args.files:
+            workload['files'] = args.files
+        server_options = {'size': 64 * 1024, 'latency': 0.0, **workload.pop('server', {})}
+        server, base_url = start_server(**server_options)
+        try:
+            for mode in args.modes:
+                for engine in args.engines:
+                    spec = {'engine': engine, 'concurrency': args.concurrency[0], 'base_url': base_url,
+                            'workload': workload, 'mode': mode, 'latencies': True}
+                    result = {'workload': name, **run_case_in_subprocess(spec)}
+                    results.append(result)
+                    print(f"{name:<10}{mode:<7}{engine:<8}{result['files_per_sec']:>9}{result['mb_per_sec']:>9}"
+                          f"{result['p50_ms'] or '-':>9}{result['p99_ms'] or '-':>9}{result['cpu_seconds']:>8}"
+                          f"{result['peak_rss_mb']:>10}{result['failed']:>6}{result['retries']:>6}")
+        finally:
+            server.terminate()
+
+    if args.json:
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'cpu_count': os.cpu_count(),
+            'concurrency': args.concurrency[0],
+            'results': results,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.json}")
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+def compare_results(baseline_path, results):
+    """与之前保存的结果逐个用例对比，吞吐量下降或p99上升超过10%时标出"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['workload'], r['mode'], r['engine']): r for r in json.load(f)['results']}
+
+    def change(new, old):
+        return (new - old) / old if new is not None and old else None
+
+    print(f"\n与 {baseline_path} 对比:")
+    print(f"{'负载':<10}{'方式':<7}{'引擎':<8}{'文件/秒':>10}{'p99':>10}{'CPU秒':>10}")
+    for result in results:
+        old = baseline.get((result['workload'], result['mode'], result['engine']))
+        if old is None:
+            continue
+        throughput = change(result['files_per_sec'], old['files_per_sec'])
+        p99 = change(result['p99_ms'], old['p99_ms'])
+        cpu = change(result['cpu_seconds'], old['cpu_seconds'])
+        regressed = (throughput is not None and throughput < -0.1) or (p99 is not None and p99 > 0.1)
+        print(f"{result['workload']:<10}{result['mode']:<7}{result['engine']:<8}"
+              + "".join(f"{'-' if value is None else f'{value:+.0%}':>10}" for value in (throughput, p99, cpu))
+              + ("  ⚠️ 变慢" if regressed else ""))
+
+
+def make_zip(entries):
+    """在内存中生成ZIP，entries为[(文件名, 内容, 是否压缩)]"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data, compress in entries:
+            archive.writestr(name, data, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+def ooxml(directory, part):
+    """按Office的文件顺序生成一个最小的OOXML文档"""
+    content_types = b'<?xml version="1.0"?><Types>' + b'<Default Extension="xml"/>' * 20 + b'</Types>'
+    rels = b'<?xml version="1.0"?><Relationships>' + b'<Relationship Id="rId1"/>' * 10 + b'</Relationships>'
+    return make_zip([('[Content_Types].xml', content_types, True), ('_rels/.rels', rels, True),
+                     (f'{directory}/{part}', b'<xml/>' * 1000, True)])
+
+
+def sniff_corpus():
+    """类型识别测试语料：[(正确的扩展名, 文件开头的字节)]"""
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.USTAR_FORMAT) as archive:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 5
+        archive.addfile(info, io.BytesIO(b'hello'))
+    epub = make_zip([('mimetype', b'application/epub+zip', False), ('META-INF/container.xml', b'<x/>', True)])
+    odt = make_zip([('mimetype', b'application/vnd.oasis.opendocument.text', False), ('content.xml', b'<x/>', True)])
+    corpus = [
+        ('.pdf', b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n1 0 obj'),
+        ('.pdf', b'\xef\xbb\xbf\r\n%PDF-1.4\n'),
+        ('.jpg', b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'),
+        ('.png', b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR'),
+        ('.gif', b'GIF89a\x01\x00\x01\x00'),
+        ('.bmp', b'BM6\x00\x0c\x00\x00\x00'),
+        ('.tiff', b'II*\x00\x08\x00\x00\x00'),
+        ('.webp', b'RIFF\x24\x00\x00\x00WEBPVP8 '),
+        ('.wav', b'RIFF\x24\x08\x00\x00WAVEfmt '),
+        ('.avi', b'RIFF\x00\x10\x00\x00AVI LIST'),
+        ('.mp4', b'\x00\x00\x00\x20ftypisom\x00\x00\x02\x00isomiso2'),
+        ('.mov', b'\x00\x00\x00\x14ftypqt  \x00\x00\x02\x00qt  '),
+        ('.heic', b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1'),
+        ('.m4a', b'\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00M4A '),
+        ('.webm', b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01'),
+        ('.mp3', b'ID3\x04\x00\x00\x00\x00\x00\x00'),
+        ('.flac', b'fLaC\x00\x00\x00\x22'),
+        ('.zip', make_zip([('readme.txt', b'hello' * 100, True)])),
+        ('.docx', ooxml('word', 'document.xml')),
+        ('.xlsx', ooxml('xl', 'workbook.xml')),
+        ('.pptx', ooxml('ppt', 'presentation.xml')),
+        ('.epub', epub),
+        ('.odt', odt),
+        ('.doc', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1\x00\x00'),
+        ('.rar', b'Rar!\x1a\x07\x01\x00'),
+        ('.7z', b"7z\xbc\xaf'\x1c\x00\x04"),
+        ('.gz', b'\x1f\x8b\x08\x00\x00\x00\x00\x00'),
+        ('.tar', tar_buffer.getvalue()),
+        ('.exe', b'MZ\x90\x00\x03\x00\x00\x00'),
+        ('.elf', b'\x7fELF\x02\x01\x01\x00'),
+        (None, b'<!DOCTYPE html><html><head><title>404</title>'),
+        (None, bytes(range(256)) * 4),
+    ]
+    return [(extension, data[:PDFDownloader.SNIFF_SIZE]) for extension, data in corpus]
+
+
+# 改造前逐个扫描的签名表，作为sniff场景的对照组
+LEGACY_SIGNATURES = {
+    b'\x25\x50\x44\x46': '.pdf', b'\xFF\xD8\xFF': '.jpg', b'\x89\x50\x4E\x47': '.png',
+    b'\x47\x49\x46\x38': '.gif', b'\x42\x4D': '.bmp', b'\x50\x4B\x03\x04': '.zip',
+    b'\x50\x4B\x05\x06': '.zip', b'\x50\x4B\x07\x08': '.zip', b'\xD0\xCF\x11\xE0': '.doc',
+    b'\x52\x61\x72\x21': '.rar', b'\x7F\x45\x4C\x46': '.elf', b'\x4D\x5A': '.exe',
+}
+
+
+def legacy_sniff(sample):
+    for signature, extension in LEGACY_SIGNATURES.items():
+        if sample.startswith(signature):
+            return extension
+    return None
+
+
+def scenario_sniff(args):
+    """文件类型识别的速度和正确率对比"""
+    corpus = sniff_corpus()
+    sniffer = PDFDownloader.file_sniffer
+    print(f"语料: {len(corpus)} 种文件头, 每种方式识别 {args.files:,} 次")
+    print(f"{'方式':<12}{'次/秒':>12}{'正确率':>10}")
+    print("-" * 34)
+    for label, sniff in (('legacy', legacy_sniff), ('indexed', sniffer.sniff)):
+        correct = sum(sniff(data) == extension for extension, data in corpus)
+        samples = [data for _, data in corpus] * (args.files // len(corpus) + 1)
+        samples = samples[:args.files]
+        start = time.perf_counter()
+        for data in samples:
+            sniff(data)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<12}{args.files / elapsed:>12,.0f}{correct / len(corpus):>10.0%}")
+    missed = [extension for extension, data in corpus if sniffer.sniff(data) != extension]
+    if missed:
+        print(f"未正确识别: {missed}")
+
+
+# 启动时检查是否被导入的重量级模块
+HEAVY_MODULES = ('openpyxl', 'numpy', 'pandas', 'asyncio', 'aiohttp')
+
+
+def start_first_request_server():
+    """
+    在本进程的线程中启动一个小型HTTP服务器，记录每个请求到达的时刻（time.perf_counter），
+    用来测量从启动程序到它发出第一个请求的时间。返回(服务器, base_url, 到达时刻列表)
+    """
+    hits = []
+    body = make_body(1024)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            hits.append(time.perf_counter())
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", hits
+
+
+def time_process(command, cwd, hits=None, stdin=None, timeout=120):
+    """
+    运行一次命令，返回从启动到进程结束的秒数；传入hits时返回从启动到第一个请求到达的秒数
+    （进程在第一个请求之后还要下载、打印统计，这部分不计入）
+    """
+    if hits is not None:
+        hits.clear()
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    try:
+        _, stderr = process.communicate(stdin, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise RuntimeError(f"{command[0]} 运行超过 {timeout} 秒")
+    end = time.perf_counter()
+    if process.returncode != 0 and not hits:
+        raise RuntimeError(f"{' '.join(command)} 失败: {stderr.decode(errors='replace')[-500:]}")
+    if hits is None:
+        return end - start
+    if not hits:
+        raise RuntimeError(f"{command[0]} 没有发出请求: {stderr.decode(errors='replace')[-500:]}")
+    return hits[0] - start
+
+
+def scenario_startup(args):
+    """启动耗时：导入模块、从启动到发出第一个请求，分别测试脚本和打包后的exe"""
+    server, base_url, hits = start_first_request_server()
+    workdir = tempfile.mkdtemp(prefix='startup_bench_')
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sheet = os.path.join(workdir, 'urls.xlsx')
+    write_sheet(sheet, [('first.pdf', f"{base_url}/first.pdf")])
+
+    # 导入后实际加载了哪些重量级模块
+    output = subprocess.run(
+        [sys.executable, '-c', f"import sys, pdf_downloader; print(' '.join("
+                               f"m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+        cwd=package_dir, capture_output=True, text=True, check=True).stdout.strip()
+    print(f"导入pdf_downloader后已加载的重量级模块: {output or '无'}")
+
+    script = (f"import pdf_downloader; pdf_downloader.PDFDownloader({os.path.join(workdir, 'script')!r}, "
+              f"verbosity='quiet').download_from_excel({sheet!r})")
+    cases = [
+        ('Python解释器启动', [sys.executable, '-c', 'pass'], package_dir, None, None),
+        ('导入pdf_downloader', [sys.executable, '-c', 'import pdf_downloader'], package_dir, None, None),
+        ('脚本: 启动到首个请求', [sys.executable, '-c', script], package_dir, hits, None),
+    ]
+    if args.exe:
+        # exe从所在目录读取urls.xlsx，下载完成后等待按回车退出
+        exe = os.path.join(workdir, os.path.basename(args.exe))
+        shutil.copy2(args.exe, exe)
+        shutil.copy2(sheet, os.path.join(workdir, 'urls.xlsx'))
+        cases.append(('exe: 启动到首个请求', [exe], workdir, hits, b'\n'))
+
+    print(f"每种方式运行 {args.files} 次")
+    print(f"{'方式':<24}{'中位数s':>10}{'最快s':>10}{'最慢s':>10}")
+    print("-" * 54)
+    try:
+        for label, command, cwd, case_hits, stdin in cases:
+            times = [time_process(command, cwd, case_hits, stdin) for _ in range(args.files)]
+            print(f"{label:<24}{statistics.median(times):>10.3f}{min(times):>10.3f}{max(times):>10.3f}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# 不使用共用模拟服务器的场景（不需要服务器，或者自行为每个负载启动服务器）
+LOCAL_SCENARIOS = {
+    'sniff': scenario_sniff,
+    'startup': scenario_startup,
+    'suite': scenario_suite,
+}
+
+
+SCENARIOS = {
+    'engines': scenario_engines,
+    'backpressure': scenario_backpressure,
+    'adaptive': scenario_adaptive,
+    'segmented': scenario_segmented,
+    'writepath': scenario_writepath,
+    'sharded': scenario_sharded,
+    'dns': scenario_dns,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载引擎基准测试")
+    parser.add_argument('scenario', nargs='?', default='engines', choices=sorted({**SCENARIOS, **LOCAL_SCENARIOS}),
+                        help="engines: 线程/异步引擎对比; backpressure: 大列表内存峰值对比; "
+                             "adaptive: 限流服务器下固定并发与自适应并发对比; "
+                             "segmented: 单连接限速时大文件分段下载对比; "
+                             "writepath: 大文件写入路径的吞吐量和CPU对比; "
+                             "sniff: 文件类型识别的速度和正确率; "
+                             "sharded: 本机多进程分片下载的总吞吐量; "
+                             "dns: 主机很多时DNS缓存和预热的效果; "
+                             "startup: 导入模块和从启动到发出第一个请求的耗时（脚本和exe）; "
+                             "suite: 各种负载下的回归基准，可输出JSON并与之前的结果对比")
+    parser.add_argument('--files', type=int,
+                        help="每个用例下载的文件数（engines默认2000，backpressure默认100000）；sniff场景为识别次数，"
+                             "startup场景为每种方式的运行次数")
+    parser.add_argument('--size', type=int, help="每个文件的大小(字节)，engines默认64KB，backpressure默认1KB")
+    parser.add_argument('--latency', type=float, help="服务器每个请求的响应延迟(秒)，engines默认0.2，backpressure默认0")
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        help="要测试的并发数，engines默认10 100 1000，backpressure默认16，"
+                             "adaptive默认2 8 32，segmented和writepath默认1")
+    parser.add_argument('--capacity', type=int,
+                        help="服务器同时处理的请求数上限，超出返回429（adaptive默认8，其他场景不限制）")
+    parser.add_argument('--bandwidth', type=int,
+                        help="服务器每个连接的带宽上限(字节/秒)（segmented默认8MB/s，其他场景不限制）")
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 4, 8],
+                        help="segmented场景要对比的分段数，默认1 4 8")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4],
+                        help="sharded场景要对比的进程数，默认1 2 4")
+    parser.add_argument('--engines', nargs='+', choices=['thread', 'async'],
+                        help="要对比的下载引擎，默认thread async（suite默认只测thread）")
+    parser.add_argument('--workloads', nargs='+', choices=list(SUITE_WORKLOADS), default=list(SUITE_WORKLOADS),
+                        help="suite场景要运行的负载，默认全部")
+    parser.add_argument('--modes', nargs='+', choices=['list', 'excel'], default=['list', 'excel'],
+                        help="suite场景的调用方式：list为download_from_list_with_names，excel为download_from_excel")
+    parser.add_argument('--json', help="suite场景：把结果保存为JSON文件")
+    parser.add_argument('--compare', help="suite场景：与之前用--json保存的结果对比")
+    parser.add_argument('--exe', help="startup场景：同时测试打包后的exe（如 dist/PDF_Downloader.exe）")
+    parser.add_argument('--hosts', type=int, default=500, help="dns场景：任务分布在多少个主机名上，默认500")
+    parser.add_argument('--dns-latency', type=float, default=0.03,
+                        help="dns场景：模拟解析器每次解析的耗时(秒)，默认0.03")
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    defaults = {
+        'engines': {'files': 2000, 'size': 64 * 1024, 'latency': 0.2, 'concurrency': [10, 100, 1000]},
+        'backpressure': {'files': 100000, 'size': 1024, 'latency': 0.0, 'concurrency': [16]},
+        'adaptive': {'files': 2000, 'size': 64 * 1024, 'latency': 0.1, 'concurrency': [2, 8, 32],
+                     'capacity': 8},
+        'segmented': {'files': 4, 'size': 64 * 1024 * 1024, 'latency': 0.0, 'concurrency': [1],
+                      'bandwidth': 8 * 1024 * 1024},
+        'writepath': {'files': 8, 'size': 256 * 1024 * 1024, 'latency': 0.0, 'concurrency': [1]},
+        'sniff': {'files': 200000},
+        'startup': {'files': 5},
+        'sharded': {'files': 20000, 'size': 16 * 1024, 'latency': 0.0, 'concurrency': [32]},
+        'dns': {'files': 2000, 'size': 16 * 1024, 'latency': 0.0, 'concurrency': [16]},
+        'suite': {'concurrency': [16], 'engines': ['thread']},
+    }[args.scenario]
+    defaults.setdefault('engines', ['thread', 'async'])
+    for name, value in defaults.items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+
+    if args.scenario in LOCAL_SCENARIOS:
+        LOCAL_SCENARIOS[args.scenario](args)
+        return
+
+    server, base_url = start_server(size=args.size, latency=args.latency, capacity=args.capacity,
+                                    bandwidth=args.bandwidth)
+    print(f"模拟服务器: {base_url} (文件大小 {args.size:,} bytes, 延迟 {args.latency}s"
+          f"{f', 处理能力 {args.capacity}' if args.capacity else ''}"
+          f"{f', 单连接带宽 {args.bandwidth / (1024 * 1024):.1f} MB/s' if args.bandwidth else ''})")
+    print_header()
+    try:
+        SCENARIOS[args.scenario](args, base_url)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
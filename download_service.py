@@ -0,0 +1,537 @@
+"""
+下载服务（常驻运行）
+
+直接运行 pdf_downloader.py 时，每一批下载都要重新启动进程、建立会话和连接。
+服务模式只创建一个下载器并一直运行，连接池中的keep-alive连接、自适应并发
+学到的各主机并发数、文件名索引等都保留下来，通过两种方式接收下载任务：
+
+HTTP接口（默认只监听本机）:
+    POST /jobs        提交任务，JSON: {"urls": [...]}、
+                      {"tasks": [{"url": ..., "filename": ...}, ...]}
+                      或 {"path": "服务器上的下载表路径"}，可选 "name"
+    GET  /jobs        全部任务的状态
+    GET  /jobs/<id>   一个任务的状态和进度；?wait=秒 等待任务完成，?results=1 附带每个文件的结果
+    GET  /status      服务整体的进度和指标
+    POST /shutdown    不再接收新任务，已提交的任务完成后退出
+
+收件箱文件夹（--inbox）:
+    放入下载表（.xlsx/.csv：文件名、URL两列；.txt 每行一个URL）后自动提交，
+    文件移到 收件箱/已提交/ 中，任务结束时在旁边写入 <表名>.result.json。
+
+所有任务共用同一个调度器：全局和单主机并发上限、限速、自适应并发对全部任务
+一起生效；各任务的输入轮流读取，先提交的大任务不会让后提交的小任务一直排队。
+文件都保存到同一个下载文件夹，重名时照常添加-1、-2等后缀。
+
+用法:
+    python download_service.py -o 下载目录 [--port 8765] [--inbox 收件箱] [--engine async]
+    curl -X POST http://127.0.0.1:8765/jobs -d '{"urls": ["https://example.com/a.pdf"]}'
+    curl "http://127.0.0.1:8765/jobs/1?wait=60"
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from pdf_downloader import (PDFDownloader, AsyncPDFDownloader, RetryPolicy, iter_spreadsheet_rows,
+                            iter_text_lines)
+
+ENGINES = {
+    'thread': PDFDownloader,
+    'async': AsyncPDFDownloader,
+}
+
+# 收件箱中会自动提交的文件类型
+INBOX_SUFFIXES = ('.xlsx', '.xlsm', '.csv', '.txt')
+SUBMITTED_DIR = "已提交"
+
+# GET /jobs/<id>?wait= 最多等待的秒数
+MAX_WAIT = 300.0
+
+
+def iter_file_tasks(downloader, path):
+    """
+    读取服务器上的下载表：.xlsx/.csv 第一列为文件名、第二列为URL（开启校验时第三列为哈希值），
+    其他文件每行一个URL
+
+    文件在调用时立即打开（打不开时马上抛出异常），数据行在调度线程中按需读取。
+
+    Returns:
+        (url, filename) 迭代器
+    """
+    if Path(path).suffix.lower() in ('.xlsx', '.xlsm', '.csv'):
+        return downloader.iter_named_tasks(iter_spreadsheet_rows(path))
+    return ((url, None) for url in iter_text_lines(path))
+
+
+class Job:
+    """
+    一次提交的下载任务组，记录进度和每个文件的结果
+
+    输入在下载器的调度线程中按需读取，结果也在调度线程中记录；
+    HTTP线程通过snapshot()读取状态。
+    """
+
+    def __init__(self, job_id, name, total=None):
+        self.id = job_id
+        self.name = name
+        self.total = total          # 文件总数，从下载表读取时为None（读完才知道）
+        self.state = 'queued'       # queued -> running -> finished
+        self.error = None           # 读取输入失败的原因
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.read = 0               # 已读入调度器的任务数
+        self.succeeded = 0
+        self.failed = 0
+        self.bytes = 0              # 成功下载的文件的总大小
+        self.results = []           # [(url, 成功标志, 文件路径或错误信息), ...]
+        self.on_finish = None       # 任务结束时调用 on_finish(job)
+        self.finished = threading.Event()
+        self._input_done = False
+        self._lock = threading.Lock()
+
+    def iter_tasks(self, tasks):
+        """包装输入：记录读入的任务数；读取出错时记录原因并结束这个任务的输入，不影响其他任务"""
+        try:
+            for url, filename in tasks:
+                with self._lock:
+                    if self.state == 'queued':
+                        self.state = 'running'
+                        self.started_at = time.time()
+                    self.read += 1
+                yield url, filename
+        except Exception as e:
+            self.error = f"读取任务失败: {str(e)}"
+        with self._lock:
+            self._input_done = True
+            if self.total is None or self.read < self.total:
+                self.total = self.read
+        self._check_finished()
+
+    def on_result(self, url, success, result):
+        size = 0
+        if success:
+            try:
+                size = os.path.getsize(result)
+            except OSError:
+                pass
+        with self._lock:
+            if success:
+                self.succeeded += 1
+                self.bytes += size
+            else:
+                self.failed += 1
+            self.results.append((url, success, str(result)))
+        self._check_finished()
+
+    def _check_finished(self):
+        with self._lock:
+            if self.finished.is_set() or not self._input_done or self.succeeded + self.failed < self.read:
+                return
+            self.state = 'finished'
+            self.finished_at = time.time()
+            if self.started_at is None:
+                self.started_at = self.finished_at
+        if self.on_finish:
+            self.on_finish(self)
+        self.finished.set()
+
+    def snapshot(self, results=False):
+        """
+        任务的状态和进度
+
+        Args:
+            results (bool): 是否附带每个文件的结果，否则只附带失败的文件
+        """
+        with self._lock:
+            done = self.succeeded + self.failed
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            status = {
+                'id': self.id,
+                'name': self.name,
+                'state': self.state,
+                'error': self.error,
+                'submitted_at': self.submitted_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'files_total': self.total,
+                'files_read': self.read,
+                'files_succeeded': self.succeeded,
+                'files_failed': self.failed,
+                'files_remaining': self.total - done if self.total is not None else None,
+                'bytes': self.bytes,
+                'elapsed_seconds': round(elapsed, 3),
+                'files_per_second': round(done / elapsed, 2) if elapsed else 0.0,
+            }
+            if results:
+                status['results'] = [{'url': url, 'success': success, 'result': result}
+                                     for url, success, result in self.results]
+            else:
+                status['failures'] = [{'url': url, 'error': result}
+                                      for url, success, result in self.results if not success]
+        return status
+
+
+class DownloadService:
+    """
+    常驻的下载服务：一个下载器、一个持续运行的调度循环，接收任意多个任务组
+
+    调度循环在单独的线程中运行，submit()可以在任何线程中调用。
+    """
+
+    def __init__(self, downloader, keep_jobs=1000):
+        """
+        Args:
+            downloader (PDFDownloader): 下载器，整个服务期间一直使用
+            keep_jobs (int): 最多保留多少个已结束任务的状态，更早的任务状态被丢弃
+        """
+        self.downloader = downloader
+        self.keep_jobs = keep_jobs
+        self.jobs = OrderedDict()
+        self.started_at = None
+        self.stopped = threading.Event()
+        self.accepting = True
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._run = downloader.create_run()
+        self._run.open = True
+        self._thread = threading.Thread(target=self._serve, name='download-service', daemon=True)
+
+    def start(self):
+        self.started_at = time.time()
+        self.downloader.begin_batch()
+        self._thread.start()
+
+    def _serve(self):
+        try:
+            self.downloader.execute_run(self._run)
+        finally:
+            self.downloader.end_batch()
+            self.stopped.set()
+
+    def submit(self, tasks, name=None, total=None, on_finish=None):
+        """
+        提交一组任务，立即返回，任务在调度线程中与其他任务一起下载
+
+        Args:
+            tasks: (url, filename) 迭代器，filename为None时从URL提取文件名
+            name (str): 任务名称，显示在状态中
+            total (int): 任务数，未知时为None
+            on_finish: 任务结束时在调度线程中调用的函数 on_finish(job)
+
+        Returns:
+            Job: 新的任务
+        """
+        with self._lock:
+            if not self.accepting:
+                raise RuntimeError("服务正在停止，不再接收新任务")
+            job_id = str(next(self._ids))
+            job = Job(job_id, name or f"任务{job_id}", total)
+            job.on_finish = self._finished_callback(on_finish)
+            self.jobs[job_id] = job
+        self.downloader.events.emit(
+            'job_submitted', f"📥 收到任务 {job.id}: {job.name}" + (f" ({total} 个文件)" if total is not None else ""),
+            job=job.id, name=job.name, total=total)
+        self._run.add_tasks(job.iter_tasks(tasks), job.on_result)
+        return job
+
+    def _finished_callback(self, on_finish):
+        def finished(job):
+            self.downloader.events.emit(
+                'job_finished', f"📦 任务 {job.id} 完成: {job.name}，成功 {job.succeeded} 个，失败 {job.failed} 个"
+                + (f"（{job.error}）" if job.error else ""),
+                job=job.id, succeeded=job.succeeded, failed=job.failed, error=job.error)
+            self._prune_jobs()
+            if on_finish:
+                on_finish(job)
+        return finished
+
+    def _prune_jobs(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished.is_set()]
+            for job_id in finished[:max(len(finished) - self.keep_jobs, 0)]:
+                del self.jobs[job_id]
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.snapshot() for job in jobs]
+
+    def status(self):
+        """服务整体的状态：下载器的进度和指标、各状态的任务数、连接复用情况"""
+        with self._lock:
+            states = [job.state for job in self.jobs.values()]
+        stats = self.downloader.connection_stats
+        status = self.downloader.progress_snapshot(self._run)
+        status.update({
+            'accepting': self.accepting,
+            'uptime_seconds': round(time.time() - self.started_at, 3) if self.started_at else 0.0,
+            'jobs': {state: states.count(state) for state in ('queued', 'running', 'finished')},
+            'connections_opened': stats.opened,
+            'connections_reused': stats.reused,
+        })
+        return status
+
+    def shutdown(self):
+        """不再接收新任务，已提交的任务全部完成后调度循环结束（不等待，用stopped等待）"""
+        with self._lock:
+            self.accepting = False
+        self._run.close_input()
+
+
+class InboxWatcher:
+    """
+    定时检查收件箱文件夹，把新放入的下载表提交给服务
+
+    文件最后修改超过settle秒才提交，避免读到还在复制中的文件。
+    """
+
+    def __init__(self, service, inbox, interval=2.0, settle=1.0):
+        self.service = service
+        self.inbox = Path(inbox)
+        self.submitted_dir = self.inbox / SUBMITTED_DIR
+        self.interval = interval
+        self.settle = settle
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name='inbox', daemon=True)
+        self.submitted_dir.mkdir(parents=True, exist_ok=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _watch(self):
+        while not self._stop.is_set() and self.service.accepting:
+            self.scan()
+            self._stop.wait(self.interval)
+
+    def scan(self):
+        """提交收件箱中已经写完的下载表，返回提交的任务列表"""
+        jobs = []
+        now = time.time()
+        for path in sorted(self.inbox.iterdir()):
+            if (not path.is_file() or path.suffix.lower() not in INBOX_SUFFIXES
+                    or path.name.startswith(('.', '~$'))):
+                continue
+            try:
+                if now - path.stat().st_mtime < self.settle:
+                    continue
+                target = self._submitted_path(path.name)
+                os.replace(path, target)
+            except OSError:
+                continue
+            try:
+                tasks = iter_file_tasks(self.service.downloader, target)
+            except Exception as e:
+                print(f"❌ 无法读取收件箱中的 {path.name}: {str(e)}")
+                continue
+            try:
+                jobs.append(self.service.submit(tasks, path.name, on_finish=self._write_result(target)))
+            except RuntimeError:
+                break
+        return jobs
+
+    def _submitted_path(self, name):
+        target = self.submitted_dir / name
+        counter = 1
+        while target.exists():
+            target = self.submitted_dir / f"{Path(name).stem}-{counter}{Path(name).suffix}"
+            counter += 1
+        return target
+
+    @staticmethod
+    def _write_result(target):
+        def write(job):
+            result_path = target.with_name(f"{target.name}.result.json")
+            temp_file = Path(f"{result_path}.tmp")
+            temp_file.write_text(json.dumps(job.snapshot(results=True), ensure_ascii=False, indent=1),
+                                 encoding='utf-8')
+            os.replace(temp_file, result_path)
+        return write
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """下载服务的HTTP/JSON接口，service由ServiceHTTPServer提供"""
+
+    server_version = "pdf-downloader"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        service = self.server.service
+        if parts == ['status']:
+            self._send_json(200, service.status())
+        elif parts == ['jobs']:
+            self._send_json(200, {'jobs': service.list_jobs()})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = service.get_job(parts[1])
+            if job is None:
+                self._send_json(404, {'error': f"任务不存在: {parts[1]}"})
+                return
+            try:
+                wait = float(query.get('wait', ['0'])[0])
+            except ValueError:
+                self._send_json(400, {'error': "wait必须是秒数"})
+                return
+            if wait > 0:
+                job.finished.wait(min(wait, MAX_WAIT))
+            results = query.get('results', ['0'])[0] not in ('0', '', 'false')
+            self._send_json(200, job.snapshot(results))
+        else:
+            self._send_json(404, {'error': f"未知的路径: {url.path}"})
+
+    def do_POST(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        service = self.server.service
+        if parts == ['shutdown']:
+            service.shutdown()
+            self._send_json(202, {'accepting': False})
+            return
+        if parts != ['jobs']:
+            self._send_json(404, {'error': f"未知的路径: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            tasks, total, name = self._parse_job(body)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            job = service.submit(tasks, name, total)
+        except RuntimeError as e:
+            self._send_json(503, {'error': str(e)})
+            return
+        self._send_json(202, job.snapshot())
+
+    def _parse_job(self, body):
+        """
+        检查提交的任务
+
+        Returns:
+            tuple: ((url, filename) 迭代器, 任务数或None, 任务名称)
+        """
+        if not isinstance(body, dict):
+            raise ValueError("请求内容必须是JSON对象")
+        name = body.get('name')
+        if 'urls' in body:
+            urls = body['urls']
+            if not isinstance(urls, list) or not all(isinstance(url, str) and url.strip() for url in urls):
+                raise ValueError("urls必须是URL字符串列表")
+            return [(url.strip(), None) for url in urls], len(urls), name
+        if 'tasks' in body:
+            tasks = []
+            for task in body['tasks']:
+                if not isinstance(task, dict) or not isinstance(task.get('url'), str) or not task['url'].strip():
+                    raise ValueError("tasks中的每一项必须是带url的对象")
+                filename = task.get('filename')
+                if filename is not None:
+                    filename = str(filename).strip() or None
+                tasks.append((task['url'].strip(), filename))
+            return tasks, len(tasks), name
+        if 'path' in body:
+            path = Path(str(body['path']))
+            if not path.is_file():
+                raise ValueError(f"文件不存在: {path}")
+            try:
+                tasks = iter_file_tasks(self.server.service.downloader, path)
+            except Exception as e:
+                raise ValueError(f"无法读取 {path}: {str(e)}")
+            return tasks, None, name or path.name
+        raise ValueError("需要提供urls、tasks或path之一")
+
+    def _send_json(self, status, data):
+        content = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # 不逐个输出访问日志，任务的进度见下载器的输出和 /jobs
+        pass
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻下载服务（本机HTTP接口和收件箱文件夹）")
+    parser.add_argument('-o', '--output', required=True, help="下载文件夹")
+    parser.add_argument('--host', default='127.0.0.1', help="HTTP接口监听的地址，默认只允许本机访问")
+    parser.add_argument('--port', type=int, default=8765, help="HTTP接口端口，0表示自动选择")
+    parser.add_argument('--inbox', help="收件箱文件夹，放入的下载表自动提交")
+    parser.add_argument('--poll', type=float, default=2.0, help="检查收件箱的间隔（秒）")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='thread', help="下载引擎")
+    parser.add_argument('--workers', type=int, default=16, help="全部任务合计的并发下载数上限")
+    parser.add_argument('--per-host', type=int, help="每个主机的并发下载数上限")
+    parser.add_argument('--adaptive', action='store_true', help="按主机自适应调整并发数")
+    parser.add_argument('--verify', action='store_true', help="校验下载的文件，不完整时重新下载")
+    parser.add_argument('--warmup', action='store_true', help="每个任务开始前先解析全部主机，并为最忙的主机预先建立连接")
+    parser.add_argument('--retries', type=int, default=3, help="每个文件最多尝试几次")
+    parser.add_argument('--verbosity', choices=['quiet', 'normal', 'verbose'], default='normal', help="输出详细程度")
+    args = parser.parse_args()
+
+    downloader = ENGINES[args.engine](
+        download_folder=args.output,
+        max_workers=args.workers,
+        max_per_host=args.per_host,
+        adaptive=args.adaptive,
+        verify=args.verify,
+        warmup=args.warmup,
+        retry_policy=RetryPolicy(max_attempts=args.retries),
+        verbosity=args.verbosity,
+    )
+    service = DownloadService(downloader)
+    server = ServiceHTTPServer((args.host, args.port), service)
+    service.start()
+    threading.Thread(target=server.serve_forever, name='http', daemon=True).start()
+    host, port = server.server_address[:2]
+    print(f"🚀 下载服务已启动: http://{host}:{port}/ ，保存目录: {downloader.download_folder.absolute()}")
+    downloader.print_concurrency()
+
+    watcher = None
+    if args.inbox:
+        watcher = InboxWatcher(service, args.inbox, args.poll)
+        watcher.start()
+        print(f"📂 收件箱: {watcher.inbox.absolute()}")
+
+    try:
+        while not service.stopped.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        print("\n⏹️  停止接收新任务，等待已提交的任务完成（再按一次Ctrl+C立即退出）...")
+        service.shutdown()
+        service.stopped.wait()
+    finally:
+        if watcher:
+            watcher.stop()
+        server.shutdown()
+        server.server_close()
+    downloader.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,24 +4,2207 @@ from urllib.parse import urlparse, unquote
 import time
 from pathlib import Path
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import pandas as pd
+import sqlite3
+import hashlib
+import shutil
+import socket
+import tarfile
+import tempfile
+import zipfile
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+import csv
+import itertools
+import struct
+import queue
+import json
+import atexit
+import heapq
+import mmap
+import random
+import contextvars
+from email.utils import parsedate_to_datetime
 import sys
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError, ProtocolError, ReadTimeoutError, SSLError
+
+# openpyxl（会连带导入numpy）和asyncio只在读取Excel、使用异步引擎时才导入，
+# 让程序（尤其是打包后的exe）启动时不必先加载它们
+
+
+class ConnectionStats:
+    """统计新建连接数和连接复用次数（线程安全）"""
+    
+    def __init__(self):
+        self.opened = 0      # 新建的TCP/TLS连接数
+        self.checkouts = 0   # 从连接池取连接的次数（每个请求一次）
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+    
+    def record_open(self):
+        with self._lock:
+            self.opened += 1
+    
+    def record_connect_time(self, seconds, dns_seconds=0.0):
+        """
+        记录当前线程新建连接花费的时间
+        
+        Args:
+            seconds (float): TCP/TLS握手的时间（不使用DNS缓存时也包含DNS解析）
+            dns_seconds (float): 通过DNS缓存解析主机名的时间
+        """
+        local = self._local
+        local.connect_seconds = getattr(local, 'connect_seconds', 0.0) + seconds
+        local.dns_seconds = getattr(local, 'dns_seconds', 0.0) + dns_seconds
+    
+    def take_connect_time(self):
+        """
+        取出并清零当前线程累计的建立连接时间
+        
+        Returns:
+            tuple: (DNS解析秒数, TCP/TLS握手秒数)
+        """
+        local = self._local
+        seconds = (getattr(local, 'dns_seconds', 0.0), getattr(local, 'connect_seconds', 0.0))
+        local.dns_seconds = local.connect_seconds = 0.0
+        return seconds
+    
+    @property
+    def reused(self):
+        """复用已有keep-alive连接的次数"""
+        return max(self.checkouts - self.opened, 0)
+
+
+class DNSCache:
+    """
+    进程内的DNS解析缓存（线程安全）
+    
+    requests每新建一个连接都要在工作线程中调用一次阻塞的getaddrinfo，URL列表中
+    主机很多时，每个文件都要多等几十毫秒。这里把解析结果缓存ttl秒（系统接口不返回
+    记录的TTL，统一使用固定时间），解析失败的主机也缓存negative_ttl秒；
+    同一个主机同时只解析一次，其他线程等待这次的结果。
+    """
+    
+    def __init__(self, ttl=300.0, negative_ttl=10.0, resolver=None):
+        """
+        Args:
+            ttl (float): 解析结果缓存的秒数
+            negative_ttl (float): 解析失败缓存的秒数
+            resolver: 实际解析的函数，参数与返回值同socket.getaddrinfo，默认为socket.getaddrinfo
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.resolver = resolver or socket.getaddrinfo
+        self.hits = 0             # 直接使用缓存的次数
+        self.lookups = 0          # 实际解析的次数
+        self.lookup_seconds = 0.0  # 实际解析累计用时
+        self._entries = {}   # (主机, 端口, 地址族) -> (过期时刻, getaddrinfo结果或解析错误)
+        self._pending = {}   # 正在解析的键 -> threading.Event
+        self._lock = threading.Lock()
+    
+    def cached(self, host, port, family=0):
+        """只查缓存，没有未过期的结果时返回None（解析失败的结果照常抛出异常）"""
+        with self._lock:
+            entry = self._entries.get((host.lower(), port, family))
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self.hits += 1
+        return self._result(entry[1])
+    
+    def getaddrinfo(self, host, port, family=0):
+        """
+        解析主机名，相当于socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        
+        Returns:
+            list: [(地址族, 套接字类型, 协议, 规范名, 地址), ...]
+        """
+        key = (host.lower(), port, family)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return self._result(entry[1])
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    break
+            # 其他线程正在解析这个主机，等它的结果
+            event.wait()
+        
+        start = time.perf_counter()
+        result, ttl = None, 0.0
+        try:
+            result = self.resolver(host, port, family, socket.SOCK_STREAM)
+            ttl = self.ttl
+        except socket.gaierror as e:
+            result, ttl = e, self.negative_ttl
+        finally:
+            with self._lock:
+                self.lookups += 1
+                self.lookup_seconds += time.perf_counter() - start
+                if result is not None:
+                    self._entries[key] = (time.monotonic() + ttl, result)
+                del self._pending[key]
+            event.set()
+        return self._result(result)
+    
+    @staticmethod
+    def _result(result):
+        if isinstance(result, socket.gaierror):
+            # 每次抛出新的异常，不让缓存的异常对象累积各次的调用栈
+            raise socket.gaierror(*result.args)
+        return result
+    
+    def resolve_many(self, hosts, workers=32):
+        """
+        并发解析多个主机
+        
+        Args:
+            hosts: (主机, 端口) 列表
+            workers (int): 最多同时解析几个
+        
+        Returns:
+            dict: 解析失败的 (主机, 端口) -> 错误信息
+        """
+        def resolve(address):
+            try:
+                self.getaddrinfo(*address)
+            except OSError as e:
+                return address, str(e)
+            return address, None
+        
+        hosts = list(hosts)
+        if not hosts:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(workers, len(hosts)), thread_name_prefix='dns') as executor:
+            return {address: error for address, error in executor.map(resolve, hosts) if error is not None}
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """记录连接新建/复用次数的HTTPAdapter，提供dns_cache时新建连接用缓存解析主机名"""
+    
+    def __init__(self, stats, dns_cache=None, **kwargs):
+        # 父类__init__会调用init_poolmanager，需要先设置stats
+        self.connection_stats = stats
+        self.dns_cache = dns_cache
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.connection_stats
+        dns_cache = self.dns_cache
+        
+        def connect_cached(conn, connect):
+            """
+            用缓存解析的地址建立连接，返回解析用时
+            
+            只替换实际连接的地址（_dns_host），Host请求头和TLS的SNI、证书校验仍使用原主机名；
+            有多个地址时和urllib3一样依次尝试
+            """
+            host = conn._dns_host
+            start = time.perf_counter()
+            try:
+                addresses = dns_cache.getaddrinfo(host.strip('[]'), conn.port)
+            except socket.gaierror as e:
+                raise NewConnectionError(conn, f"Failed to resolve '{host}' ({e})") from e
+            dns_seconds = time.perf_counter() - start
+            if not addresses:
+                raise NewConnectionError(conn, f"Failed to resolve '{host}' (no addresses)")
+            try:
+                for index, (_, _, _, _, sockaddr) in enumerate(addresses):
+                    conn._dns_host = sockaddr[0]
+                    try:
+                        connect()
+                        break
+                    except ConnectTimeoutError:  # NewConnectionError是它的子类
+                        if index == len(addresses) - 1:
+                            raise
+            finally:
+                conn._dns_host = host
+            return dns_seconds
+        
+        class CountingMixin:
+            def _get_conn(self, timeout=None):
+                stats.record_checkout()
+                return super()._get_conn(timeout=timeout)
+            
+            def _new_conn(self):
+                stats.record_open()
+                conn = super()._new_conn()
+                connect = conn.connect
+                
+                def timed_connect():
+                    start = time.perf_counter()
+                    dns_seconds = 0.0
+                    try:
+                        if dns_cache is None:
+                            connect()
+                        else:
+                            dns_seconds = connect_cached(conn, connect)
+                    finally:
+                        stats.record_connect_time(time.perf_counter() - start - dns_seconds, dns_seconds)
+                
+                conn.connect = timed_connect
+                return conn
+        
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CountingHTTPConnectionPool', (CountingMixin, HTTPConnectionPool), {}),
+            'https': type('CountingHTTPSConnectionPool', (CountingMixin, HTTPSConnectionPool), {}),
+        }
+
+
+class EventLog:
+    """
+    下载过程中的消息、事件和指标输出
+    
+    下载线程只把消息和事件放入队列，由一个后台线程统一打印（按verbosity过滤）、
+    写JSON Lines事件日志，并在批量下载期间定期输出进度、更新Prometheus文本格式
+    的指标文件。下载线程不再为抢占stdout互相等待，也不会被终端输出拖慢。
+    """
+    
+    ERROR = 0   # 失败等必须显示的消息
+    INFO = 1    # 每个文件完成、重试、并发调整等
+    DEBUG = 2   # 类型检测、文件名修正等细节
+    VERBOSITY = {'quiet': ERROR, 'normal': INFO, 'verbose': DEBUG}
+    
+    def __init__(self, verbosity='normal', event_log=None, metrics_file=None,
+                 progress_interval=10.0, snapshot=None):
+        """
+        Args:
+            verbosity (str): 'quiet'只显示错误，'normal'每个文件一行，'verbose'显示全部细节
+            event_log (str): JSON Lines事件日志的文件路径，为None时不记录
+            metrics_file (str): Prometheus文本格式的指标文件路径（可由node_exporter的
+                textfile收集器读取），为None时不输出
+            progress_interval (float): 批量下载时输出进度、更新指标文件的间隔（秒），0表示不输出
+            snapshot: 返回当前进度和指标字典的函数，见PDFDownloader.progress_snapshot()
+        """
+        if verbosity not in self.VERBOSITY:
+            raise ValueError(f"verbosity必须是 {', '.join(self.VERBOSITY)} 之一")
+        self.level = self.VERBOSITY[verbosity]
+        self.event_log = event_log
+        self.metrics_file = metrics_file
+        self.progress_interval = progress_interval
+        self.snapshot = snapshot
+        self.batch_active = False
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._log_file = None
+    
+    def emit(self, event=None, message=None, level=INFO, **fields):
+        """
+        输出一条消息和/或一个事件
+        
+        Args:
+            event (str): 事件名，写入事件日志；为None时只打印消息
+            message (str): 要打印的消息，级别高于verbosity时不打印
+            level (int): 消息级别 ERROR/INFO/DEBUG
+            **fields: 事件的字段
+        """
+        if level > self.level:
+            message = None
+        if not self.event_log:
+            event = None
+        if message is None and event is None:
+            return
+        self._start()
+        self._queue.put((time.time(), event, message, fields))
+    
+    def flush(self):
+        """等待已放入队列的消息全部输出，并更新指标文件"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+    
+    def close(self):
+        self.flush()
+        if self._log_file:
+            self._log_file.close()
+            self._log_file = None
+    
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                if self.event_log:
+                    self._log_file = open(self.event_log, 'a', encoding='utf-8')
+                self._thread = threading.Thread(target=self._run, name="EventLog", daemon=True)
+                self._thread.start()
+                # 后台线程是守护线程，程序退出前把剩余的消息输出完
+                atexit.register(self.close)
+    
+    def _run(self):
+        interval = self.progress_interval
+        next_report = time.monotonic() + interval if interval else None
+        while True:
+            timeout = max(0.0, next_report - time.monotonic()) if next_report else None
+            try:
+                items = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                items = []
+            # 一次取出队列中的全部消息，合并成一次写入
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            lines = []
+            waiters = []
+            for item in items:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    continue
+                timestamp, event, message, fields = item
+                if message is not None:
+                    lines.append(message)
+                if event is not None:
+                    self._write_event(timestamp, event, fields)
+            
+            if next_report and time.monotonic() >= next_report:
+                next_report = time.monotonic() + interval
+                if self.batch_active:
+                    lines.extend(self._report_progress())
+            if waiters:
+                self._write_metrics()
+            
+            if lines:
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
+            if self._log_file:
+                self._log_file.flush()
+            for waiter in waiters:
+                waiter.set()
+    
+    def _write_event(self, timestamp, event, fields):
+        record = {'time': round(timestamp, 3), 'event': event}
+        record.update(fields)
+        self._log_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    
+    def _report_progress(self):
+        """输出一次进度，返回要打印的行"""
+        if self.snapshot is None:
+            return []
+        status = self.snapshot()
+        if self._log_file:
+            self._write_event(time.time(), 'progress', status)
+        self._write_metrics(status)
+        if self.level < self.INFO:
+            return []
+        
+        done = status['files_succeeded'] + status['files_failed']
+        total = status['files_total']
+        line = (f"📊 进度: 已完成 {done}{f'/{total}' if total is not None else ''} 个文件"
+                f" (失败 {status['files_failed']}), 进行中 {status['files_in_progress']}, "
+                f"已下载 {status['bytes_downloaded'] / (1024 * 1024):.1f} MB, "
+                f"{status['bytes_per_second'] / (1024 * 1024):.2f} MB/秒")
+        if status['eta_seconds'] is not None:
+            line += f", 剩余约 {status['files_remaining']} 个文件"
+            if status['bytes_remaining'] is not None:
+                line += f" / {status['bytes_remaining'] / (1024 * 1024):.0f} MB"
+            line += f", 预计还需 {format_duration(status['eta_seconds'])}"
+        return [line]
+    
+    def _write_metrics(self, status=None):
+        """把指标写成Prometheus文本格式（先写临时文件再替换，读取方不会读到一半的内容）"""
+        if not self.metrics_file or self.snapshot is None:
+            return
+        status = status or self.snapshot()
+        metrics = [
+            ('pdf_downloader_files_total', 'counter', "完成的文件数",
+             [('{result="success"}', status['files_succeeded']), ('{result="failed"}', status['files_failed'])]),
+            ('pdf_downloader_files_in_progress', 'gauge', "正在下载的文件数",
+             [('', status['files_in_progress'])]),
+            ('pdf_downloader_bytes_total', 'counter', "从网络下载的字节数",
+             [('', status['bytes_downloaded'])]),
+            ('pdf_downloader_requests_total', 'counter', "发出的HTTP请求数",
+             [('', status['requests'])]),
+            ('pdf_downloader_retries_total', 'counter', "失败重试次数",
+             [('', status['retries'])]),
+            ('pdf_downloader_throttled_seconds_total', 'counter', "因限速累计等待的秒数（各下载合计）",
+             [('', status['throttled_seconds'])]),
+            ('pdf_downloader_throughput_bytes_per_second', 'gauge', "本批下载的平均速度",
+             [('', status['bytes_per_second'])]),
+            ('pdf_downloader_phase_seconds', 'summary', "各阶段耗时：DNS解析、建立连接(TCP/TLS)、首字节、传输",
+             [(f'_sum{{phase="{phase}"}}', seconds) for phase, seconds in status['phase_seconds'].items()]
+             + [(f'_count{{phase="{phase}"}}', status['timed_files']) for phase in status['phase_seconds']]),
+        ]
+        if status['files_remaining'] is not None:
+            metrics.append(('pdf_downloader_files_remaining', 'gauge', "剩余的文件数",
+                            [('', status['files_remaining'])]))
+        if status['eta_seconds'] is not None:
+            metrics.append(('pdf_downloader_eta_seconds', 'gauge', "预计剩余时间",
+                            [('', status['eta_seconds'])]))
+        
+        lines = []
+        for name, metric_type, help_text, samples in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+        temp_file = f"{self.metrics_file}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_file, self.metrics_file)
+
+
+def format_duration(seconds):
+    """把秒数格式化为 1小时2分3秒 的形式"""
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}小时{minutes}分{seconds}秒"
+    if minutes:
+        return f"{minutes}分{seconds}秒"
+    return f"{seconds}秒"
+
+
+class HostScheduler:
+    """
+    按主机轮转分发待下载任务
+    
+    同时限制全局和每个主机的进行中任务数。某个主机达到上限时跳过它，
+    继续分发其他主机的任务，这样一个域名占多数的列表不会饿死其他域名，
+    也不会因为同时打开过多连接被目标服务器封禁。
+    本类只做记账，不创建线程，线程引擎和异步引擎共用。分段下载的额外连接
+    在工作线程中用acquire_extra()占用名额，因此分发和释放都在锁内进行。
+    """
+    
+    def __init__(self, max_active, max_per_host=None):
+        """
+        Args:
+            max_active (int): 全局最多同时进行的任务数
+            max_per_host (int): 每个主机最多同时进行的任务数，None表示不限制
+        """
+        self.max_active = max_active
+        self.max_per_host = max_per_host
+        self.host_limits = {}       # 主机 -> 单独设置的并发上限（覆盖max_per_host）
+        self.host_ready = None      # 可选的 host_ready(主机) -> 是否可以分发，用于请求速率限制
+        self.active = 0
+        self.pending = 0            # 待分发任务总数
+        self._pending = {}          # 主机 -> 待分发任务队列
+        self._active_per_host = {}  # 主机 -> 进行中任务数
+        self._hosts = deque()       # 有待分发任务的主机，按轮转顺序排列
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def host_of(url):
+        return urlparse(url).netloc.lower()
+    
+    def add(self, url, task):
+        """加入一个待分发任务"""
+        host = self.host_of(url)
+        if host not in self._pending:
+            self._pending[host] = deque()
+            self._hosts.append(host)
+        self._pending[host].append(task)
+        self.pending += 1
+    
+    def has_pending(self):
+        return bool(self._hosts)
+    
+    def pending_hosts(self):
+        """有待分发任务的主机"""
+        return list(self._hosts)
+    
+    def pop_ready(self):
+        """
+        取出下一个可以开始的任务，并计入进行中
+        
+        Returns:
+            (host, task)，没有可开始的任务时返回None
+        """
+        with self._lock:
+            return self._pop_ready()
+    
+    def _pop_ready(self):
+        if self.active >= self.max_active:
+            return None
+        for _ in range(len(self._hosts)):
+            host = self._hosts[0]
+            self._hosts.rotate(-1)
+            limit = self.host_limits.get(host, self.max_per_host)
+            if limit and self._active_per_host.get(host, 0) >= limit:
+                continue
+            if self.host_ready is not None and not self.host_ready(host):
+                continue
+            queue = self._pending[host]
+            task = queue.popleft()
+            self.pending -= 1
+            if not queue:
+                del self._pending[host]
+                self._hosts.remove(host)
+            self._active_per_host[host] = self._active_per_host.get(host, 0) + 1
+            self.active += 1
+            return host, task
+        return None
+    
+    def release(self, host, count=1):
+        """标记某个主机的count个任务（或额外名额）已结束"""
+        with self._lock:
+            self.active -= count
+            remaining = self._active_per_host[host] - count
+            if remaining:
+                self._active_per_host[host] = remaining
+            else:
+                del self._active_per_host[host]
+    
+    def acquire_extra(self, host, wanted):
+        """
+        为进行中的任务额外占用同一主机最多wanted个名额（分段下载的额外连接），
+        不超过全局和这个主机（含自适应并发设置）的剩余名额，用完后用release(host, count)归还
+        
+        Returns:
+            int: 实际占用的名额数
+        """
+        with self._lock:
+            free = self.max_active - self.active
+            limit = self.host_limits.get(host, self.max_per_host)
+            if limit:
+                free = min(free, limit - self._active_per_host.get(host, 0))
+            granted = max(0, min(wanted, free))
+            if granted:
+                self.active += granted
+                self._active_per_host[host] = self._active_per_host.get(host, 0) + granted
+            return granted
+
+
+class AdaptiveConcurrency:
+    """
+    按主机自适应调整并发数（AIMD）
+    
+    每个主机从较低的并发数开始，先成倍增加（慢启动），吞吐量不再增长后
+    改为每轮加1。遇到限流（429/503）、超时或连接错误时并发数乘以0.7；
+    耗时明显变长而吞吐量没有增长时（请求已经在服务器排队）减1。
+    每完成"当前并发数"个任务评估一轮，调整结果写入调度器的单主机上限。
+    """
+    
+    # 说明服务器已经过载的失败原因
+    CONGESTION_REASONS = frozenset({"HTTP 429", "HTTP 503", "超时", "连接错误"})
+    
+    def __init__(self, scheduler, max_limit, initial=2, min_limit=1,
+                 decrease_factor=0.7, latency_tolerance=1.5, min_gain=0.05, events=None):
+        """
+        Args:
+            scheduler (HostScheduler): 要调整单主机上限的调度器
+            max_limit (int): 单主机并发数上限
+            initial (int): 每个主机的初始并发数
+            min_limit (int): 单主机并发数下限
+            decrease_factor (float): 遇到限流或错误时并发数乘以的系数
+            latency_tolerance (float): 平均耗时超过最短耗时的多少倍视为服务器开始排队
+            min_gain (float): 吞吐量至少增长多少比例才算增加并发有效
+            events (EventLog): 输出调整记录，为None时直接打印
+        """
+        self.scheduler = scheduler
+        self.events = events
+        self.max_limit = max(max_limit, min_limit)
+        self.initial = max(min(initial, self.max_limit), min_limit)
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.min_gain = min_gain
+        self._hosts = {}
+    
+    def limit_of(self, host):
+        """主机当前的并发上限"""
+        return self.scheduler.host_limits.get(host, self.initial)
+    
+    @property
+    def limits(self):
+        """各主机当前的并发上限"""
+        return {host: self.limit_of(host) for host in self._hosts}
+    
+    def watch(self, host):
+        """开始跟踪一个主机（它的第一个任务分发之前调用）"""
+        if host not in self._hosts:
+            self._hosts[host] = _HostWindow()
+            self.scheduler.host_limits[host] = self.initial
+    
+    def observe(self, host, started, success, reason=None, size=0):
+        """
+        记录一个任务的结果，必要时调整该主机的并发数
+        
+        Args:
+            host (str): 任务所属主机
+            started (float): 任务开始时的time.monotonic()
+            success (bool): 是否成功
+            reason (str): 失败原因
+            size (int): 下载的字节数
+        """
+        self.watch(host)
+        state = self._hosts[host]
+        now = time.monotonic()
+        limit = self.limit_of(host)
+        
+        if not success and reason in self.CONGESTION_REASONS:
+            # 调整之前就已经开始的请求反映的是旧的并发数，不再重复减少
+            if started >= state.window_start:
+                state.slow_start = False
+                self._set_limit(host, int(limit * self.decrease_factor), f"{reason}，降低")
+                state.reset(now)
+            return
+        
+        state.completed += 1
+        state.bytes += size
+        state.latency += now - started
+        if state.completed < limit:
+            return
+        
+        # 评估这一轮
+        throughput = (state.bytes or state.completed) / max(now - state.window_start, 1e-6)
+        latency = state.latency / state.completed
+        state.min_latency = min(state.min_latency, latency)
+        improved = state.throughput is None or throughput >= state.throughput * (1 + self.min_gain)
+        if state.slow_start:
+            if improved:
+                new_limit, why = limit * 2, "慢启动"
+            else:
+                state.slow_start = False
+                new_limit, why = limit - 1, "吞吐量不再增长"
+        elif not improved and latency > state.min_latency * self.latency_tolerance:
+            new_limit, why = limit - 1, "耗时变长"
+        else:
+            new_limit, why = limit + 1, "探测"
+        detail = f"{why}, {throughput / (1024 * 1024):.2f} MB/秒, 平均耗时 {latency:.2f}秒"
+        self._set_limit(host, new_limit, detail)
+        state.throughput = throughput
+        state.reset(now)
+    
+    def _set_limit(self, host, limit, detail):
+        old = self.limit_of(host)
+        limit = max(self.min_limit, min(self.max_limit, limit))
+        if limit == old:
+            return
+        self.scheduler.host_limits[host] = limit
+        message = f"{'📈' if limit > old else '📉'} 自适应并发 {host}: {old} → {limit} ({detail})"
+        if self.events:
+            self.events.emit('concurrency', message, host=host, old=old, new=limit, detail=detail)
+        else:
+            print(message)
+
+
+class _HostWindow:
+    """AdaptiveConcurrency中一个主机的统计窗口"""
+    
+    def __init__(self):
+        self.slow_start = True
+        self.throughput = None           # 上一轮的吞吐量
+        self.min_latency = float('inf')  # 观察到的最短平均耗时
+        self.reset(time.monotonic())
+    
+    def reset(self, now):
+        self.window_start = now
+        self.completed = 0
+        self.bytes = 0
+        self.latency = 0.0
+
+
+class TokenBucket:
+    """
+    令牌桶：每秒补充rate个令牌，最多积攒burst个
+    
+    reserve()直接扣除令牌（可以扣成负数）并返回需要等待的秒数，调用方只需
+    睡眠一次，不用反复轮询；排在后面的调用等待的时间依次顺延。
+    """
+    
+    def __init__(self, rate=None, burst=None):
+        """
+        Args:
+            rate (float): 每秒补充的令牌数，None表示不限制
+            burst (float): 桶容量，默认为1秒的量（至少为1）
+        """
+        self._lock = threading.Lock()
+        self.rate = None
+        self.burst = None
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, burst)
+    
+    def set_rate(self, rate, burst=None):
+        """运行中调整速率，已积攒的令牌不超过新的容量"""
+        with self._lock:
+            self._refill(time.monotonic())
+            unlimited = self.rate is None
+            self.rate = rate or None
+            self.burst = (burst or max(rate, 1)) if rate else None
+            if self.rate:
+                # 从不限制改为限制时桶是满的，不会让正在进行的下载突然停顿
+                self._tokens = self.burst if unlimited else min(self._tokens, self.burst)
+    
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def delay(self, amount=1):
+        """还要等多少秒才有amount个令牌（不扣除）"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (amount - self._tokens) / self.rate)
+    
+    def reserve(self, amount=1):
+        """扣除amount个令牌，返回调用方需要等待的秒数"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    全局和每个主机的带宽（字节/秒）与请求速率（次/秒）限制
+    
+    每个限制是一个令牌桶：发起请求前按请求数扣除，读到数据后按字节数扣除，
+    取全局和所在主机中需要等待更久的一个。所有限制都可以在运行中调整。
+    """
+    
+    _UNCHANGED = object()
+    
+    def __init__(self, bandwidth=None, request_rate=None, host_bandwidth=None, host_request_rate=None):
+        """
+        Args:
+            bandwidth (float): 全局带宽上限（字节/秒），None表示不限制
+            request_rate (float): 全局每秒最多发起的请求数
+            host_bandwidth (float): 每个主机的带宽上限（字节/秒）
+            host_request_rate (float): 每个主机每秒最多发起的请求数
+        """
+        self._lock = threading.Lock()
+        self._bandwidth = TokenBucket()
+        self._requests = TokenBucket()
+        self.host_bandwidth = None
+        self.host_request_rate = None
+        self._host_overrides = {}  # 主机 -> {'bandwidth': ..., 'request_rate': ...}，覆盖每个主机的默认限制
+        self._host_bandwidth = {}  # 主机 -> TokenBucket
+        self._host_requests = {}
+        self.limits_bandwidth = False
+        self.limits_requests = False
+        self.set_limits(bandwidth, request_rate, host_bandwidth, host_request_rate)
+    
+    @property
+    def bandwidth(self):
+        return self._bandwidth.rate
+    
+    @property
+    def request_rate(self):
+        return self._requests.rate
+    
+    def set_limits(self, bandwidth=_UNCHANGED, request_rate=_UNCHANGED, host_bandwidth=_UNCHANGED,
+                   host_request_rate=_UNCHANGED):
+        """调整限制，没有传入的参数保持不变，传入None取消这项限制"""
+        with self._lock:
+            if bandwidth is not self._UNCHANGED:
+                self._bandwidth.set_rate(bandwidth)
+            if request_rate is not self._UNCHANGED:
+                self._requests.set_rate(request_rate)
+            if host_bandwidth is not self._UNCHANGED:
+                self.host_bandwidth = host_bandwidth or None
+            if host_request_rate is not self._UNCHANGED:
+                self.host_request_rate = host_request_rate or None
+            for host in set(self._host_bandwidth) | set(self._host_requests):
+                self._apply_host_limits(host)
+            self._update_flags()
+    
+    def set_host_limits(self, host, bandwidth=_UNCHANGED, request_rate=_UNCHANGED):
+        """单独调整某个主机的限制（覆盖host_bandwidth/host_request_rate），传入None取消这项限制"""
+        host = host.lower()
+        with self._lock:
+            override = self._host_overrides.setdefault(host, {})
+            if bandwidth is not self._UNCHANGED:
+                override['bandwidth'] = bandwidth or None
+            if request_rate is not self._UNCHANGED:
+                override['request_rate'] = request_rate or None
+            self._apply_host_limits(host)
+            self._update_flags()
+    
+    def host_limits(self, host):
+        """主机当前生效的 (带宽, 请求速率)"""
+        override = self._host_overrides.get(host, {})
+        return (override.get('bandwidth', self.host_bandwidth),
+                override.get('request_rate', self.host_request_rate))
+    
+    def _apply_host_limits(self, host):
+        bandwidth, request_rate = self.host_limits(host)
+        if host in self._host_bandwidth:
+            self._host_bandwidth[host].set_rate(bandwidth)
+        if host in self._host_requests:
+            self._host_requests[host].set_rate(request_rate)
+    
+    def _update_flags(self):
+        overrides = self._host_overrides.values()
+        self.limits_bandwidth = bool(self.bandwidth or self.host_bandwidth
+                                     or any(o.get('bandwidth') for o in overrides))
+        self.limits_requests = bool(self.request_rate or self.host_request_rate
+                                    or any(o.get('request_rate') for o in overrides))
+    
+    def _host_bucket(self, buckets, host, index):
+        bucket = buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = buckets.get(host)
+                if bucket is None:
+                    bucket = buckets[host] = TokenBucket(self.host_limits(host)[index])
+        return bucket
+    
+    def request_delay(self, host):
+        """还要等多少秒才能向这个主机发起下一个请求（不扣除）"""
+        return max(self._requests.delay(), self._host_bucket(self._host_requests, host, 1).delay())
+    
+    def reserve_request(self, host):
+        """扣除一个请求，返回发起请求前需要等待的秒数"""
+        return max(self._requests.reserve(), self._host_bucket(self._host_requests, host, 1).reserve())
+    
+    def reserve_bytes(self, host, amount):
+        """扣除已读到的字节数，返回继续读取前需要等待的秒数"""
+        return max(self._bandwidth.reserve(amount),
+                   self._host_bucket(self._host_bandwidth, host, 0).reserve(amount))
+    
+    def describe(self):
+        """限制设置的文字说明，没有任何限制时返回空字符串"""
+        parts = []
+        if self.bandwidth:
+            parts.append(f"全局 {self.bandwidth / (1024 * 1024):.2f} MB/秒")
+        if self.request_rate:
+            parts.append(f"全局 {self.request_rate:g} 请求/秒")
+        if self.host_bandwidth:
+            parts.append(f"每主机 {self.host_bandwidth / (1024 * 1024):.2f} MB/秒")
+        if self.host_request_rate:
+            parts.append(f"每主机 {self.host_request_rate:g} 请求/秒")
+        if self._host_overrides:
+            parts.append(f"{len(self._host_overrides)} 个主机单独设置")
+        return ", ".join(parts)
+
+
+# 批量调度器分发任务时已经为它扣除了请求令牌，任务的第一个请求不再重复扣除
+_prepaid_request = contextvars.ContextVar('prepaid_request', default=None)
+
+# 执行当前任务的批量调度器，分段下载的额外连接从这里占用并发名额
+_task_scheduler = contextvars.ContextVar('task_scheduler', default=None)
+
+# 当前任务所属的TaskGroup，去重索引按组查找
+_task_group = contextvars.ContextVar('task_group', default=None)
+
+
+class DownloadJournal:
+    """
+    断点续传日志（SQLite，保存在下载文件夹中）
+    
+    每个下载任务一行，记录任务状态、已写入字节数以及服务器返回的
+    ETag/Last-Modified。程序中断后重新运行时，已完成的任务直接跳过，
+    写了一半的 .part 文件通过 Range 请求从断点继续下载。
+    """
+    
+    FILENAME = ".download_journal.sqlite3"
+    
+    def __init__(self, folder, filename=None):
+        """
+        Args:
+            folder: 下载文件夹路径
+            filename: 日志文件名，默认为FILENAME。多个进程分片下载到同一个文件夹时
+                每个分片使用各自的日志文件
+        """
+        self.path = Path(folder) / (filename or self.FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " key TEXT PRIMARY KEY, url TEXT NOT NULL, filename TEXT, state TEXT NOT NULL,"
+            " bytes_written INTEGER NOT NULL DEFAULT 0, total_size INTEGER, resumable INTEGER NOT NULL DEFAULT 0,"
+            " etag TEXT, last_modified TEXT, updated_at REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+    
+    @staticmethod
+    def make_key(index, url, filename):
+        """任务键：行号 + URL + 指定文件名，同一份列表重新运行时保持不变"""
+        return f"{index}\t{url}\t{filename or ''}"
+    
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+    
+    def get(self, key):
+        """读取任务记录，不存在时返回None"""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+    
+    def start(self, key, url, filename, total_size, resumable, etag, last_modified):
+        """记录任务开始写入 .part 文件"""
+        self._execute(
+            "INSERT OR REPLACE INTO jobs (key, url, filename, state, bytes_written, total_size,"
+            " resumable, etag, last_modified, updated_at) VALUES (?, ?, ?, 'partial', 0, ?, ?, ?, ?, ?)",
+            (key, url, filename, total_size, int(resumable), etag, last_modified, time.time()),
+        )
+    
+    def update_progress(self, key, bytes_written):
+        self._execute("UPDATE jobs SET bytes_written = ?, updated_at = ? WHERE key = ?",
+                      (bytes_written, time.time(), key))
+    
+    def mark_done(self, key, bytes_written):
+        self._execute("UPDATE jobs SET state = 'done', bytes_written = ?, updated_at = ? WHERE key = ?",
+                      (bytes_written, time.time(), key))
+    
+    def set_batch_finished(self, finished):
+        """记录整批任务是否已经跑完，用于判断下次启动时是否需要续传"""
+        self._execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('batch_finished', ?)",
+                      ('1' if finished else '0',))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    @classmethod
+    def is_unfinished(cls, folder):
+        """文件夹中是否有一批没有跑完的下载任务"""
+        path = Path(folder) / cls.FILENAME
+        if not path.exists():
+            return False
+        conn = sqlite3.connect(str(path))
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE name = 'batch_finished'").fetchone()
+        except sqlite3.Error:
+            return False
+        finally:
+            conn.close()
+        return row is not None and row[0] == '0'
+
+
+def find_unfinished_download_folder(project_path):
+    """查找最近一次没有跑完的 下载_时间戳 文件夹，没有则返回None"""
+    for folder in sorted(Path(project_path).glob("下载_*"), reverse=True):
+        if folder.is_dir() and DownloadJournal.is_unfinished(folder):
+            return str(folder)
+    return None
+
+
+def copy_file(source, destination):
+    """
+    复制文件内容。优先用copy_file_range在内核中复制（不经过用户态缓冲区，
+    有的文件系统还能直接共享数据块），不支持时退回shutil.copyfile
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(source, 'rb') as src, open(destination, 'wb') as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            if remaining <= 0:
+                return
+        except OSError:
+            # 跨文件系统或内核不支持，退回普通复制
+            pass
+    shutil.copyfile(source, destination)
+
+
+def link_or_copy(source, destination):
+    """
+    优先创建硬链接（不占额外空间），跨磁盘或文件系统不支持时退回复制
+    
+    destination已存在时替换它（先链接到临时文件名，再原子地重命名过去）。
+    """
+    temp_file = f"{destination}.link"
+    try:
+        os.link(source, temp_file)
+    except OSError:
+        copy_file(source, destination)
+    else:
+        os.replace(temp_file, destination)
+
+
+class DirectorySink:
+    """
+    默认的输出位置：每个文件单独保存在下载文件夹中
+    
+    下载时先写入 .part 文件，完成后原子地重命名为正式文件名。取名时以独占方式
+    创建 .part 文件占住名字，其他进程（如分片运行的下载器）也不会再用它。
+    """
+    
+    is_archive = False
+    
+    def __init__(self, folder):
+        self.folder = Path(folder)
+    
+    def existing_names(self):
+        """已被占用的文件名（.part 文件按它对应的正式文件名计）"""
+        for name in os.listdir(self.folder):
+            yield name[:-len('.part')] if name.endswith('.part') else name
+    
+    def location(self, filename):
+        """文件保存后的路径"""
+        return self.folder / filename
+    
+    def claim(self, filename):
+        """以独占方式创建 .part 文件占住文件名，已被其他进程占用时返回False"""
+        file_path = self.folder / filename
+        part_file = file_path.with_name(filename + '.part')
+        try:
+            os.close(os.open(part_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        except FileExistsError:
+            return False
+        if file_path.exists():
+            # 其他进程已经下载完成了同名文件
+            part_file.unlink()
+            return False
+        return True
+    
+    def release(self, filename):
+        """
+        下载失败时删除 .part 文件
+        
+        Returns:
+            bool: 文件名是否可以重新使用（正式文件已经存在时不能）
+        """
+        file_path = self.folder / filename
+        if file_path.exists():
+            return False
+        try:
+            file_path.with_name(filename + '.part').unlink()
+        except FileNotFoundError:
+            pass
+        return True
+    
+    def close(self):
+        pass
+    
+    def describe(self):
+        return str(self.folder.absolute())
+
+
+class ArchiveSink:
+    """
+    把下载的文件直接写入一个ZIP（超过4GB时自动使用ZIP64）或tar归档，不再单独保存
+    
+    各下载线程先把文件内容写入各自的临时缓冲（不超过spool_size时在内存中，更大的文件
+    落到归档所在目录的临时文件），下载完成后放入有界队列；唯一的写入线程按完成顺序
+    依次把它们追加到归档中。队列满时下载线程等待写入，内存占用有上限。
+    """
+    
+    is_archive = True
+    
+    def __init__(self, path, spool_size=8 * 1024 * 1024, queue_size=8, buffer_size=1024 * 1024):
+        """
+        Args:
+            path (str): 归档文件路径，按扩展名区分格式：.zip、.tar、.tar.gz/.tgz
+            spool_size (int): 每个条目在内存中缓冲的最大字节数，超过后改用临时文件
+            queue_size (int): 等待写入归档的条目数上限
+            buffer_size (int): 从临时缓冲复制到归档时的读写块大小
+        """
+        self.path = Path(path)
+        name = self.path.name.lower()
+        if name.endswith('.zip'):
+            self.format, self.tar_mode = 'zip', None
+        elif name.endswith(('.tar.gz', '.tgz')):
+            self.format, self.tar_mode = 'tar', 'gz'
+        elif name.endswith('.tar'):
+            self.format, self.tar_mode = 'tar', ''
+        else:
+            raise ValueError("归档文件的扩展名必须是 .zip、.tar 或 .tar.gz")
+        self.spool_size = spool_size
+        self.buffer_size = buffer_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.entries = 0        # 已写入归档的文件数
+        self.bytes_written = 0  # 已写入归档的文件内容字节数
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._archive = None
+        self._created = False
+        self._committed = set()
+        self._error = None
+    
+    def existing_names(self):
+        # 每次运行都新建归档，之前的批次用过的名字仍在下载器的预留索引中
+        return ()
+    
+    def location(self, filename):
+        """条目的显示路径：归档路径/条目名"""
+        return self.path / filename
+    
+    def claim(self, filename):
+        return True
+    
+    def release(self, filename):
+        """已经交给写入线程的条目不能再释放名字"""
+        with self._lock:
+            return filename not in self._committed
+    
+    def open_entry(self):
+        """新建一个条目的临时缓冲"""
+        self._check_error()
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_size, dir=self.path.parent)
+    
+    def commit(self, filename, spool):
+        """
+        把写完的条目交给写入线程，队列满时等待
+        
+        Returns:
+            int: 条目的字节数
+        """
+        self._check_error()
+        size = spool.tell()
+        spool.seek(0)
+        with self._lock:
+            self._committed.add(filename)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='archive-writer', daemon=True)
+                self._writer.start()
+        self._queue.put((filename, spool, size))
+        return size
+    
+    def _check_error(self):
+        if self._error is not None:
+            raise OSError(f"写入归档失败: {self._error}") from self._error
+    
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            filename, spool, size = item
+            try:
+                if self._error is None:
+                    self._write_entry(filename, spool, size)
+            except Exception as e:
+                # 之后的条目不再写入，下载线程提交条目时会收到这个错误
+                self._error = e
+            finally:
+                spool.close()
+    
+    def _open(self):
+        # 同一个下载器的后续批次在原来的归档后面追加
+        mode = 'a' if self._created else 'w'
+        if self.format == 'zip':
+            self._archive = zipfile.ZipFile(self.path, mode, zipfile.ZIP_STORED, allowZip64=True)
+        elif mode == 'a' and self.tar_mode:
+            raise ValueError("压缩的tar归档不能追加写入，每批请使用新的归档文件")
+        else:
+            self._archive = tarfile.open(self.path, f"{mode}:{self.tar_mode}" if self.tar_mode else mode)
+        self._created = True
+    
+    def _write_entry(self, filename, spool, size):
+        if self._archive is None:
+            self._open()
+        if self.format == 'zip':
+            # 预先给出大小，超过4GB的条目会直接写成ZIP64格式
+            info = zipfile.ZipInfo(filename, time.localtime()[:6])
+            info.file_size = size
+            info.external_attr = 0o644 << 16
+            with self._archive.open(info, 'w') as dest:
+                shutil.copyfileobj(spool, dest, self.buffer_size)
+        else:
+            info = tarfile.TarInfo(filename)
+            info.size = size
+            info.mtime = time.time()
+            info.mode = 0o644
+            self._archive.addfile(info, spool)
+        self.entries += 1
+        self.bytes_written += size
+    
+    def close(self):
+        """等待队列中的条目全部写入，写好归档目录后关闭（同一个下载器之后还可以继续追加）"""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        if self._archive is not None:
+            archive, self._archive = self._archive, None
+            archive.close()
+        self._check_error()
+    
+    def describe(self):
+        return str(self.path.absolute())
+
+
+class DownloadCache:
+    """
+    跨批次的下载缓存（按URL索引，内容按SHA-256存放）
+    
+    记录每个URL上次下载到的内容以及服务器返回的ETag/Last-Modified。
+    再次下载同一URL时带上 If-None-Match / If-Modified-Since 请求头，
+    服务器返回304说明文件没有变化，直接从缓存硬链接（或复制）到本次的
+    下载文件夹，不再传输文件内容。缓存总大小超过上限时按最近最少使用淘汰。
+    """
+    
+    INDEX_FILENAME = "index.sqlite3"
+    
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        """
+        Args:
+            cache_dir: 缓存文件夹路径
+            max_bytes (int): 缓存内容的总大小上限（字节）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.cache_dir / self.INDEX_FILENAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, extension TEXT NOT NULL,"
+            " etag TEXT, last_modified TEXT, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS objects (sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._conn.commit()
+    
+    def object_path(self, sha256):
+        """缓存内容的存放路径"""
+        return self.objects_dir / sha256[:2] / sha256
+    
+    def lookup(self, url):
+        """
+        查找URL的缓存记录，缓存内容缺失或大小不对时删除记录
+        
+        Returns:
+            dict: 缓存记录（含sha256、size、extension、etag、last_modified），没有时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT e.sha256, o.size, e.extension, e.etag, e.last_modified FROM entries e"
+                " JOIN objects o ON o.sha256 = e.sha256 WHERE e.url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = dict(zip(('sha256', 'size', 'extension', 'etag', 'last_modified'), row))
+            try:
+                valid = self.object_path(entry['sha256']).stat().st_size == entry['size']
+            except OSError:
+                valid = False
+            if not valid:
+                self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._conn.commit()
+                return None
+            return entry
+    
+    @staticmethod
+    def conditional_headers(entry):
+        """根据缓存记录生成条件请求头"""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def materialize(self, url, entry, destination):
+        """把缓存内容放到目标路径，并更新最近使用时间"""
+        link_or_copy(self.object_path(entry['sha256']), destination)
+        with self._lock:
+            self._conn.execute("UPDATE entries SET last_used = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+    
+    def store(self, url, file_path, sha256, size, extension, etag, last_modified):
+        """
+        把刚下载完成的文件加入缓存
+        
+        没有ETag和Last-Modified的响应无法做条件请求，不会缓存。
+        """
+        if not etag and not last_modified:
+            return
+        object_file = self.object_path(sha256)
+        if not object_file.exists():
+            object_file.parent.mkdir(exist_ok=True)
+            temp_file = object_file.with_name(f"{sha256}.{threading.get_ident()}.tmp")
+            link_or_copy(file_path, temp_file)
+            os.replace(temp_file, object_file)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO objects (sha256, size) VALUES (?, ?)", (sha256, size))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (url, sha256, extension, etag, last_modified, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (url, sha256, extension, etag, last_modified, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+    
+    def forget(self, url):
+        """删除URL的缓存记录（缓存的内容没有通过校验时），内容留给淘汰时清理"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self._conn.commit()
+    
+    def _evict(self):
+        """总大小超过上限时，按最近最少使用的顺序淘汰（调用方持有锁）"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, sha256 in self._conn.execute("SELECT url, sha256 FROM entries ORDER BY last_used").fetchall():
+            self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            # 同一份内容可能被多个URL引用，只有最后一个引用删除后才删除内容
+            if self._conn.execute("SELECT 1 FROM entries WHERE sha256 = ?", (sha256,)).fetchone():
+                continue
+            size = self._conn.execute("SELECT size FROM objects WHERE sha256 = ?", (sha256,)).fetchone()[0]
+            self._conn.execute("DELETE FROM objects WHERE sha256 = ?", (sha256,))
+            try:
+                self.object_path(sha256).unlink()
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def iter_spreadsheet_rows(path, encoding='utf-8-sig'):
+    """
+    逐行读取表格文件（.xlsx/.xlsm 或 .csv），不会把整个文件读入内存
+    
+    文件在调用时立即打开（文件不存在等错误会马上抛出），数据行则在迭代时才读取。
+    
+    Args:
+        path (str): 表格文件路径
+        encoding (str): CSV文件编码，默认兼容Excel导出的带BOM的UTF-8
+        
+    Returns:
+        (行号, 单元格值元组) 迭代器，行号从1开始
+    """
+    if str(path).lower().endswith('.csv'):
+        return _iter_csv_rows(open(path, 'r', encoding=encoding, newline=''))
+    from openpyxl import load_workbook
+    
+    # read_only模式按需解析XML，内存占用与表格行数无关
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    return _iter_workbook_rows(workbook)
+
+
+def _iter_csv_rows(f):
+    with f:
+        for row_number, row in enumerate(csv.reader(f), start=1):
+            yield row_number, tuple(cell if cell != '' else None for cell in row)
+
+
+def _iter_workbook_rows(workbook):
+    try:
+        for row_number, row in enumerate(workbook.active.iter_rows(values_only=True), start=1):
+            yield row_number, row
+    finally:
+        workbook.close()
+
+
+def iter_text_lines(path, encoding='utf-8'):
+    """逐行读取文本文件中的URL，跳过空行"""
+    f = open(path, 'r', encoding=encoding)
+    
+    def lines():
+        with f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+    return lines()
+
+
+class RetryPolicy:
+    """
+    批量下载的失败重试策略
+    
+    只有可重试的失败（超时、连接错误、429/5xx等）才会重试。两次尝试之间按
+    指数退避并加随机抖动等待，服务器给出Retry-After时至少等待这么久。
+    等待期间任务不占用下载线程。全部任务结束后，重试次数用完仍失败的任务
+    会再自动尝试一轮。
+    """
+    
+    RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+    
+    def __init__(self, max_attempts=3, backoff_base=1.0, backoff_max=60.0, jitter=True,
+                 retry_statuses=RETRY_STATUSES, max_retry_after=300.0, second_pass=True):
+        """
+        Args:
+            max_attempts (int): 每个任务在第一轮中最多尝试的次数（含第一次），1表示不重试
+            backoff_base (float): 第一次重试前的基础等待秒数，之后每次翻倍
+            backoff_max (float): 退避等待的上限（秒）
+            jitter (bool): 是否在退避时间上加随机抖动，避免大量任务同时重试
+            retry_statuses: 视为可重试的HTTP状态码
+            max_retry_after (float): 服务器Retry-After最多遵守的秒数
+            second_pass (bool): 全部任务结束后，是否对仍然失败的可重试任务再尝试一轮
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_retry_after = max_retry_after
+        self.second_pass = second_pass
+    
+    def delay(self, attempt, retry_after=None):
+        """
+        第attempt次尝试失败后，到下一次尝试需要等待的秒数
+        
+        Args:
+            attempt (int): 刚刚失败的是第几次尝试（从1开始）
+            retry_after (float): 服务器要求的等待秒数，没有时为None
+        """
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        if self.jitter:
+            backoff = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, self.max_retry_after))
+        return backoff
+    
+    @staticmethod
+    def parse_retry_after(value):
+        """解析Retry-After响应头（秒数或HTTP日期），无法解析时返回None"""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+
+class DownloadFailure(str):
+    """
+    下载失败时返回的错误信息
+    
+    仍然是普通字符串，(成功标志, 错误信息) 的返回格式保持不变；
+    另外带有失败原因分类，供批量下载判断是否重试以及分类统计。
+    """
+    
+    def __new__(cls, message, reason, retryable=False, retry_after=None):
+        failure = super().__new__(cls, message)
+        failure.reason = reason
+        failure.retryable = retryable
+        failure.retry_after = retry_after
+        return failure
+
+
+class VerificationError(Exception):
+    """下载的文件没有通过校验（大小不符、文件结构不完整或哈希值不一致）"""
+
+
+class TaskGroup:
+    """
+    一组任务（一次批量下载，或常驻服务中的一次提交）各自的去重索引、期望哈希值和预检结果
+    
+    同一组中重复的URL只下载一次、内容相同的文件只保存一份，哈希值也只用于校验
+    这一组的文件；不同组之间互不影响。索引随任务一起释放，常驻服务中不会无限增长。
+    """
+    
+    __slots__ = ('url_results', 'content_index', 'expected_hashes', 'preflight')
+    
+    def __init__(self):
+        self.url_results = {}      # URL -> (文件路径, 扩展名, 大小)
+        self.content_index = {}    # SHA-256 -> 第一次保存的文件路径
+        self.expected_hashes = {}  # URL -> (哈希算法, 十六进制哈希值)
+        self.preflight = {}        # URL -> PreflightInfo
+
+
+class BatchTask:
+    """批量下载中的一个任务"""
+    
+    __slots__ = ('url', 'filename', 'job_key', 'on_result', 'group', 'attempt', 'final', 'owner', 'started',
+                 'request_wait')
+    
+    def __init__(self, url, filename, job_key=None, on_result=None, group=None):
+        self.url = url
+        self.filename = filename
+        self.job_key = job_key
+        self.on_result = on_result  # 所属任务组的结果回调，为None时使用整批的on_result
+        self.group = group          # 所属的TaskGroup
+        self.attempt = 1       # 当前是第几次尝试
+        self.final = False     # 是否是最后一轮（失败后不再重试）
+        self.owner = False     # 去重时是否是这个URL实际负责下载的任务
+        self.started = None    # 实际开始下载时的time.monotonic()
+        self.request_wait = None  # 分发时已扣除请求令牌的话，发起请求前还需等待的秒数
+
+
+class KeyedTasks:
+    """
+    自带序号的一组任务，迭代产生 (序号, (url, filename))
+    
+    断点续传日志的任务键默认使用任务在输入中的位置。任务来自共享队列等每次
+    运行读取顺序都不同的输入时，用这个类包装，任务键改用输入自带的序号（如队列中的任务id）。
+    """
+    
+    def __init__(self, indexed_tasks):
+        self.indexed_tasks = indexed_tasks
+    
+    def __iter__(self):
+        return iter(self.indexed_tasks)
+
+
+class PreflightInfo:
+    """预检（HEAD或只取开头字节的Range请求）得到的一个URL的信息"""
+    
+    __slots__ = ('size', 'extension', 'resumable', 'error')
+    
+    def __init__(self, size=None, extension=None, resumable=False, error=None):
+        self.size = size            # 文件大小（字节），服务器没有说明时为None
+        self.extension = extension  # 检测到的扩展名，下载时不再重复检测
+        self.resumable = resumable  # 是否支持Range续传
+        self.error = error          # 预检失败的原因，成功时为None
+
+
+class BatchRun:
+    """
+    一批下载任务的调度状态，线程引擎和异步引擎共用
+    
+    负责按需从输入中读取任务、按主机分发、暂存重复URL、把需要重试的任务
+    延迟排队，以及在最后对失败任务再尝试一轮。驱动循环只需要反复：
+    用start_ready()取出可开始的任务执行，任务结束后调用finish()，
+    没有任务可执行时等待wait_time()秒。
+    
+    服务模式下一个BatchRun持续运行：open为True时输入读完也不结束，
+    其他线程可以随时用add_tasks()加入新的一组任务，多组任务的输入轮流读取，
+    共用同一套并发上限、限速和自适应并发；close_input()之后处理完已有任务再结束。
+    """
+    
+    # 队列中的任务所在主机都已达到并发上限时，为找到其他主机的任务最多可以多读入的倍数
+    MAX_PENDING_PER_SLOT = 64
+    
+    def __init__(self, downloader, tasks, on_result=None, max_active=None, total=None):
+        """
+        Args:
+            downloader (PDFDownloader): 执行下载的下载器
+            tasks: (url, filename) 迭代器或KeyedTasks，为None时先不加入任务（用add_tasks()加入）
+            on_result: 每个任务最终完成时调用的函数 on_result(url, 成功标志, 文件路径或错误信息)
+            max_active (int): 同时分发出去的任务数上限，默认为下载器的并发数
+            total (int): 任务总数，未知时为None（开启预检时按预检读入的任务数累计）
+        """
+        self.downloader = downloader
+        self.on_result = on_result
+        # 进度：任务总数，以及预检后这批下载完成时bytes_downloaded应达到的值
+        self.total = total
+        self.bytes_target = None
+        self._count_total = total is None
+        self.scheduler = HostScheduler(max_active or downloader.max_connections, downloader.max_per_host)
+        self.controller = None
+        if downloader.adaptive:
+            self.controller = AdaptiveConcurrency(
+                self.scheduler, min(downloader.max_per_host or downloader.max_connections,
+                                    downloader.max_connections), events=downloader.events)
+        # 请求速率限制：令牌不足的主机暂不分发，不让工作线程在睡眠中空等
+        self.limiter = downloader.rate_limiter
+        self.scheduler.host_ready = self._host_ready
+        self.running = 0
+        # 各组任务的输入，轮流读取；其他线程加入的新任务组先放入_incoming
+        self._sources = deque([self._prepare(tasks)] if tasks is not None else [])
+        self._incoming = queue.SimpleQueue()
+        self._exhausted = False
+        self.open = False
+        
+        # 去重时，同一组中同一URL正在下载的期间，后面重复的任务先暂存，等它完成后直接链接
+        self._downloading_urls = set()
+        self._waiting = {}
+        
+        # 等待重试的任务：(到期时间, 序号, 主机, 任务) 小顶堆
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._second_pass = []
+        
+        # 下载完成的文件在单独的线程池中校验，不占用下载并发；校验完成后由wakeup唤醒驱动循环
+        self.verifying = 0
+        self._verified = queue.SimpleQueue()
+        self.wakeup = None
+        
+        if downloader.journal:
+            downloader.journal.set_batch_finished(False)
+    
+    def _prepare(self, tasks, on_result=None):
+        downloader = self.downloader
+        journal = downloader.journal
+        group = TaskGroup()
+        indexed = iter(tasks) if isinstance(tasks, KeyedTasks) else enumerate(tasks)
+        if self.downloader.warmup:
+            # 预热需要先读入全部任务，统计各主机的任务数
+            indexed = list(indexed)
+            self.downloader.warm_up(url for _, (url, _) in indexed)
+        if self.downloader.preflight:
+            # 预检需要先读入全部任务，按大小重新排序；断点续传的任务键仍用原来的序号
+            indexed, group.preflight, expected = self.downloader.run_preflight(indexed)
+            if self.bytes_target is None:
+                self.bytes_target = downloader.bytes_downloaded
+            self.bytes_target += expected
+            if self._count_total:
+                self.total = (self.total or 0) + len(indexed)
+        for index, (url, filename) in indexed:
+            # iter_named_tasks()读到的哈希值转入这一组
+            expected = downloader.expected_hashes.pop(url, None)
+            if expected:
+                group.expected_hashes[url] = expected
+            job_key = DownloadJournal.make_key(index, url, filename) if journal else None
+            yield BatchTask(url, filename, job_key, on_result, group)
+    
+    def add_tasks(self, tasks, on_result=None):
+        """
+        加入一组任务（可以在其他线程中调用），与已有的任务轮流读取、共用并发上限
+        
+        Args:
+            tasks: (url, filename) 迭代器或KeyedTasks，在驱动循环中按需读取
+            on_result: 这组任务完成时调用的函数，为None时使用整批的on_result
+        """
+        self._incoming.put(self._prepare(tasks, on_result))
+        if self.wakeup:
+            self.wakeup()
+    
+    def close_input(self):
+        """不再接收新的任务组（可以在其他线程中调用），已有的任务完成后驱动循环结束"""
+        self.open = False
+        if self.wakeup:
+            self.wakeup()
+    
+    def _feed(self, limit):
+        """
+        从输入中按需读取任务，直到调度队列中有limit个待分发任务
+        
+        Returns:
+            bool: 输入是否已经读完（持续接收任务时表示暂时没有新任务）
+        """
+        sources = self._sources
+        while self.scheduler.pending < limit:
+            while True:
+                try:
+                    sources.append(self._incoming.get_nowait())
+                except queue.Empty:
+                    break
+            if not sources:
+                if not self.open:
+                    self._exhausted = True
+                return True
+            task = next(sources[0], None)
+            if task is None:
+                sources.popleft()
+                continue
+            # 每组任务读一个就换下一组，一组任务很大时其他组也不必排在它后面
+            sources.rotate(-1)
+            self._add(task)
+        return False
+    
+    def _pop_ready(self):
+        """取出下一个可以开始的任务，必要时从输入中补充"""
+        downloader = self.downloader
+        scheduler = self.scheduler
+        limit = downloader.max_pending
+        max_limit = max(limit, downloader.max_connections * self.MAX_PENDING_PER_SLOT)
+        drained = self._exhausted
+        while True:
+            if not self._exhausted:
+                drained = self._feed(limit)
+            ready = scheduler.pop_ready()
+            if ready is not None or drained or scheduler.active >= scheduler.max_active:
+                return ready
+            # 队列中的任务都属于已满的主机，还有空闲并发时多读入一些任务
+            if limit >= max_limit:
+                return None
+            limit = scheduler.pending + downloader.max_connections
+    
+    def _add(self, task):
+        if self.controller:
+            self.controller.watch(HostScheduler.host_of(task.url))
+        self.scheduler.add(task.url, task)
+    
+    def _host_ready(self, host):
+        return not self.limiter.limits_requests or self.limiter.request_delay(host) <= 0
+    
+    def _release_due_retries(self):
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, host, task = heapq.heappop(self._delayed)
+            self._add(task)
+    
+    def _start_second_pass(self):
+        """其他任务全部结束后，把重试次数用完的失败任务再分发一轮"""
+        tasks, self._second_pass = self._second_pass, []
+        self.downloader.events.emit('second_pass', f"\n🔁 第二轮：重新尝试 {len(tasks)} 个失败的任务",
+                                    tasks=len(tasks))
+        for task in tasks:
+            self._add(task)
+    
+    def start_ready(self):
+        """
+        取出当前可以开始的全部任务，并计入进行中
+        
+        Returns:
+            list: [(host, BatchTask), ...]
+        """
+        self._release_due_retries()
+        started = []
+        while True:
+            ready = self._pop_ready()
+            if ready is None:
+                # 持续接收任务时，没有待分发的任务就说明输入暂时读完了
+                if (not started and not self.running and not self.verifying and not self._delayed
+                        and self._second_pass and (self._exhausted or self.open)
+                        and not self.scheduler.has_pending()):
+                    self._start_second_pass()
+                    continue
+                return started
+            host, task = ready
+            if self.downloader.dedup and not task.owner:
+                key = (task.group, task.url)
+                if key in self._downloading_urls:
+                    self.scheduler.release(host)
+                    self._waiting.setdefault(key, []).append(task)
+                    continue
+                self._downloading_urls.add(key)
+                task.owner = True
+            task.request_wait = self.limiter.reserve_request(host) if self.limiter.limits_requests else None
+            self.running += 1
+            started.append(ready)
+    
+    def wait_time(self):
+        """
+        距离下一个等待重试的任务到期、或者因请求速率限制暂停的主机可以分发
+        还有多少秒，都没有时返回None
+        """
+        waits = []
+        if self._delayed:
+            waits.append(max(0.0, self._delayed[0][0] - time.monotonic()))
+        if self.limiter.limits_requests and self.scheduler.has_pending():
+            waits.append(min(self.limiter.request_delay(host) for host in self.scheduler.pending_hosts()))
+        return min(waits) if waits else None
+    
+    def finish(self, host, task, get_result):
+        """
+        处理一个已结束的任务：开启校验时成功的文件先交给校验线程池，
+        失败且可重试时排队重试，否则计入统计并交给on_result
+        
+        Args:
+            host (str): start_ready()返回的主机
+            task (BatchTask): 已结束的任务
+            get_result: 返回 (成功标志, 文件路径或错误信息) 的函数，如Future.result
+        """
+        downloader = self.downloader
+        self.running -= 1
+        self.scheduler.release(host)
+        try:
+            success, result = get_result()
+        except Exception as e:
+            success, result = False, DownloadFailure(f"任务执行异常 {task.url}: {str(e)}", "任务异常")
+            downloader.events.emit('file_failed', result, EventLog.ERROR, url=task.url, reason=result.reason)
+        
+        if self.controller and task.started is not None:
+            self.controller.observe(host, task.started, success, getattr(result, 'reason', None),
+                                    self._size_of(result) if success else 0)
+        
+        if success and downloader.verify and not downloader.sink.is_archive:
+            self.verifying += 1
+            future = downloader.verifier.submit(downloader.verify_file, task.url, result, task.group)
+            future.add_done_callback(lambda future: self._verification_done(host, task, future))
+            return
+        self._complete(host, task, success, result)
+    
+    def _verification_done(self, host, task, future):
+        """在校验线程中调用：把结果交给驱动循环处理"""
+        self._verified.put((host, task, future))
+        if self.wakeup:
+            self.wakeup()
+    
+    def collect_verified(self):
+        """处理已经完成的校验（在驱动循环中调用），没有通过校验的文件按失败处理，可以重试"""
+        while True:
+            try:
+                host, task, future = self._verified.get_nowait()
+            except queue.Empty:
+                return
+            self.verifying -= 1
+            try:
+                success, result = future.result()
+            except Exception as e:
+                success, result = False, DownloadFailure(f"校验异常 {task.url}: {str(e)}", "任务异常")
+                self.downloader.events.emit('file_failed', result, EventLog.ERROR, url=task.url,
+                                            reason=result.reason)
+            self._complete(host, task, success, result)
+    
+    def _complete(self, host, task, success, result):
+        """任务的最终结果：失败且可重试时排队重试，否则计入统计并交给on_result"""
+        downloader = self.downloader
+        if not success and self._schedule_retry(host, task, result):
+            return
+        
+        if task.owner:
+            task.owner = False
+            key = (task.group, task.url)
+            self._downloading_urls.discard(key)
+            for waiting_task in self._waiting.pop(key, ()):
+                self._add(waiting_task)
+        
+        downloader.record_result(task.url, success, getattr(result, 'reason', None))
+        on_result = task.on_result or self.on_result
+        if on_result:
+            on_result(task.url, success, result)
+    
+    @staticmethod
+    def _size_of(file_path):
+        try:
+            return os.path.getsize(file_path)
+        except (OSError, TypeError):
+            return 0
+    
+    def _schedule_retry(self, host, task, failure):
+        """可重试的失败安排延迟重试或放入第二轮，返回是否已安排"""
+        policy = self.downloader.retry_policy
+        if task.final or not getattr(failure, 'retryable', False):
+            return False
+        if task.attempt < policy.max_attempts:
+            delay = policy.delay(task.attempt, failure.retry_after)
+            task.attempt += 1
+            self.downloader.record_retry(failure.reason)
+            self.downloader.events.emit(
+                'retry', f"⏳ {failure.reason}，{delay:.1f}秒后第{task.attempt}次尝试: {task.url}",
+                url=task.url, reason=failure.reason, attempt=task.attempt, delay=round(delay, 3))
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), host, task))
+            return True
+        if policy.second_pass:
+            task.final = True
+            self.downloader.record_retry(failure.reason)
+            self._second_pass.append(task)
+            return True
+        return False
+    
+    def close(self):
+        """整批任务结束"""
+        if self.controller:
+            self.downloader.adaptive_limits.update(self.controller.limits)
+        if self.downloader.journal:
+            self.downloader.journal.set_batch_finished(True)
+
+
+class FileTypeSniffer:
+    """
+    根据文件开头的字节识别文件类型
+    
+    签名表在创建时按"偏移位置 + 该位置的首字节"建好索引，检测时只比较
+    首字节相同的签名（更长、更具体的签名优先），不再逐个扫描整张表。
+    签名可以由多段组成，如RIFF容器在第8字节区分WAV/AVI/WEBP，
+    MP4/MOV/HEIC在第4字节的ftyp后区分品牌，tar的标记在第257字节。
+    ZIP文件再读取本地文件头中的文件名，区分docx/xlsx/pptx、epub和OpenDocument。
+    只需要响应流开头的几KB数据。
+    """
+    
+    # ZIP中出现这些目录说明是Office Open XML文档
+    OOXML_DIRECTORIES = ((b'word/', '.docx'), (b'xl/', '.xlsx'), (b'ppt/', '.pptx'))
+    
+    # epub和OpenDocument的第一个文件是未压缩的mimetype
+    ZIP_MIMETYPES = {
+        'application/epub+zip': '.epub',
+        'application/vnd.oasis.opendocument.text': '.odt',
+        'application/vnd.oasis.opendocument.spreadsheet': '.ods',
+        'application/vnd.oasis.opendocument.presentation': '.odp',
+    }
+    
+    # PDF规范允许文件头前面有少量其他字节
+    PDF_HEADER_WINDOW = 1024
+    
+    def __init__(self, signatures):
+        """
+        Args:
+            signatures: [(扩展名, ((偏移, 标记字节), ...)), ...]，所有段都匹配才算命中
+        """
+        # 偏移 -> 该位置的首字节 -> [(标记字节, 其余各段, 扩展名)]
+        index = {}
+        for extension, parts in signatures:
+            (offset, magic), rest = parts[0], tuple(parts[1:])
+            index.setdefault(offset, {}).setdefault(magic[0], []).append((magic, rest, extension))
+        for by_byte in index.values():
+            for candidates in by_byte.values():
+                candidates.sort(key=lambda item: -(len(item[0]) + sum(len(more) for _, more in item[1])))
+        self._index = sorted(index.items())
+    
+    def sniff(self, sample):
+        """
+        Args:
+            sample (bytes): 文件开头的字节
+            
+        Returns:
+            str: 文件扩展名，无法识别时返回None
+        """
+        if not sample:
+            return None
+        size = len(sample)
+        for offset, by_byte in self._index:
+            if offset >= size:
+                break
+            candidates = by_byte.get(sample[offset])
+            if not candidates:
+                continue
+            for magic, rest, extension in candidates:
+                if not sample.startswith(magic, offset):
+                    continue
+                for position, more in rest:
+                    if not sample.startswith(more, position):
+                        break
+                else:
+                    if extension == '.zip':
+                        return self.sniff_zip(sample) or extension
+                    return extension
+        if sample.find(b'%PDF-', 0, self.PDF_HEADER_WINDOW) >= 0:
+            return '.pdf'
+        return None
+    
+    @classmethod
+    def sniff_zip(cls, sample):
+        """从ZIP本地文件头中的文件名识别基于ZIP的文档格式，无法识别时返回None"""
+        position = 0
+        while True:
+            position = sample.find(b'PK\x03\x04', position)
+            if position < 0 or position + 30 > len(sample):
+                return None
+            compressed_size, = struct.unpack_from('<I', sample, position + 18)
+            name_length, extra_length = struct.unpack_from('<HH', sample, position + 26)
+            name_start = position + 30
+            name = sample[name_start:name_start + name_length]
+            if name == b'mimetype':
+                data_start = name_start + name_length + extra_length
+                mimetype = bytes(sample[data_start:data_start + compressed_size]).decode('ascii', 'ignore')
+                if mimetype.strip() in cls.ZIP_MIMETYPES:
+                    return cls.ZIP_MIMETYPES[mimetype.strip()]
+            for directory, extension in cls.OOXML_DIRECTORIES:
+                if name.startswith(directory):
+                    return extension
+            position += 4
+
 
 class PDFDownloader:
-    def __init__(self, download_folder="downloads", max_workers=5):
+    # 批量下载时显示在并发数后面的引擎说明
+    ENGINE_LABEL = ""
+    
+    # 统计下载耗时的各阶段：DNS解析、建立连接(TCP/TLS)、首字节、传输
+    PHASES = ('dns', 'connect', 'ttfb', 'transfer')
+    
+    # 以下类型表在类上只建一次，所有实例共用
+    
+    # 文件类型映射表 - Content-Type 到扩展名
+    content_type_map = {
+        # PDF文件
+        'application/pdf': '.pdf',
+        'application/x-pdf': '.pdf',
+            
+        # 图片文件
+        'image/jpeg': '.jpg',
+        'image/jpg': '.jpg', 
+        'image/png': '.png',
+        'image/gif': '.gif',
+        'image/bmp': '.bmp',
+        'image/webp': '.webp',
+        'image/svg+xml': '.svg',
+        'image/tiff': '.tiff',
+            
+        # 文档文件
+        'application/msword': '.doc',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+        'application/vnd.ms-excel': '.xls',
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+        'application/vnd.ms-powerpoint': '.ppt',
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
+            
+        # 文本文件
+        'text/plain': '.txt',
+        'text/html': '.html',
+        'text/css': '.css',
+        'text/javascript': '.js',
+        'application/json': '.json',
+        'text/xml': '.xml',
+        'application/xml': '.xml',
+            
+        # 压缩文件
+        'application/zip': '.zip',
+        'application/x-rar-compressed': '.rar',
+        'application/x-7z-compressed': '.7z',
+        'application/x-tar': '.tar',
+        'application/gzip': '.gz',
+        'application/epub+zip': '.epub',
+            
+        # 音频文件
+        'audio/mpeg': '.mp3',
+        'audio/wav': '.wav',
+        'audio/flac': '.flac',
+        'audio/aac': '.aac',
+            
+        # 视频文件
+        'video/mp4': '.mp4',
+        'video/avi': '.avi',
+        'video/quicktime': '.mov',
+        'video/x-msvideo': '.avi',
+        'video/webm': '.webm',
+            
+        # 其他常见格式
+        'application/octet-stream': None,  # 需要进一步检测
+    }
+    
+    # 文件头签名检测（用于Content-Type不可靠的情况）：(扩展名, ((偏移, 标记字节), ...))
+    file_signatures = (
+        ('.pdf', ((0, b'%PDF'),)),                              # PDF
+        ('.jpg', ((0, b'\xFF\xD8\xFF'),)),                       # JPEG
+        ('.png', ((0, b'\x89PNG'),)),                            # PNG
+        ('.gif', ((0, b'GIF8'),)),                              # GIF
+        ('.bmp', ((0, b'BM'),)),                                # BMP
+        ('.tiff', ((0, b'II*\x00'),)),                          # TIFF (小端)
+        ('.tiff', ((0, b'MM\x00*'),)),                          # TIFF (大端)
+        ('.webp', ((0, b'RIFF'), (8, b'WEBP'))),                # WEBP
+        ('.wav', ((0, b'RIFF'), (8, b'WAVE'))),                 # WAV
+        ('.avi', ((0, b'RIFF'), (8, b'AVI '))),                 # AVI
+        ('.zip', ((0, b'PK\x03\x04'),)),                        # ZIP (再根据内容区分docx, xlsx等)
+        ('.zip', ((0, b'PK\x05\x06'),)),                        # ZIP (空档案)
+        ('.zip', ((0, b'PK\x07\x08'),)),                        # ZIP
+        ('.doc', ((0, b'\xD0\xCF\x11\xE0'),)),                  # DOC/XLS/PPT (老格式)
+        ('.rar', ((0, b'Rar!'),)),                              # RAR
+        ('.7z', ((0, b"7z\xBC\xAF'\x1C"),)),                     # 7z
+        ('.gz', ((0, b'\x1F\x8B'),)),                           # gzip
+        ('.flac', ((0, b'fLaC'),)),                             # FLAC
+        ('.mp3', ((0, b'ID3'),)),                               # MP3 (带ID3标签)
+        ('.webm', ((0, b'\x1A\x45\xDF\xA3'),)),                 # WebM/Matroska
+        ('.mov', ((4, b'ftypqt  '),)),                          # QuickTime
+        ('.heic', ((4, b'ftypheic'),)),                         # HEIC
+        ('.heic', ((4, b'ftypmif1'),)),                         # HEIF
+        ('.avif', ((4, b'ftypavif'),)),                         # AVIF
+        ('.m4a', ((4, b'ftypM4A '),)),                          # M4A
+        ('.mp4', ((4, b'ftyp'),)),                              # MP4 (其他品牌)
+        ('.tar', ((257, b'ustar'),)),                           # tar
+        ('.elf', ((0, b'\x7FELF'),)),                           # ELF执行文件
+        ('.exe', ((0, b'MZ'),)),                                # Windows可执行文件
+    )
+    file_sniffer = FileTypeSniffer(file_signatures)
+    
+    # URL路径中的扩展名映射
+    url_extensions = {
+        '.pdf': '.pdf', '.doc': '.doc', '.docx': '.docx',
+        '.xls': '.xls', '.xlsx': '.xlsx', '.ppt': '.ppt', '.pptx': '.pptx',
+        '.jpg': '.jpg', '.jpeg': '.jpg', '.png': '.png', '.gif': '.gif',
+        '.bmp': '.bmp', '.webp': '.webp', '.svg': '.svg',
+        '.txt': '.txt', '.html': '.html', '.htm': '.html',
+        '.zip': '.zip', '.rar': '.rar', '.7z': '.7z',
+        '.mp3': '.mp3', '.wav': '.wav', '.mp4': '.mp4', '.avi': '.avi'
+    }
+    
+    def __init__(self, download_folder="downloads", max_workers=5, pool_maxsize=None,
+                 pool_connections=100, max_per_host=None, max_connections=None, resume=False,
+                 cache_dir=None, cache_max_bytes=10 * 1024 ** 3, dedup=False, max_pending=None,
+                 retry_policy=None, adaptive=False, segments=4, segment_threshold=64 * 1024 ** 2,
+                 buffer_size=256 * 1024, preallocate=True, verbosity='normal', event_log=None,
+                 metrics_file=None, progress_interval=10.0, journal_name=None, bandwidth_limit=None,
+                 request_rate=None, host_bandwidth_limit=None, host_request_rate=None, preflight=False,
+                 archive=None, verify=False, verify_workers=2, dns_ttl=300.0, resolver=None, warmup=False,
+                 warmup_hosts=8):
         """
         初始化PDF下载器
         
         Args:
             download_folder (str): 下载文件保存的文件夹路径
             max_workers (int): 最大并发下载数
+            pool_maxsize (int): 每个主机保留的keep-alive连接数，默认与max_workers相同
+            pool_connections (int): 连接池最多缓存多少个主机的连接
+            max_per_host (int): 每个主机最多同时下载数，None表示不限制
+            max_connections (int): 全局最多同时下载数，默认等于max_workers
+            resume (bool): 是否在下载文件夹中记录断点续传日志，
+                重新运行同一批任务时跳过已完成的文件并续传未完成的文件
+            cache_dir (str): 跨批次下载缓存的文件夹，为None时不使用缓存。
+                服务器确认文件未变化(304)时直接从缓存取文件，不再重新传输
+            cache_max_bytes (int): 下载缓存的总大小上限（字节）
+            dedup (bool): 是否去重。同一批任务中重复的URL只下载一次，
+                内容完全相同的文件只保存一份，其余文件名以硬链接指向它
+            max_pending (int): 批量下载时最多预先读入、等待分发的任务数，
+                默认为并发数的4倍。输入列表再大，内存中也只保留这么多任务
+            retry_policy (RetryPolicy): 批量下载的失败重试策略，默认RetryPolicy()；
+                不需要重试时传入 RetryPolicy(max_attempts=1, second_pass=False)
+            adaptive (bool): 是否按主机自适应调整并发数。根据吞吐量、耗时和限流情况
+                在运行中增减每个主机的并发，max_workers（及max_per_host）作为上限
+            segments (int): 大文件分成几段、用几个连接并行下载，1表示不分段
+            segment_threshold (int): 服务器支持Range且文件不小于这个字节数时才分段下载
+            buffer_size (int): 每个下载读写数据用的缓冲区大小（字节），
+                每个下载线程各占一个，并发很高时可以适当调小
+            preallocate (bool): 响应带Content-Length时是否预先分配文件空间
+            verbosity (str): 输出详细程度：'quiet'只显示错误和统计，'normal'每个文件一行，
+                'verbose'显示类型检测、文件名修正等全部细节
+            event_log (str): JSON Lines事件日志的文件路径，为None时不记录
+            metrics_file (str): Prometheus文本格式的指标文件路径，为None时不输出
+            progress_interval (float): 批量下载时输出进度和更新指标文件的间隔（秒），0表示不输出
+            journal_name (str): 断点续传日志的文件名，默认 .download_journal.sqlite3
+            bandwidth_limit (float): 全局带宽上限（字节/秒），None表示不限制
+            request_rate (float): 全局每秒最多发起的请求数
+            host_bandwidth_limit (float): 每个主机的带宽上限（字节/秒）
+            host_request_rate (float): 每个主机每秒最多发起的请求数。
+                限制都可以在运行中用set_rate_limits()调整
+            preflight (bool): 批量下载前是否先并发预检所有链接（HEAD请求，不支持时只取开头字节），
+                得到文件大小、类型和是否支持续传，按从大到小的顺序下载，并在开始前报告总大小和预计用时
+            archive (str): 把下载的文件直接写入这个归档（.zip、.tar或.tar.gz），不再单独保存到
+                下载文件夹，文件名和重名加后缀的规则不变。为None时保存为单独的文件。
+                归档模式不能与resume、cache_dir、dedup同时使用，大文件也不分段下载；批量下载结束时
+                自动写好归档目录，单独调用download_single_pdf_with_name等方法后需要调用sink.close()
+            verify (bool): 批量下载时是否校验下载的文件：收到的字节数与Content-Length是否一致、
+                文件结构是否完整（PDF的%%EOF、ZIP的中央目录、图片的开头和结尾），Excel第三列
+                提供了哈希值时再比对哈希。没有通过的文件删除后按可重试的失败处理
+            verify_workers (int): 校验文件的线程数，校验不占用下载并发
+            dns_ttl (float): DNS解析结果在进程内缓存的秒数，0或None表示不缓存（每个新连接都重新解析，
+                解析时间计入建立连接的时间）
+            resolver: 解析主机名的函数，参数与返回值同socket.getaddrinfo，默认使用系统解析
+            warmup (bool): 批量下载前是否先读入全部任务，并发解析所有主机，
+                并为任务最多的几个主机预先建立keep-alive连接（异步引擎只预先解析）
+            warmup_hosts (int): 预先建立连接的主机数，每个主机建立的连接数不超过它的任务数和单主机并发上限
         """
+        if archive and (resume or cache_dir or dedup):
+            raise ValueError("归档输出不能与断点续传(resume)、下载缓存(cache_dir)、去重(dedup)同时使用")
         self.download_folder = Path(download_folder)
         self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.max_connections = min(max_connections or max_workers, max_workers)
+        self.max_pending = max_pending or self.max_connections * 4
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = RateLimiter(bandwidth_limit, request_rate, host_bandwidth_limit, host_request_rate)
+        self.adaptive = adaptive
+        self.adaptive_limits = {}  # 自适应并发：各主机最后的并发数
+        self.segments = max(1, segments)
+        # 各文件的额外分段共用一个线程池，同时进行的分段数由调度器的名额限制
+        self.segment_pool = (ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix='segment')
+                             if self.segments > 1 else None)
+        self.segment_threshold = segment_threshold
+        self.buffer_size = buffer_size
+        self.preallocate = preallocate
+        self.events = EventLog(verbosity, event_log, metrics_file, progress_interval,
+                               snapshot=self.progress_snapshot)
         self.session = requests.Session()
         
+        # 进程内DNS缓存，两个下载引擎共用
+        self.dns_cache = DNSCache(dns_ttl, resolver=resolver) if dns_ttl else None
+        self.warmup = warmup
+        self.warmup_hosts = warmup_hosts
+        self.warmup_report = None  # 最近一次预热的结果，见warm_up()
+        
+        # 连接池至少要容纳所有工作线程，否则多出来的连接用完即被丢弃，无法复用
+        self.connection_stats = ConnectionStats()
+        adapter = CountingHTTPAdapter(
+            self.connection_stats,
+            self.dns_cache,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize or max(max_workers, 10),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
         # 设置请求头，模拟浏览器访问
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -29,87 +2212,64 @@ class PDFDownloader:
         
         # 创建下载文件夹
         self.download_folder.mkdir(parents=True, exist_ok=True)
+        self.sink = ArchiveSink(archive) if archive else DirectorySink(self.download_folder)
+        
+        # 下载后的校验在单独的线程池中进行
+        self.verify = verify
+        self.verifier = ThreadPoolExecutor(max_workers=verify_workers, thread_name_prefix='verify') if verify else None
+        # URL -> (哈希算法, 十六进制哈希值)，来自Excel第三列；批量下载读入任务时转入任务所在的TaskGroup
+        self.expected_hashes = {}
         
         # 统计信息
         self.success_count = 0
         self.failed_count = 0
         self.failed_urls = []
+        self.request_count = 0  # 实际发出的HTTP请求数
+        self.bytes_downloaded = 0  # 从网络下载的字节数
+        self.in_progress = 0  # 正在下载的文件数
+        self.phase_seconds = Counter()  # 各阶段（DNS解析、连接、首字节、传输）的累计耗时
+        self.timed_files = 0  # 计入phase_seconds的文件数
+        self.throttled_seconds = 0.0  # 因带宽和请求速率限制累计等待的秒数（各下载合计）
+        self.preflight = preflight
+        self._batch_started = None
+        self._active_run = None  # 正在执行的BatchRun，进度中的任务总数和预计字节数从这里读取
+        self.retry_reasons = Counter()  # 重试次数，按失败原因分类
+        self.failure_reasons = Counter()  # 最终失败的任务数，按失败原因分类
+        self.skipped_count = 0  # 断点续传：之前已完成而跳过的文件数
+        self.resumed_count = 0  # 断点续传：从 .part 文件断点继续的文件数
+        self.cache_hit_count = 0  # 下载缓存：服务器确认未变化、直接使用缓存的文件数
+        self.cache_hit_bytes = 0  # 下载缓存：因此少传输的字节数
+        self.dedup_url_count = 0  # 去重：重复URL直接链接到已下载文件的次数
+        self.dedup_content_count = 0  # 去重：内容相同、改为硬链接的文件数
+        self.dedup_bytes_saved = 0  # 去重：节省的磁盘空间（字节）
+        self.verified_count = 0  # 校验：通过校验的文件数
+        self.verify_failed_count = 0  # 校验：没有通过校验的次数（之后会重试）
+        self._stats_lock = threading.Lock()
         
-        # 文件名计数器，用于处理重复文件名
-        self.filename_counter = {}
+        # 断点续传日志
+        self.journal = DownloadJournal(self.download_folder, journal_name) if resume else None
         
-        # 文件类型映射表 - Content-Type 到扩展名
-        self.content_type_map = {
-            # PDF文件
-            'application/pdf': '.pdf',
-            'application/x-pdf': '.pdf',
-            
-            # 图片文件
-            'image/jpeg': '.jpg',
-            'image/jpg': '.jpg', 
-            'image/png': '.png',
-            'image/gif': '.gif',
-            'image/bmp': '.bmp',
-            'image/webp': '.webp',
-            'image/svg+xml': '.svg',
-            'image/tiff': '.tiff',
-            
-            # 文档文件
-            'application/msword': '.doc',
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
-            'application/vnd.ms-excel': '.xls',
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
-            'application/vnd.ms-powerpoint': '.ppt',
-            'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
-            
-            # 文本文件
-            'text/plain': '.txt',
-            'text/html': '.html',
-            'text/css': '.css',
-            'text/javascript': '.js',
-            'application/json': '.json',
-            'text/xml': '.xml',
-            'application/xml': '.xml',
-            
-            # 压缩文件
-            'application/zip': '.zip',
-            'application/x-rar-compressed': '.rar',
-            'application/x-7z-compressed': '.7z',
-            'application/x-tar': '.tar',
-            'application/gzip': '.gz',
-            
-            # 音频文件
-            'audio/mpeg': '.mp3',
-            'audio/wav': '.wav',
-            'audio/flac': '.flac',
-            'audio/aac': '.aac',
-            
-            # 视频文件
-            'video/mp4': '.mp4',
-            'video/avi': '.avi',
-            'video/quicktime': '.mov',
-            'video/x-msvideo': '.avi',
-            'video/webm': '.webm',
-            
-            # 其他常见格式
-            'application/octet-stream': None,  # 需要进一步检测
-        }
+        # 跨批次下载缓存
+        self.cache = DownloadCache(cache_dir, cache_max_bytes) if cache_dir else None
         
-        # 文件头签名检测（用于Content-Type不可靠的情况）
-        self.file_signatures = {
-            b'\x25\x50\x44\x46': '.pdf',  # PDF
-            b'\xFF\xD8\xFF': '.jpg',       # JPEG
-            b'\x89\x50\x4E\x47': '.png',   # PNG
-            b'\x47\x49\x46\x38': '.gif',   # GIF
-            b'\x42\x4D': '.bmp',           # BMP
-            b'\x50\x4B\x03\x04': '.zip',   # ZIP (也可能是docx, xlsx等)
-            b'\x50\x4B\x05\x06': '.zip',   # ZIP (空档案)
-            b'\x50\x4B\x07\x08': '.zip',   # ZIP
-            b'\xD0\xCF\x11\xE0': '.doc',   # DOC/XLS/PPT (老格式)
-            b'\x52\x61\x72\x21': '.rar',   # RAR
-            b'\x7F\x45\x4C\x46': '.elf',   # ELF执行文件
-            b'\x4D\x5A': '.exe',           # Windows可执行文件
-        }
+        # 去重索引按任务组分开（见TaskGroup），不在批量下载中的单独下载共用_standalone_group
+        self.dedup = dedup
+        self._standalone_group = TaskGroup()
+        self._dedup_lock = threading.Lock()
+        
+        # 文件名预留索引：已占用的文件名（含未完成的 .part）-> 取名时请求的原始文件名，
+        # 第一次取名时列一次下载文件夹建立，之后只在内存中查找
+        self._reserved_names = None
+        # 文件名计数器：原始文件名 -> 重名时下次尝试的编号，不必每次从-1开始逐个尝试
+        self.filename_counter = {}
+        self._name_lock = threading.Lock()
+    
+    # 类型检测时从响应流开头读取的字节数（tar标记在第257字节，识别docx等需要读到ZIP中的前几个文件名）
+    SNIFF_SIZE = 4096
+    
+    def _log(self, message, level=EventLog.INFO):
+        """输出一条消息（由后台线程打印，不阻塞下载）"""
+        self.events.emit(None, message, level)
     
     def detect_file_type_from_content(self, content_sample):
         """
@@ -121,23 +2281,17 @@ class PDFDownloader:
         Returns:
             str: 文件扩展名，如果无法识别返回None
         """
-        if not content_sample:
-            return None
-            
-        # 检查文件头签名
-        for signature, extension in self.file_signatures.items():
-            if content_sample.startswith(signature):
-                return extension
-        
-        return None
+        return self.file_sniffer.sniff(content_sample)
     
-    def detect_file_type_from_response(self, response, url):
+    def detect_file_type_from_response(self, response, url, content_sample=None):
         """
         从HTTP响应检测文件类型
         
         Args:
             response: requests.Response对象
             url (str): 请求的URL
+            content_sample (bytes): 已从响应流中预读的开头字节，
+                为None时会直接从响应流读取（会消耗流中的数据）
             
         Returns:
             str: 检测到的文件扩展名
@@ -149,22 +2303,23 @@ class PDFDownloader:
         if content_type in self.content_type_map:
             detected_ext = self.content_type_map[content_type]
             if detected_ext:
-                print(f"🔍 从Content-Type检测到文件类型: {content_type} -> {detected_ext}")
+                self._log(f"🔍 从Content-Type检测到文件类型: {content_type} -> {detected_ext}", EventLog.DEBUG)
         
-        # 2. 如果Content-Type检测失败或者是application/octet-stream，尝试文件头检测
-        if not detected_ext or content_type == 'application/octet-stream':
-            # 读取前64字节进行文件头检测
-            content_sample = b''
+        # 2. 如果Content-Type检测失败、是application/octet-stream或只说明是ZIP，尝试文件头检测
+        if self._needs_sniff(response):
+            # 读取开头的字节进行文件头检测
             try:
-                for chunk in response.iter_content(chunk_size=64):
-                    content_sample = chunk
-                    break
+                if content_sample is None:
+                    content_sample = b''
+                    for chunk in response.iter_content(chunk_size=self.SNIFF_SIZE):
+                        content_sample = chunk
+                        break
                 
                 if content_sample:
                     header_ext = self.detect_file_type_from_content(content_sample)
                     if header_ext:
                         detected_ext = header_ext
-                        print(f"🔍 从文件头检测到文件类型: {header_ext}")
+                        self._log(f"🔍 从文件头检测到文件类型: {header_ext}", EventLog.DEBUG)
                         
             except:
                 pass
@@ -174,40 +2329,31 @@ class PDFDownloader:
             parsed_url = urlparse(url)
             url_path = unquote(parsed_url.path).lower()
             
-            # 常见扩展名映射
-            url_extensions = {
-                '.pdf': '.pdf', '.doc': '.doc', '.docx': '.docx',
-                '.xls': '.xls', '.xlsx': '.xlsx', '.ppt': '.ppt', '.pptx': '.pptx',
-                '.jpg': '.jpg', '.jpeg': '.jpg', '.png': '.png', '.gif': '.gif',
-                '.bmp': '.bmp', '.webp': '.webp', '.svg': '.svg',
-                '.txt': '.txt', '.html': '.html', '.htm': '.html',
-                '.zip': '.zip', '.rar': '.rar', '.7z': '.7z',
-                '.mp3': '.mp3', '.wav': '.wav', '.mp4': '.mp4', '.avi': '.avi'
-            }
-            
-            for ext in url_extensions:
-                if url_path.endswith(ext):
-                    detected_ext = url_extensions[ext]
-                    print(f"🔍 从URL路径检测到文件类型: {ext}")
-                    break
+            ext = os.path.splitext(url_path)[1]
+            if ext in self.url_extensions:
+                detected_ext = self.url_extensions[ext]
+                self._log(f"🔍 从URL路径检测到文件类型: {ext}", EventLog.DEBUG)
         
         # 4. 如果所有方法都失败，根据Content-Type大类给默认扩展名
         if not detected_ext:
             if 'image' in content_type:
                 detected_ext = '.jpg'
-                print(f"🔍 根据Content-Type大类指定为图片: {detected_ext}")
+                self._log(f"🔍 根据Content-Type大类指定为图片: {detected_ext}", EventLog.DEBUG)
             elif 'text' in content_type:
                 detected_ext = '.txt'
-                print(f"🔍 根据Content-Type大类指定为文本: {detected_ext}")
-            elif 'application' in content_type:
-                detected_ext = '.pdf'  # 默认假设是PDF
-                print(f"🔍 无法识别具体类型，默认设为PDF: {detected_ext}")
+                self._log(f"🔍 根据Content-Type大类指定为文本: {detected_ext}", EventLog.DEBUG)
             else:
                 detected_ext = '.bin'  # 二进制文件
-                print(f"🔍 完全无法识别，设为二进制文件: {detected_ext}")
+                self._log(f"🔍 完全无法识别，设为二进制文件: {detected_ext}", EventLog.DEBUG)
         
         return detected_ext or '.unknown'
     
+    def _needs_sniff(self, response):
+        """Content-Type不足以确定文件类型（未知、application/octet-stream或只说明是ZIP），需要看文件头"""
+        content_type = response.headers.get('content-type', '').lower().split(';')[0].strip()
+        detected_ext = self.content_type_map.get(content_type)
+        return not detected_ext or detected_ext == '.zip' or content_type == 'application/octet-stream'
+    
     def get_filename_from_url(self, url):
         """从URL中提取文件名"""
         parsed_url = urlparse(url)
@@ -215,207 +2361,1557 @@ class PDFDownloader:
         
         # 如果URL中没有文件名，生成一个基于URL的文件名
         if not filename or filename == '/' or '.' not in filename:
-            # 使用域名加上路径的hash作为文件名
+            # 使用域名加上URL的hash作为文件名（不用内置hash()，它每个进程的结果都不同，
+            # 重新运行时文件名和断点续传的任务键都会变化）
             domain = parsed_url.netloc.replace('www.', '').replace('.', '_')
-            url_hash = abs(hash(url)) % 10000
+            url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()[:8]
             filename = f"{domain}_{url_hash}"
             # 注意：这里不添加扩展名，会在下载时动态检测
         
         return filename
     
+    def apply_detected_extension(self, url, filename, detected_extension):
+        """
+        按检测到的文件类型修正文件名的扩展名
+        
+        Args:
+            url (str): 文件下载链接
+            filename (str): 指定的文件名，为None时从URL自动提取
+            detected_extension (str): 检测到的扩展名
+            
+        Returns:
+            str: 修正后的文件名
+        """
+        if filename is None:
+            # 从URL提取基础文件名
+            base_filename = self.get_filename_from_url(url)
+            
+            # 如果基础文件名已经有扩展名，检查是否与检测到的一致
+            if '.' in base_filename:
+                current_ext = '.' + base_filename.split('.')[-1].lower()
+                if current_ext != detected_extension:
+                    # 扩展名不匹配，用检测到的扩展名替换
+                    base_filename = base_filename.rsplit('.', 1)[0] + detected_extension
+                    self._log(f"🔄 文件扩展名已更正为: {detected_extension}", EventLog.DEBUG)
+            else:
+                # 没有扩展名，添加检测到的扩展名
+                base_filename = base_filename + detected_extension
+                self._log(f"➕ 已添加文件扩展名: {detected_extension}", EventLog.DEBUG)
+            return base_filename
+        
+        if '.' in filename:
+            # 用户指定的文件名有扩展名，检查是否与检测到的一致
+            current_ext = '.' + filename.split('.')[-1].lower()
+            if current_ext != detected_extension:
+                # 扩展名不匹配，给用户提示并使用检测到的扩展名
+                base_name = filename.rsplit('.', 1)[0]
+                filename = base_name + detected_extension
+                self._log(f"🔄 文件扩展名已从 {current_ext} 更正为: {detected_extension}", EventLog.DEBUG)
+            else:
+                self._log(f"✅ 文件扩展名正确: {current_ext}", EventLog.DEBUG)
+        else:
+            # 用户指定的文件名没有扩展名，添加检测到的扩展名
+            filename = filename + detected_extension
+            self._log(f"➕ 已添加文件扩展名: {detected_extension}", EventLog.DEBUG)
+        return filename
+    
     def get_unique_filename(self, base_filename):
-        """获取唯一的文件名，处理重复情况"""
-        file_path = self.download_folder / base_filename
+        """
+        获取唯一的文件名并预留，处理重复情况
+        
+        在加锁的预留索引中查找，多个线程同时取名不会拿到同一个名字；选中的名字再由
+        输出位置占住（下载文件夹中以独占方式创建 .part 文件，其他进程也不会再用它）。
+        重名时添加-1、-2、-3等后缀。
+        """
+        name_stem = Path(base_filename).stem
+        name_suffix = Path(base_filename).suffix
+        
+        with self._name_lock:
+            if self._reserved_names is None:
+                self._reserved_names = self._scan_names()
+            
+            new_filename = base_filename
+            counter = self.filename_counter.get(base_filename, 1)
+            while not self._claim_name(new_filename, base_filename):
+                new_filename = f"{name_stem}-{counter}{name_suffix}"
+                counter += 1
+            self.filename_counter[base_filename] = counter
+            return new_filename
+    
+    # Windows和macOS的文件系统默认不区分文件名大小写
+    CASE_INSENSITIVE_NAMES = sys.platform in ('win32', 'darwin')
+    
+    @classmethod
+    def _name_key(cls, filename):
+        return filename.casefold() if cls.CASE_INSENSITIVE_NAMES else filename
+    
+    def _scan_names(self):
+        """输出位置中已被占用的文件名"""
+        return {self._name_key(name): None for name in self.sink.existing_names()}
+    
+    def _claim_name(self, filename, base_filename):
+        """尝试预留文件名，调用时需持有_name_lock"""
+        key = self._name_key(filename)
+        if key in self._reserved_names:
+            return False
+        if not self.sink.claim(filename):
+            # 列目录之后被其他进程占用
+            self._reserved_names[key] = None
+            return False
+        self._reserved_names[key] = base_filename
+        return True
+    
+    def _release_name(self, file_path):
+        """下载失败且不会续传时删除 .part 文件并释放文件名，重试时可以继续使用这个名字"""
+        with self._name_lock:
+            if not self.sink.release(file_path.name) or self._reserved_names is None:
+                # 还没有取过名时，删除 .part 之后再列目录自然不会包含这个名字
+                return
+            base_filename = self._reserved_names.pop(self._name_key(file_path.name), None)
+            if base_filename is not None:
+                self.filename_counter.pop(base_filename, None)
+    
+    @staticmethod
+    def part_path(file_path):
+        """下载过程中使用的临时文件路径，下载完成后才重命名为正式文件名"""
+        return file_path.with_name(file_path.name + '.part')
+    
+    def _open_stream(self, url, headers=None):
+        """
+        发起流式GET请求并计入请求统计
+        
+        返回的响应带有download_timing属性：{'dns': DNS解析秒数, 'connect': 建立连接(TCP/TLS)秒数,
+        'ttfb': 发出请求到收到响应头的秒数（不含解析和建立连接）, 'headers_at': 收到响应头的时刻}
+        没有使用DNS缓存时解析时间计入connect。
+        """
+        wait = self._request_wait(url)
+        if wait:
+            self._throttle(wait)
+        with self._stats_lock:
+            self.request_count += 1
+        self.connection_stats.take_connect_time()
+        start = time.perf_counter()
+        response = self.session.get(url, stream=True, timeout=30, headers=headers)
+        headers_at = time.perf_counter()
+        dns, connect = self.connection_stats.take_connect_time()
+        response.download_timing = {'dns': dns, 'connect': connect,
+                                    'ttfb': max(headers_at - start - dns - connect, 0.0), 'headers_at': headers_at}
+        try:
+            response.raise_for_status()
+        except BaseException:
+            # 错误响应不会被读取，先关闭以便连接回到连接池
+            response.close()
+            raise
+        return response
+    
+    def _request_wait(self, url):
+        """发起请求前需要等待的秒数（批量调度器分发任务时已经扣除过令牌的请求不再扣除）"""
+        prepaid = _prepaid_request.get()
+        if prepaid is not None:
+            _prepaid_request.set(None)
+            return prepaid
+        if not self.rate_limiter.limits_requests:
+            return 0.0
+        return self.rate_limiter.reserve_request(HostScheduler.host_of(url))
+    
+    def _record_throttle(self, seconds):
+        with self._stats_lock:
+            self.throttled_seconds += seconds
+    
+    def _throttle(self, seconds):
+        """按限速等待（只睡眠一次，不轮询）"""
+        self._record_throttle(seconds)
+        time.sleep(seconds)
+    
+    def set_rate_limits(self, host=None, **limits):
+        """
+        运行中调整限速，没有传入的项保持不变，传入None取消这项限制
+        
+        Args:
+            host (str): 为None时调整全局和每个主机的默认限制（bandwidth、request_rate、
+                host_bandwidth、host_request_rate），否则只调整这个主机（bandwidth、request_rate）
+        """
+        if host is None:
+            self.rate_limiter.set_limits(**limits)
+        else:
+            self.rate_limiter.set_host_limits(host, **limits)
+        self.events.emit('rate_limits', f"🚦 限速已调整: {self.rate_limiter.describe() or '不限制'}",
+                         host=host, **limits)
+    
+    def warm_up(self, urls):
+        """
+        下载开始前预热：并发解析全部主机名存入DNS缓存，并为任务最多的warmup_hosts个主机
+        预先建立keep-alive连接，下载开始后直接复用，不必在工作线程中等待解析和握手
+        
+        Args:
+            urls: 本批全部任务的URL
+        
+        Returns:
+            dict: {'hosts': 主机数, 'failed': 解析失败的主机数, 'busy_hosts': 预先建立连接的主机数,
+                'connections': 建立的连接数, 'seconds': 用时}，同时保存在warmup_report
+        """
+        start = time.perf_counter()
+        origins = Counter()
+        for url in urls:
+            try:
+                parsed = urlparse(url)
+                port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            except ValueError:
+                continue
+            if parsed.scheme in ('http', 'https') and parsed.hostname:
+                origins[(parsed.scheme, parsed.hostname, port)] += 1
+        
+        failed = {}
+        if self.dns_cache:
+            failed = self.dns_cache.resolve_many({(host, port) for _, host, port in origins})
+        busy = [(origin, count) for origin, count in origins.most_common()
+                if (origin[1], origin[2]) not in failed][:self.warmup_hosts]
+        connections = self._open_warm_connections(busy) if busy else 0
+        
+        report = {
+            'hosts': len({(host, port) for _, host, port in origins}),
+            'failed': len(failed),
+            'busy_hosts': len(busy) if connections else 0,
+            'connections': connections,
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+        self.warmup_report = report
+        self.events.emit('warmup', f"🔥 预热完成: 解析 {report['hosts']} 个主机（{report['failed']} 个失败），"
+                                   f"预先建立 {connections} 个连接，用时 {report['seconds']:.2f}秒", **report)
+        return report
+    
+    def _connection_pool(self, url):
+        """
+        requests发送这个URL的请求时使用的urllib3连接池，经过代理时返回None
+        """
+        settings = self.session.merge_environment_settings(url, {}, None, None, None)
+        if requests.utils.select_proxy(url, settings['proxies']):
+            return None
+        adapter = self.session.get_adapter(url)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            request = requests.Request('GET', url).prepare()
+            return adapter.get_connection_with_tls_context(request, settings['verify'], settings['proxies'],
+                                                           settings['cert'])
+        return adapter.get_connection(url, settings['proxies'])
+    
+    def _open_warm_connections(self, origins):
+        """
+        为每个主机建立若干连接后放回requests的连接池，开始下载时直接复用
+        
+        每个主机的连接数不超过它的任务数、单主机并发上限和连接池大小。
+        
+        Args:
+            origins: [((协议, 主机, 端口), 任务数), ...]
+        
+        Returns:
+            int: 成功建立的连接数
+        """
+        per_host = min(self.max_per_host or self.max_connections, self.max_connections)
+        checked_out = []
+        for (scheme, host, port), count in origins:
+            url = f"{scheme}://{f'[{host}]' if ':' in host else host}:{port}/"
+            pool = self._connection_pool(url)
+            if pool is None:
+                continue
+            # 先全部取出再放回，否则放回的连接会被下一次取出（连接池后进先出）
+            for _ in range(min(count, per_host, pool.pool.maxsize)):
+                checked_out.append((pool, pool._get_conn()))
+        if not checked_out:
+            return 0
+        
+        def connect(item):
+            conn = item[1]
+            try:
+                conn.connect()
+                return True
+            except Exception:
+                conn.close()
+                return False
+            finally:
+                # 预热的耗时单独报告，不计入之后在这个线程中下载的文件
+                self.connection_stats.take_connect_time()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=min(32, len(checked_out)), thread_name_prefix='warmup') as executor:
+                return sum(executor.map(connect, checked_out))
+        finally:
+            for pool, conn in checked_out:
+                pool._put_conn(conn)
+    
+    def run_preflight(self, indexed_tasks):
+        """
+        并发预检批量任务的所有链接，报告总大小和预计用时，返回按大小排好序的任务
+        
+        从大到小下载（最长处理时间优先），最后剩下的都是小文件，整批完成得更早。
+        大小未知的排在最前面，预检失败和之前已完成的排在最后。调度器按主机轮转分发，
+        同一主机的任务保持这个顺序，所以每个主机也是大文件先下载
+        
+        Args:
+            indexed_tasks: (原序号, (url, filename)) 迭代器
+            
+        Returns:
+            tuple: (排好序的 (原序号, (url, filename)) 列表, {URL: PreflightInfo}, 预计下载的总字节数)
+        """
+        tasks = list(indexed_tasks)
+        finished = set()
+        if self.journal:
+            for index, (url, filename) in tasks:
+                entry = self.journal.get(DownloadJournal.make_key(index, url, filename))
+                if entry and entry['state'] == 'done':
+                    finished.add(index)
+        urls = list(dict.fromkeys(url for index, (url, filename) in tasks if index not in finished))
+        
+        started = time.monotonic()
+        self._log(f"🔎 预检 {len(urls)} 个链接...")
+        if urls:
+            with ThreadPoolExecutor(max_workers=min(self.max_connections, len(urls))) as executor:
+                preflight = dict(zip(urls, executor.map(self._probe, urls)))
+        else:
+            preflight = {}
+        elapsed = time.monotonic() - started
+        
+        def order(item):
+            index, (url, filename) = item
+            info = preflight.get(url)
+            if info is None or info.error:
+                return 2, 0
+            if info.size is None:
+                return 0, 0
+            return 1, -info.size
+        tasks.sort(key=order)
+        
+        # 去重时重复的URL只下载一次
+        if self.dedup:
+            sizes = [info.size for info in preflight.values()]
+        else:
+            sizes = [preflight[url].size for index, (url, filename) in tasks if index not in finished]
+        infos = preflight.values()
+        known = [size for size in sizes if size is not None]
+        expected = sum(known)
+        failed = sum(1 for info in infos if info.error)
+        unknown = sum(1 for info in infos if info.size is None and not info.error)
+        resumable = sum(1 for info in infos if info.resumable)
+        
+        message = (f"🔎 预检完成: {len(urls)} 个链接, 预计共 {expected / (1024 * 1024):.1f} MB"
+                   + (f", 最大 {max(known) / (1024 * 1024):.1f} MB" if known else "")
+                   + f", 支持断点续传 {resumable} 个")
+        if unknown:
+            message += f", 大小未知 {unknown} 个"
+        if failed:
+            message += f", 预检失败 {failed} 个"
+        if finished:
+            message += f", 之前已完成 {len(finished)} 个"
+        message += f" (用时 {elapsed:.1f}秒)"
+        self._log(message)
+        
+        # 只有设置了全局限速时才能在开始前给出可靠的预计用时，否则开始后按实际速度估算
+        estimates = []
+        if self.rate_limiter.bandwidth and expected:
+            estimates.append(expected / self.rate_limiter.bandwidth)
+        if self.rate_limiter.request_rate and len(urls) > 1:
+            estimates.append((len(urls) - 1) / self.rate_limiter.request_rate)
+        eta = max(estimates) if estimates else None
+        if eta is not None:
+            self._log(f"⏱️  按当前限速预计至少需要 {format_duration(eta)}")
+        else:
+            self._log("⏱️  预计剩余时间将在开始下载后按实际速度估算")
+        self.events.emit('preflight', urls=len(urls), expected_bytes=expected, unknown_size=unknown,
+                         failed=failed, resumable=resumable, skipped=len(finished),
+                         eta_seconds=round(eta, 1) if eta is not None else None,
+                         seconds=round(elapsed, 3))
+        return tasks, preflight, expected
+    
+    def _probe(self, url):
+        """
+        预检一个URL：先发HEAD请求；服务器不支持HEAD，或者Content-Type不足以确定类型
+        需要看文件头时，改为只取开头SNIFF_SIZE字节的Range请求
+        
+        Returns:
+            PreflightInfo: 预检结果
+        """
+        try:
+            head = self._probe_request(url, 'HEAD')
+            head.close()
+            if head.ok and not self._needs_sniff(head):
+                return self._preflight_info(head, self.detect_file_type_from_response(head, url, b''))
+            
+            try:
+                response = self._probe_request(url, 'GET', {'Range': f'bytes=0-{self.SNIFF_SIZE - 1}'})
+                try:
+                    response.raise_for_status()
+                    sample = b''
+                    for chunk in response.iter_content(chunk_size=self.SNIFF_SIZE):
+                        sample += chunk
+                        if len(sample) >= self.SNIFF_SIZE:
+                            break
+                    return self._preflight_info(response, self.detect_file_type_from_response(response, url, sample))
+                finally:
+                    response.close()
+            except Exception:
+                if not head.ok:
+                    raise
+                # HEAD成功但取不到文件头，类型留到下载时再检测
+                return self._preflight_info(head, None)
+        except Exception as e:
+            reason = self._classify_error(e)[0]
+            self._log(f"🔎 预检失败: {url} ({reason})", EventLog.DEBUG)
+            return PreflightInfo(error=reason)
+    
+    def _probe_request(self, url, method, headers=None):
+        wait = self._request_wait(url)
+        if wait:
+            self._throttle(wait)
+        with self._stats_lock:
+            self.request_count += 1
+        return self.session.request(method, url, headers=headers, stream=True, timeout=30,
+                                    allow_redirects=True)
+    
+    def _preflight_info(self, response, extension):
+        """从预检响应中取出文件大小、类型和是否支持续传"""
+        size = None
+        content_range = response.headers.get('content-range', '')
+        if response.status_code == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1].strip()
+            size = int(total) if total.isdigit() else None
+        elif not response.headers.get('content-encoding'):
+            length = response.headers.get('content-length', '')
+            size = int(length) if length.isdigit() else None
+        resumable = ((response.status_code == 206 and not response.headers.get('content-encoding'))
+                     or self._is_resumable(response))
+        return PreflightInfo(size, extension, resumable)
+    
+    def _detect_extension(self, response, url, sample):
+        """下载时确定文件类型：预检已经检测过的直接使用，不再重复检测"""
+        info = self._current_group().preflight.get(url)
+        if info is not None and info.extension:
+            self._log(f"🔍 使用预检检测到的文件类型: {info.extension}", EventLog.DEBUG)
+            return info.extension
+        return self.detect_file_type_from_response(response, url, sample)
+    
+    def _report_done(self, url, file_path, file_size, message, source, timing=None, transferred=None):
+        """
+        记录一个文件下载完成：更新指标并输出消息和file_done事件
+        
+        Args:
+            url (str): 下载链接
+            file_path: 保存的文件路径
+            file_size (int): 文件大小
+            message (str): 要显示的消息（不含速度）
+            source (str): 文件来源 network/resume/cache/dedup/journal
+            timing (dict): _open_stream()记录的耗时，从网络下载时提供
+            transferred (int): 本次从网络传输的字节数，默认等于file_size
+        """
+        fields = {'url': url, 'file': str(file_path), 'bytes': file_size, 'source': source}
+        if timing is not None:
+            transferred = file_size if transferred is None else transferred
+            transfer = time.perf_counter() - timing['headers_at']
+            phases = {'dns': timing['dns'], 'connect': timing['connect'], 'ttfb': timing['ttfb'], 'transfer': transfer}
+            speed = transferred / transfer if transfer > 0 else 0.0
+            with self._stats_lock:
+                self.bytes_downloaded += transferred
+                self.phase_seconds.update(phases)
+                self.timed_files += 1
+            fields.update({phase: round(seconds, 4) for phase, seconds in phases.items()})
+            fields['bytes_per_second'] = round(speed)
+            message += f", {speed / (1024 * 1024):.2f} MB/秒, 耗时 {sum(phases.values()):.2f}秒"
+        self.events.emit('file_done', message + ")", EventLog.INFO, **fields)
+    
+    def _peek_response(self, response, size=None):
+        """
+        从响应流开头预读若干字节，供文件类型检测使用
+        
+        Args:
+            response: requests.Response对象
+            size (int): 至少预读的字节数，默认SNIFF_SIZE
+            
+        Returns:
+            tuple: (预读到的字节, 剩余数据块迭代器)
+        """
+        size = size or self.SNIFF_SIZE
+        chunks = self._iter_body(response)
+        sample = b''
+        for chunk in chunks:
+            sample += chunk
+            if len(sample) >= size:
+                break
+        return sample, chunks
+    
+    def _iter_body(self, response):
+        """
+        逐块读取响应体
+        
+        没有压缩编码时用urllib3的readinto读到一个可复用的缓冲区，每次返回它的
+        memoryview，写入时不再复制数据。返回的数据只在下一次迭代之前有效，必须立即写出。
+        urllib3会检查收到的字节数是否与Content-Length一致，读完后把连接归还连接池。
+        有压缩编码时交给requests解压。
+        """
+        limiter = self.rate_limiter
+        host = HostScheduler.host_of(response.url)
+        if response.headers.get('content-encoding'):
+            for chunk in response.iter_content(chunk_size=self.buffer_size):
+                if limiter.limits_bandwidth:
+                    wait = limiter.reserve_bytes(host, len(chunk))
+                    if wait:
+                        self._throttle(wait)
+                yield chunk
+            return
+        
+        buffer = memoryview(bytearray(self.buffer_size))
+        while True:
+            # 与iter_content()一样把urllib3的异常转换为requests的异常
+            try:
+                count = response.raw.readinto(buffer)
+            except ReadTimeoutError as e:
+                raise requests.exceptions.ReadTimeout(e)
+            except SSLError as e:
+                raise requests.exceptions.SSLError(e)
+            except ProtocolError as e:
+                raise requests.exceptions.ChunkedEncodingError(e)
+            if not count:
+                break
+            if limiter.limits_bandwidth:
+                wait = limiter.reserve_bytes(host, count)
+                if wait:
+                    self._throttle(wait)
+            yield buffer[:count]
+    
+    @staticmethod
+    def _content_length(response):
+        """未压缩响应体的字节数，未知时返回None"""
+        if response.headers.get('content-encoding'):
+            return None
+        try:
+            return int(response.headers['content-length'])
+        except (KeyError, ValueError):
+            return None
+    
+    def _check_size(self, response, file_size):
+        """开启校验时确认收到的字节数与Content-Length一致（写入时已经计数，不需要再读文件）"""
+        expected = self._content_length(response)
+        if self.verify and expected is not None and file_size != expected:
+            raise VerificationError(f"大小不符: 收到 {file_size:,} bytes, Content-Length为 {expected:,} bytes")
+    
+    # 断点续传日志中已写入字节数的更新间隔
+    JOURNAL_PROGRESS_INTERVAL = 4 * 1024 * 1024
+    
+    def _save_stream(self, file_path, sample, chunks, mode='wb', job_key=None, offset=0, hasher=None,
+                     expected_size=None):
+        """
+        把预读字节和剩余数据块依次写入文件
+        
+        Args:
+            file_path: 目标文件路径
+            sample (bytes): 预读的字节
+            chunks: 剩余数据块迭代器
+            mode (str): 'wb'从头写入，'ab'在断点后追加
+            job_key (str): 断点续传日志中的任务键，用于定期记录进度
+            offset (int): 追加写入时文件中已有的字节数
+            hasher: hashlib对象，写入的同时计算内容哈希，为None时不计算
+            expected_size (int): 文件的预期大小，用于预先分配空间，为None时不分配
+            
+        Returns:
+            int: 写入完成后文件的总字节数
+        """
+        # 断点续传按 .part 的实际大小确定续传位置，记录日志的下载不能预分配
+        preallocate = (self.preallocate and expected_size and mode == 'wb'
+                       and not (job_key and self.journal))
+        with open(file_path, mode) as f:
+            if preallocate:
+                self._preallocate(f.fileno(), expected_size)
+            try:
+                return self._write_chunks(f, sample, chunks, offset, hasher, job_key)
+            finally:
+                if preallocate and f.tell() != expected_size:
+                    # 下载中断或服务器多发了数据，去掉预分配多出的部分
+                    f.truncate(f.tell())
+    
+    def _write_chunks(self, f, sample, chunks, written=0, hasher=None, job_key=None):
+        """把预读字节和剩余数据块依次写入已打开的文件，返回写入后的总字节数"""
+        next_checkpoint = written + self.JOURNAL_PROGRESS_INTERVAL
+        if sample:
+            f.write(sample)
+            written += len(sample)
+            if hasher:
+                hasher.update(sample)
+        for chunk in chunks:
+            if chunk:
+                f.write(chunk)
+                written += len(chunk)
+                if hasher:
+                    hasher.update(chunk)
+                if job_key and self.journal and written >= next_checkpoint:
+                    self.journal.update_progress(job_key, written)
+                    next_checkpoint = written + self.JOURNAL_PROGRESS_INTERVAL
+        return written
+    
+    def _save_to_archive(self, response, filename, sample, chunks):
+        """把文件内容写入归档条目的临时缓冲，写完后交给归档写入线程，返回文件大小"""
+        spool = self.sink.open_entry()
+        try:
+            self._check_size(response, self._write_chunks(spool, sample, chunks))
+        except BaseException:
+            spool.close()
+            raise
+        return self.sink.commit(filename, spool)
+    
+    @staticmethod
+    def _is_resumable(response):
+        """响应是否支持之后用Range续传（压缩传输时字节偏移对不上，不能续传）"""
+        return (response.headers.get('accept-ranges', '').lower() == 'bytes'
+                and not response.headers.get('content-encoding'))
+    
+    def _segmented_size(self, response):
+        """
+        判断响应是否适合分段下载
+        
+        Returns:
+            int: 适合时返回文件总大小，否则返回None
+        """
+        if (self.segments < 2 or self.sink.is_archive or response.status_code != 200
+                or not self._is_resumable(response)):
+            return None
+        try:
+            total_size = int(response.headers.get('content-length', ''))
+        except ValueError:
+            return None
+        return total_size if total_size >= max(self.segment_threshold, self.segments) else None
+    
+    @staticmethod
+    def _preallocate(fd, size):
+        """预先分配文件空间，分段写入时不会产生空洞和碎片"""
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return
+            except OSError:
+                # 文件系统不支持时退回ftruncate
+                pass
+        os.ftruncate(fd, size)
+    
+    def _write_segment(self, part_file, start, length, chunks, abort):
+        """
+        把一个分段的数据按位置写入预分配的文件
+        
+        Args:
+            part_file: 目标文件路径（已预分配）
+            start (int): 分段在文件中的起始位置
+            length (int): 分段的字节数，数据流超出的部分丢弃
+            chunks: 数据块迭代器
+            abort (threading.Event): 其他分段失败时被设置，提前结束
+        """
+        written = 0
+        with open(part_file, 'r+b', buffering=0) as f:
+            fd = f.fileno()
+            if not hasattr(os, 'pwrite'):
+                f.seek(start)
+            for chunk in chunks:
+                if abort.is_set():
+                    return
+                chunk = chunk[:length - written]
+                if hasattr(os, 'pwrite'):
+                    os.pwrite(fd, chunk, start + written)
+                else:
+                    f.write(chunk)
+                written += len(chunk)
+                if written >= length:
+                    return
+        raise requests.exceptions.ChunkedEncodingError(
+            f"分段 {start}-{start + length - 1} 不完整: 只收到 {written:,}/{length:,} bytes")
+    
+    def _fetch_segment(self, url, part_file, start, end, validator, abort):
+        """用Range请求下载一个分段并写入文件"""
+        headers = {'Range': f'bytes={start}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+        response = self._open_stream(url, headers=headers)
+        try:
+            # 有的服务器忽略Range的结束位置、一直返回到文件末尾，只写入需要的部分即可
+            content_range = response.headers.get('content-range', '')
+            if response.status_code != 206 or not content_range.startswith(f'bytes {start}-'):
+                raise requests.exceptions.RequestException(
+                    f"服务器没有返回请求的分段 {start}-{end}（文件可能已变化）")
+            self._write_segment(part_file, start, end - start + 1, self._iter_body(response), abort)
+        finally:
+            response.close()
+    
+    def _acquire_segment_slots(self, url):
+        """
+        为分段下载的额外连接占用并发名额，返回可以额外使用的连接数
+        
+        批量下载中从调度器占用这个主机的空闲名额，全局、单主机上限和自适应并发
+        依然有效；单独下载一个文件时没有调度器，按segments分段。
+        """
+        scheduler = _task_scheduler.get()
+        if scheduler is None:
+            return self.segments - 1
+        return scheduler.acquire_extra(HostScheduler.host_of(url), self.segments - 1)
+    
+    def _release_segment_slots(self, url, count):
+        """归还_acquire_segment_slots()占用的名额"""
+        scheduler = _task_scheduler.get()
+        if scheduler is not None:
+            scheduler.release(HostScheduler.host_of(url), count)
+    
+    def _save_segmented(self, url, response, part_file, sample, chunks, total_size, segments):
+        """
+        分段并行下载：第一段沿用已经打开的响应，其余各段用Range请求在
+        独立的连接上同时下载（在共用的segment_pool中执行），全部按位置写入预分配的文件
+        
+        Args:
+            segments (int): 分段数，额外的连接已经用_acquire_segment_slots()占用了名额
+        
+        Returns:
+            int: 文件的总字节数
+        """
+        segment_size = -(-total_size // segments)
+        ranges = [(start, min(start + segment_size, total_size) - 1)
+                  for start in range(0, total_size, segment_size)]
+        etag = response.headers.get('etag')
+        validator = etag if etag and not etag.startswith('W/') else response.headers.get('last-modified')
+        self._log(f"⚡ 分段下载: {len(ranges)} 段, 共 {total_size:,} bytes", EventLog.DEBUG)
+        
+        with open(part_file, 'wb') as f:
+            self._preallocate(f.fileno(), total_size)
+        
+        abort = threading.Event()
+        futures = [self.segment_pool.submit(self._fetch_segment, url, part_file, start, end, validator, abort)
+                   for start, end in ranges[1:]]
+        for future in futures:
+            # 任何一段失败都让其余各段尽快停止
+            future.add_done_callback(lambda done: done.exception() and abort.set())
+        try:
+            try:
+                first_end = ranges[0][1]
+                self._write_segment(part_file, 0, first_end + 1, itertools.chain([sample], chunks), abort)
+            finally:
+                # 第一段读完后不再需要这个响应的剩余数据
+                response.close()
+            for future in futures:
+                future.result()
+        except BaseException:
+            abort.set()
+            raise
+        finally:
+            # 线程池是共用的，出错时也要等其余各段停止之后才能删除文件、归还名额
+            wait(futures)
+        
+        file_size = os.path.getsize(part_file)
+        if file_size != total_size:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"分段下载的文件大小不符: {file_size:,}/{total_size:,} bytes")
+        return file_size
+    
+    def _finish_download(self, part_file, file_path, job_key, file_size):
+        """把 .part 文件原子地重命名为正式文件，并在日志中标记完成"""
+        os.replace(part_file, file_path)
+        if job_key and self.journal:
+            self.journal.mark_done(job_key, file_size)
+    
+    def _new_hasher(self):
+        """缓存和去重都需要内容哈希，边写入边计算，不需要重新读取文件"""
+        return hashlib.sha256() if (self.cache or self.dedup) else None
+    
+    @staticmethod
+    def _hash_file(file_path, hasher):
+        """把已有文件的内容计入哈希（断点续传时用于 .part 中已下载的部分）"""
+        buffer = memoryview(bytearray(1024 * 1024))
+        with open(file_path, 'rb', buffering=0) as f:
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                hasher.update(buffer[:count])
+    
+    def _after_download(self, url, file_path, extension, file_size, hasher, etag, last_modified):
+        """文件下载完成后：内容去重、加入下载缓存、记录URL供重复链接使用"""
+        sha256 = hasher.hexdigest() if hasher else None
+        if self.dedup and sha256:
+            self._link_identical_content(file_path, sha256, file_size)
+        if self.cache and sha256:
+            self.cache.store(url, file_path, sha256, file_size, extension, etag, last_modified)
+        self._remember_url(url, file_path, extension, file_size, sha256)
+    
+    def _current_group(self):
+        """当前任务所属的TaskGroup，不在批量下载中时为_standalone_group"""
+        return _task_group.get() or self._standalone_group
+    
+    def _remember_url(self, url, file_path, extension, file_size, sha256=None):
+        """记录URL的下载结果，同一组中再次出现的相同URL直接链接到这个文件"""
+        if not self.dedup:
+            return
+        group = self._current_group()
+        with self._dedup_lock:
+            group.url_results[url] = (file_path, extension, file_size)
+            if sha256:
+                group.content_index.setdefault(sha256, file_path)
+    
+    def _link_identical_content(self, file_path, sha256, file_size):
+        """内容与同一组中之前保存的文件完全相同时，把新文件替换为指向它的硬链接"""
+        group = self._current_group()
+        with self._dedup_lock:
+            existing = group.content_index.setdefault(sha256, file_path)
+        if existing == file_path:
+            return
+        temp_file = self.part_path(file_path)
+        try:
+            if os.path.samefile(existing, file_path):
+                return
+            os.link(existing, temp_file)
+            os.replace(temp_file, file_path)
+        except OSError:
+            # 原文件已被删除或文件系统不支持硬链接，保留独立的副本
+            return
+        with self._stats_lock:
+            self.dedup_content_count += 1
+            self.dedup_bytes_saved += file_size
+        self.events.emit('dedup_content', f"🔗 内容与 {existing.name} 相同，已改为硬链接: {file_path.name}",
+                         file=str(file_path), existing=str(existing), bytes=file_size)
+    
+    def _link_duplicate_url(self, url, filename, job_key):
+        """
+        同一组中已经下载过的URL，直接链接到已下载的文件，不再发起请求
+        
+        Returns:
+            tuple: (成功标志, 文件路径)，没有可用的已下载文件时返回None
+        """
+        group = self._current_group()
+        with self._dedup_lock:
+            known = group.url_results.get(url)
+        if known is None or not known[0].exists():
+            return None
+        source, extension, file_size = known
+        
+        filename = self.apply_detected_extension(url, filename, extension)
+        unique_filename = self.get_unique_filename(filename)
+        file_path = self.download_folder / unique_filename
+        part_file = self.part_path(file_path)
+        
+        if job_key and self.journal:
+            self.journal.start(job_key, url, unique_filename, file_size, False, None, None)
+        link_or_copy(source, part_file)
+        self._finish_download(part_file, file_path, job_key, file_size)
+        
+        with self._stats_lock:
+            self.dedup_url_count += 1
+            self.dedup_bytes_saved += file_size
+        self._report_done(url, file_path, file_size,
+                          f"🔗 重复的下载链接，已链接到 {source.name}: {unique_filename} ({file_size:,} bytes", 'dedup')
+        return True, str(file_path)
+    
+    def _use_cached(self, url, filename, cached, job_key):
+        """服务器确认文件未变化时，把缓存中的文件放入下载文件夹"""
+        filename = self.apply_detected_extension(url, filename, cached['extension'])
+        unique_filename = self.get_unique_filename(filename)
+        file_path = self.download_folder / unique_filename
+        part_file = self.part_path(file_path)
+        
+        if job_key and self.journal:
+            self.journal.start(job_key, url, unique_filename, cached['size'], False,
+                               cached['etag'], cached['last_modified'])
+        self.cache.materialize(url, cached, part_file)
+        self._finish_download(part_file, file_path, job_key, cached['size'])
+        self._remember_url(url, file_path, cached['extension'], cached['size'], cached['sha256'])
+        
+        with self._stats_lock:
+            self.cache_hit_count += 1
+            self.cache_hit_bytes += cached['size']
+        self._report_done(url, file_path, cached['size'],
+                          f"♻️  文件未变化，使用缓存: {unique_filename} ({cached['size']:,} bytes", 'cache')
+        return True, str(file_path)
+    
+    def _resume_plan(self, url, job_key):
+        """
+        根据断点续传日志判断任务怎样继续（两个下载引擎共用）
+        
+        Returns:
+            tuple: (结果, 续传信息)。任务已处理完时结果为 (成功标志, 文件路径)；
+                .part 文件可以续传时续传信息为 (日志记录, 文件路径, 已有字节数, 续传请求头)；
+                两者都为None时正常下载
+        """
+        entry = self.journal.get(job_key)
+        if entry is None or not entry['filename']:
+            return None, None
+        
+        file_path = self.download_folder / entry['filename']
+        if entry['state'] == 'done':
+            if file_path.exists():
+                with self._stats_lock:
+                    self.skipped_count += 1
+                self._remember_url(url, file_path, file_path.suffix, entry['bytes_written'])
+                self._report_done(url, file_path, entry['bytes_written'],
+                                  f"⏭️  之前已下载完成，跳过: {entry['filename']} ({entry['bytes_written']:,} bytes",
+                                  'journal')
+                return (True, str(file_path)), None
+            return None, None
+        
+        part_file = self.part_path(file_path)
+        offset = part_file.stat().st_size if part_file.exists() else 0
+        if not entry['resumable'] or offset == 0:
+            # 无法续传的 .part 是截断的残留，删除并释放文件名，重新下载时仍使用这个名字
+            if part_file.exists():
+                self._release_name(file_path)
+            return None, None
+        
+        # .part 已经写满（上次写完后、改名前中断），不再发请求：对已满的文件请求Range会得到416
+        total_size = entry['total_size']
+        if total_size is not None and offset >= int(total_size):
+            if offset == int(total_size):
+                return self._finish_part(url, entry, job_key, offset), None
+            # 比记录的大小还大，内容不可信，从头下载
+            self._log(f"🔄 .part 文件大小异常，重新下载: {entry['filename']}")
+            self._release_name(file_path)
+            return None, None
+        
+        # 用If-Range保证服务器上的文件没有变化，否则服务器会返回完整的200响应
+        headers = {'Range': f'bytes={offset}-'}
+        etag = entry['etag']
+        validator = etag if etag and not etag.startswith('W/') else entry['last_modified']
+        if validator:
+            headers['If-Range'] = validator
+        return None, (entry, file_path, offset, headers)
+    
+    def _finish_part(self, url, entry, job_key, file_size):
+        """.part 文件已经包含完整内容：计算哈希后改为正式文件，不再发起请求"""
+        file_path = self.download_folder / entry['filename']
+        part_file = self.part_path(file_path)
+        hasher = self._new_hasher()
+        if hasher:
+            self._hash_file(part_file, hasher)
+        self._finish_download(part_file, file_path, job_key, file_size)
+        self._after_download(url, file_path, file_path.suffix, file_size, hasher,
+                             entry['etag'], entry['last_modified'])
+        with self._stats_lock:
+            self.resumed_count += 1
+        self._report_done(url, file_path, file_size,
+                          f"🔁 断点续传: .part 文件已完整，直接完成: {entry['filename']} ({file_size:,} bytes",
+                          'resume')
+        return True, str(file_path)
+    
+    @staticmethod
+    def _range_exhausted(status, headers, offset):
+        """Range请求返回416且服务器声明的文件大小正好等于已有字节数，说明 .part 已经完整"""
+        return status == 416 and headers.get('content-range', '').strip() == f'bytes */{offset}'
+    
+    def _check_journal(self, url, job_key):
+        """
+        根据断点续传日志处理已完成或未完成的任务
         
-        # 如果文件不存在，直接返回
-        if not file_path.exists():
-            return base_filename
+        Returns:
+            tuple: 任务已处理完时返回 (成功标志, 文件路径)，需要正常下载时返回None
+        """
+        result, resume = self._resume_plan(url, job_key)
+        if resume is None:
+            return result
+        entry, file_path, offset, headers = resume
+        part_file = self.part_path(file_path)
         
-        # 处理重复文件名，添加-1、-2、-3等后缀
-        name_stem = file_path.stem
-        name_suffix = file_path.suffix
-        counter = 1
+        try:
+            response = self._open_stream(url, headers=headers)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 416:
+                raise
+            if self._range_exhausted(416, e.response.headers, offset):
+                return self._finish_part(url, entry, job_key, offset)
+            # 服务器上的文件比 .part 还短，已经变化，从头下载
+            self._log(f"🔄 无法续传，重新下载: {entry['filename']}")
+            self._release_name(file_path)
+            return None
         
-        while True:
-            new_filename = f"{name_stem}-{counter}{name_suffix}"
-            new_file_path = self.download_folder / new_filename
-            if not new_file_path.exists():
-                return new_filename
-            counter += 1
+        hasher = self._new_hasher()
+        resumed_from = 0
+        try:
+            content_range = response.headers.get('content-range', '')
+            if response.status_code == 206 and content_range.startswith(f'bytes {offset}-'):
+                self._log(f"🔁 断点续传: {entry['filename']} (已有 {offset:,} bytes)")
+                with self._stats_lock:
+                    self.resumed_count += 1
+                if hasher:
+                    self._hash_file(part_file, hasher)
+                resumed_from = offset
+                file_size = self._save_stream(part_file, b'', self._iter_body(response),
+                                              mode='ab', job_key=job_key, offset=offset, hasher=hasher)
+            else:
+                # 服务器不支持续传或文件已变化，直接用这个完整响应从头写入
+                self._log(f"🔄 无法续传，重新下载: {entry['filename']}")
+                etag = response.headers.get('etag')
+                self.journal.start(job_key, url, entry['filename'], response.headers.get('content-length'),
+                                   self._is_resumable(response), etag, response.headers.get('last-modified'))
+                file_size = self._save_stream(part_file, b'', self._iter_body(response),
+                                              job_key=job_key, hasher=hasher)
+            etag = response.headers.get('etag') or entry['etag']
+            last_modified = response.headers.get('last-modified') or entry['last_modified']
+        finally:
+            response.close()
+        
+        self._finish_download(part_file, file_path, job_key, file_size)
+        self._after_download(url, file_path, file_path.suffix, file_size, hasher, etag, last_modified)
+        self._report_done(url, file_path, file_size, f"✅ 下载完成: {entry['filename']} ({file_size:,} bytes",
+                          'resume', response.download_timing, transferred=file_size - resumed_from)
+        return True, str(file_path)
     
-    def download_single_pdf(self, url):
+    def _download(self, url, filename=None, job_key=None):
         """
-        下载单个PDF文件，使用URL自动提取的文件名，并智能检测文件类型
+        下载单个文件的完整流程：单次请求、预读检测类型、确定文件名、
+        写入 .part 文件后原子重命名
         
         Args:
-            url (str): 文件的下载链接
+            url (str): 文件下载链接
+            filename (str): 指定的文件名，为None时从URL自动提取
+            job_key (str): 断点续传日志中的任务键，为None时不记录日志
         
         Returns:
             tuple: (成功标志, 文件路径或错误信息)
         """
+        with self._stats_lock:
+            self.in_progress += 1
+        file_path = None
         try:
-            print(f"正在下载: {url}")
-            
-            # 发送请求下载文件
-            response = self.session.get(url, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            # 智能检测文件类型
-            detected_extension = self.detect_file_type_from_response(response, url)
-            
-            # 从URL提取基础文件名
-            base_filename = self.get_filename_from_url(url)
+            self._log(f"正在下载: {url}", EventLog.DEBUG)
             
-            # 如果基础文件名已经有扩展名，检查是否与检测到的一致
-            if '.' in base_filename:
-                current_ext = '.' + base_filename.split('.')[-1].lower()
-                if current_ext != detected_extension:
-                    # 扩展名不匹配，用检测到的扩展名替换
-                    base_filename = base_filename.rsplit('.', 1)[0] + detected_extension
-                    print(f"🔄 文件扩展名已更正为: {detected_extension}")
-            else:
-                # 没有扩展名，添加检测到的扩展名
-                base_filename = base_filename + detected_extension
-                print(f"➕ 已添加文件扩展名: {detected_extension}")
+            if job_key and self.journal:
+                result = self._check_journal(url, job_key)
+                if result is not None:
+                    return result
             
-            # 获取唯一文件名（处理重复）
-            unique_filename = self.get_unique_filename(base_filename)
-            file_path = self.download_folder / unique_filename
+            # 同一批中已经下载过的URL直接链接，不再发起请求
+            if self.dedup:
+                result = self._link_duplicate_url(url, filename, job_key)
+                if result is not None:
+                    return result
             
-            print(f"保存为: {unique_filename}")
+            # 有缓存时带上条件请求头，服务器返回304表示文件未变化
+            cached = self.cache.lookup(url) if self.cache else None
+            headers = DownloadCache.conditional_headers(cached) if cached else None
             
-            # 重新发起请求（因为之前的流可能已经被消费了）
-            response = self.session.get(url, stream=True, timeout=30)
-            response.raise_for_status()
+            # 发送请求下载文件（整个下载过程只发起这一次请求）
+            response = self._open_stream(url, headers=headers)
+            segment_slots = 0
             
-            # 保存文件
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            try:
+                if cached and response.status_code == 304:
+                    return self._use_cached(url, filename, cached, job_key)
+                
+                # 预读开头字节，智能检测文件类型
+                sample, chunks = self._peek_response(response)
+                detected_extension = self._detect_extension(response, url, sample)
+                
+                # 按检测结果修正文件名的扩展名
+                filename = self.apply_detected_extension(url, filename, detected_extension)
+                
+                # 获取唯一文件名（处理重复）
+                unique_filename = self.get_unique_filename(filename)
+                file_path = self.sink.location(unique_filename)
+                part_file = self.part_path(file_path)
+                
+                self._log(f"保存为: {unique_filename}", EventLog.DEBUG)
+                
+                etag = response.headers.get('etag')
+                last_modified = response.headers.get('last-modified')
+                segmented_size = self._segmented_size(response)
+                if segmented_size:
+                    segment_slots = self._acquire_segment_slots(url)
+                    if not segment_slots:
+                        # 这个主机或全局已经没有空闲的并发名额，不分段
+                        segmented_size = None
+                if job_key and self.journal:
+                    # 分段下载的 .part 不是从头连续写入的，中断后不能按长度续传
+                    self.journal.start(job_key, url, unique_filename, response.headers.get('content-length'),
+                                       self._is_resumable(response) and not segmented_size, etag, last_modified)
+                
+                # 保存文件（预读的字节 + 剩余的数据流），写完后再改为正式文件名
+                hasher = self._new_hasher()
+                if self.sink.is_archive:
+                    file_size = self._save_to_archive(response, unique_filename, sample, chunks)
+                else:
+                    if segmented_size:
+                        file_size = self._save_segmented(url, response, part_file, sample, chunks, segmented_size,
+                                                         segment_slots + 1)
+                        if hasher:
+                            self._hash_file(part_file, hasher)
+                    else:
+                        file_size = self._save_stream(part_file, sample, chunks, job_key=job_key, hasher=hasher,
+                                                      expected_size=self._content_length(response))
+                    self._check_size(response, file_size)
+            finally:
+                response.close()
+                if segment_slots:
+                    self._release_segment_slots(url, segment_slots)
             
-            file_size = file_path.stat().st_size
-            print(f"✅ 下载完成: {unique_filename} ({file_size:,} bytes)")
+            if not self.sink.is_archive:
+                self._finish_download(part_file, file_path, job_key, file_size)
+            self._after_download(url, file_path, detected_extension, file_size, hasher, etag, last_modified)
+            self._report_done(url, file_path, file_size, f"✅ 下载完成: {unique_filename} ({file_size:,} bytes",
+                              'network', response.download_timing)
             
             return True, str(file_path)
             
         except requests.exceptions.RequestException as e:
-            error_msg = f"下载失败 {url}: 网络错误 - {str(e)}"
-            print(error_msg)
-            return False, error_msg
+            self._discard_partial(file_path, job_key)
+            return False, self._failure(url, f"下载失败 {url}: 网络错误 - {str(e)}", e)
             
         except Exception as e:
-            error_msg = f"下载失败 {url}: {str(e)}"
-            print(error_msg)
-            return False, error_msg
+            self._discard_partial(file_path, job_key)
+            return False, self._failure(url, f"下载失败 {url}: {str(e)}", e)
+        
+        finally:
+            with self._stats_lock:
+                self.in_progress -= 1
+    
+    def _discard_partial(self, file_path, job_key):
+        """失败留下的 .part 文件只在断点续传日志记录为可续传时保留，否则删除并释放文件名"""
+        if file_path is None:
+            return
+        if job_key and self.journal:
+            entry = self.journal.get(job_key)
+            if entry and entry['resumable'] and entry['filename'] == file_path.name:
+                return
+        self._release_name(file_path)
+    
+    def _failure(self, url, message, exc):
+        """把异常包装为带失败原因分类的DownloadFailure，并输出file_failed事件"""
+        failure = DownloadFailure(message, *self._classify_error(exc))
+        self.events.emit('file_failed', message, EventLog.ERROR, url=url, reason=failure.reason,
+                         retryable=failure.retryable)
+        return failure
+    
+    # 文件结构校验：扩展名 -> (文件开头的签名, 签名须出现在开头多少字节内, 检查结尾的字节数, 结尾须包含的标记)
+    VERIFY_RULES = {
+        '.pdf': ((b'%PDF-',), 1024, 1024, b'%%EOF'),
+        '.zip': ((b'PK\x03\x04', b'PK\x05\x06'), 4, 65536 + 22, b'PK\x05\x06'),
+        '.docx': ((b'PK\x03\x04',), 4, 65536 + 22, b'PK\x05\x06'),
+        '.xlsx': ((b'PK\x03\x04',), 4, 65536 + 22, b'PK\x05\x06'),
+        '.pptx': ((b'PK\x03\x04',), 4, 65536 + 22, b'PK\x05\x06'),
+        '.png': ((b'\x89PNG\r\n\x1a\n',), 8, 16, b'IEND'),
+        '.jpg': ((b'\xff\xd8\xff',), 3, 1024, b'\xff\xd9'),
+        '.jpeg': ((b'\xff\xd8\xff',), 3, 1024, b'\xff\xd9'),
+        '.gif': ((b'GIF87a', b'GIF89a'), 6, 16, b';'),
+    }
+    
+    # 只有十六进制哈希值时按长度判断算法
+    HASH_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+    
+    @classmethod
+    def parse_expected_hash(cls, text):
+        """
+        解析表格中的哈希值，格式为 "sha256:十六进制" 或只有十六进制（按长度判断算法）
+        
+        Returns:
+            tuple: (算法, 小写十六进制哈希值)，无法识别时返回None
+        """
+        algorithm, _, digest = str(text).strip().lower().rpartition(':')
+        algorithm = algorithm.replace('-', '') or cls.HASH_ALGORITHMS.get(len(digest))
+        try:
+            bytes.fromhex(digest)
+            valid = hashlib.new(algorithm).digest_size * 2 == len(digest)
+        except (TypeError, ValueError):
+            valid = False
+        return (algorithm, digest) if valid else None
+    
+    def verify_file(self, url, file_path, group=None):
+        """
+        校验下载完成的文件（在校验线程池中运行）
+        
+        按扩展名用mmap读取文件开头和结尾，检查签名和结尾结构，不读取整个文件；
+        Excel中提供了哈希值时再计算哈希比对。没有通过时删除文件、释放文件名，
+        返回可重试的失败，重试时重新下载
+        
+        Args:
+            url (str): 下载链接
+            file_path (str): 下载完成的文件路径
+            group (TaskGroup): 任务所属的组（期望的哈希值和去重索引），为None时使用_standalone_group
+        
+        Returns:
+            tuple: (成功标志, 文件路径或错误信息)
+        """
+        path = Path(file_path)
+        group = group or self._standalone_group
+        try:
+            try:
+                self._check_structure(path)
+                expected = group.expected_hashes.get(url)
+                if expected:
+                    self._check_hash(path, *expected)
+            except OSError as e:
+                raise VerificationError(f"无法读取文件: {e}") from e
+        except VerificationError as e:
+            self._reject_file(url, path, group)
+            with self._stats_lock:
+                self.verify_failed_count += 1
+            return False, self._failure(url, f"校验失败 {url}: {path.name} {e}", e)
+        with self._stats_lock:
+            self.verified_count += 1
+        self._log(f"🔒 校验通过: {path.name}", EventLog.DEBUG)
+        return True, file_path
+    
+    def _check_structure(self, path):
+        rule = self.VERIFY_RULES.get(path.suffix.lower())
+        if rule is None:
+            return
+        signatures, head_window, tail_window, trailer = rule
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                raise VerificationError("文件为空")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                head = data[:1024]
+                tail = data[max(size - tail_window, 0):]
+        if not any(head.find(signature, 0, head_window) >= 0 for signature in signatures):
+            lowered = head.lower()
+            hint = " (是HTML页面，可能是服务器返回的错误页)" if b'<html' in lowered or b'<!doctype' in lowered else ""
+            raise VerificationError(f"文件内容不是{path.suffix}格式{hint}")
+        if trailer not in tail:
+            raise VerificationError(f"文件不完整: 结尾缺少 {trailer.decode('latin-1')!r}")
+    
+    def _check_hash(self, path, algorithm, digest):
+        hasher = hashlib.new(algorithm)
+        self._hash_file(path, hasher)
+        if hasher.hexdigest() != digest:
+            raise VerificationError(f"{algorithm}哈希值不一致")
+    
+    def _reject_file(self, url, path, group):
+        """删除没有通过校验的文件，清除它的缓存和去重记录，并释放文件名供重试使用"""
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        if self.cache:
+            self.cache.forget(url)
+        if self.dedup:
+            with self._dedup_lock:
+                group.url_results.pop(url, None)
+        self._release_name(path)
+    
+    def _classify_error(self, exc):
+        """
+        对下载异常分类
+        
+        Returns:
+            tuple: (失败原因, 是否可重试, 服务器要求的等待秒数或None)
+        """
+        response = getattr(exc, 'response', None)
+        if isinstance(exc, requests.exceptions.HTTPError) and response is not None:
+            status = response.status_code
+            retry_after = RetryPolicy.parse_retry_after(response.headers.get('retry-after'))
+            return f"HTTP {status}", status in self.retry_policy.retry_statuses, retry_after
+        if isinstance(exc, requests.exceptions.Timeout):
+            return "超时", True, None
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            return "连接错误", True, None
+        if isinstance(exc, requests.exceptions.ChunkedEncodingError):
+            return "传输中断", True, None
+        if isinstance(exc, requests.exceptions.RequestException):
+            return "网络错误", False, None
+        if isinstance(exc, VerificationError):
+            return "校验失败", True, None
+        if isinstance(exc, OSError):
+            return "文件写入错误", False, None
+        return "其他错误", False, None
+    
+    def download_single_pdf(self, url, job_key=None):
+        """
+        下载单个PDF文件，使用URL自动提取的文件名，并智能检测文件类型
+        
+        Args:
+            url (str): 文件的下载链接
+            job_key (str): 断点续传日志中的任务键，为None时不记录日志
+        
+        Returns:
+            tuple: (成功标志, 文件路径或错误信息)
+        """
+        return self._download(url, None, job_key)
     
     def download_from_list(self, url_list):
         """
         从URL列表批量下载PDF，使用URL自动提取文件名
         
         Args:
-            url_list (list): PDF下载链接列表
+            url_list: PDF下载链接列表，也可以是按需产生URL的迭代器
+        """
+        self.download_batch(((url, None) for url in url_list), "使用URL自动提取文件名",
+                            total=len(url_list) if hasattr(url_list, '__len__') else None)
+    
+    def download_batch(self, tasks, naming, total=None, on_result=None):
+        """
+        打印批量下载信息，执行下载并打印统计
+        
+        Args:
+            tasks: (url, filename) 迭代器，或自带任务序号的KeyedTasks
+            naming (str): 文件命名方式说明
+            total (int): 任务总数，未知时为None（流式读取的任务）
+            on_result: 每个任务完成时调用的函数 on_result(url, 成功标志, 文件路径或错误信息)
         """
-        print(f"开始批量下载 {len(url_list)} 个文件...")
-        print(f"保存目录: {self.download_folder.absolute()}")
-        print(f"文件命名: 使用URL自动提取文件名")
-        print(f"并发数: {self.max_workers}")
+        if total is None:
+            print("开始批量下载（边读取边下载）...")
+        else:
+            print(f"开始批量下载 {total} 个文件...")
+        if self.sink.is_archive:
+            print(f"保存到归档: {self.sink.describe()}")
+        else:
+            print(f"保存目录: {self.download_folder.absolute()}")
+        print(f"文件命名: {naming}")
+        self.print_concurrency()
         print("-" * 50)
         
-        # 使用线程池并发下载
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            future_to_url = {
-                executor.submit(self.download_single_pdf, url): url
-                for url in url_list
-            }
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
+        self.begin_batch(total)
+        try:
+            self.run_batch(tasks, on_result, total)
+        finally:
+            self.end_batch()
+        self.print_summary()
+    
+    def begin_batch(self, total=None):
+        """开始一批下载：进度、预计剩余时间和事件日志中的批次从这里开始计算"""
+        self._batch_started = time.monotonic()
+        self._active_run = None
+        self.events.batch_active = True
+        self.events.emit('batch_start', total=total, folder=self.sink.describe())
+    
+    def end_batch(self):
+        """一批下载结束：写好归档，输出最后的进度事件和指标"""
+        try:
+            # 归档模式：等待队列中的文件全部写入并写好归档目录
+            self.sink.close()
+        finally:
+            self.events.batch_active = False
+            self.events.emit('batch_end', **self.progress_snapshot())
+            # 统计信息直接打印，先等队列中的消息输出完，保证顺序
+            self.events.flush()
+    
+    def progress_snapshot(self, run=None):
+        """
+        当前批量下载的进度和指标
+        
+        Args:
+            run (BatchRun): 提供任务总数和预计字节数的一批任务，默认为正在执行的一批
+            
+        Returns:
+            dict: 已完成/失败/进行中/剩余的文件数、已下载字节数、平均速度、
+                预计剩余时间（任务总数未知时为None）、各阶段累计耗时等
+        """
+        with self._stats_lock:
+            bytes_downloaded = self.bytes_downloaded
+            phase_seconds = {phase: round(self.phase_seconds[phase], 4) for phase in self.PHASES}
+            timed_files = self.timed_files
+            in_progress = self.in_progress
+            requests_sent = self.request_count
+            succeeded, failed = self.success_count, self.failed_count
+        done = succeeded + failed
+        elapsed = time.monotonic() - self._batch_started if self._batch_started else 0.0
+        run = run or self._active_run
+        total = run.total if run else None
+        
+        remaining = eta = bytes_remaining = None
+        if total is not None:
+            remaining = max(total - done, 0)
+            if done and elapsed:
+                eta = round(remaining * elapsed / done, 1)
+            if run.bytes_target is not None:
+                # 预检得到了文件大小，按剩余字节数和平均速度估算
+                bytes_remaining = max(run.bytes_target - bytes_downloaded, 0)
+                if bytes_downloaded and elapsed and remaining:
+                    eta = round(bytes_remaining * elapsed / bytes_downloaded, 1)
+            elif timed_files:
+                # 按已下载文件的平均大小估算
+                bytes_remaining = round(remaining * bytes_downloaded / timed_files)
+        return {
+            'files_succeeded': succeeded,
+            'files_failed': failed,
+            'files_in_progress': in_progress,
+            'files_total': total,
+            'files_remaining': remaining,
+            'bytes_downloaded': bytes_downloaded,
+            'bytes_remaining': bytes_remaining,
+            'elapsed_seconds': round(elapsed, 3),
+            'bytes_per_second': round(bytes_downloaded / elapsed) if elapsed else 0,
+            'files_per_second': round(done / elapsed, 2) if elapsed else 0.0,
+            'eta_seconds': eta,
+            'requests': requests_sent,
+            'retries': sum(self.retry_reasons.values()),
+            'phase_seconds': phase_seconds,
+            'timed_files': timed_files,
+            'throttled_seconds': round(self.throttled_seconds, 3),
+        }
+    
+    def print_concurrency(self):
+        """打印并发设置"""
+        print(f"并发数: {self.max_connections}{self.ENGINE_LABEL}")
+        if self.max_per_host:
+            print(f"单主机并发上限: {self.max_per_host}")
+        if self.adaptive:
+            print("自适应并发: 开启（按主机自动调整，以上为上限）")
+        limits = self.rate_limiter.describe()
+        if limits:
+            print(f"限速: {limits}")
+    
+    def _run_task(self, task, scheduler=None):
+        """在工作线程中执行一个批量任务，记录实际开始时间"""
+        task.started = time.monotonic()
+        token = _prepaid_request.set(task.request_wait)
+        scheduler_token = _task_scheduler.set(scheduler)
+        group_token = _task_group.set(task.group)
+        try:
+            return self.download_task(task.url, task.filename, task.job_key)
+        finally:
+            _task_group.reset(group_token)
+            _task_scheduler.reset(scheduler_token)
+            _prepaid_request.reset(token)
+    
+    def download_task(self, url, filename, job_key=None):
+        """下载一个批量任务，filename为None时从URL提取文件名"""
+        if filename is None:
+            return self.download_single_pdf(url, job_key)
+        return self.download_single_pdf_with_name(url, filename, job_key)
+    
+    def run_batch(self, tasks, on_result=None, total=None):
+        """
+        用线程池执行一批下载任务，按主机轮转分发，遵守全局和单主机并发上限
+        
+        任务从迭代器中按需读取，同时进行和等待分发的任务合计不超过
+        并发数 + max_pending 个；每个任务完成后结果立即交给on_result并释放，
+        因此输入列表再大也能立即开始下载，内存占用也不随列表增长。
+        失败的任务按retry_policy延迟重试，等待期间不占用下载线程。
+        
+        Args:
+            tasks: (url, filename) 迭代器，filename为None时从URL提取文件名
+            on_result: 每个任务完成时调用的函数 on_result(url, 成功标志, 文件路径或错误信息)
+            total (int): 任务总数，用于进度和预计剩余时间，未知时为None
+        """
+        self.execute_run(self.create_run(tasks, on_result, total))
+    
+    def create_run(self, tasks=None, on_result=None, total=None):
+        """
+        创建一批任务的调度状态，参数与run_batch相同；
+        服务模式下创建后设置open=True，用execute_run()持续执行
+        """
+        # 比线程数多分发一倍任务到线程池队列，线程做完一个任务可以立即开始下一个，
+        # 不必等主线程拿到GIL再分发；排队中的任务也计入单主机上限，上限依然有效
+        return BatchRun(self, tasks, on_result, max_active=self.max_connections * 2, total=total)
+    
+    def execute_run(self, run):
+        """执行create_run()创建的一批任务，直到全部完成（run.open为True时直到close_input()之后）"""
+        self._active_run = run
+        # 任务完成时由回调放入队列，主线程只需阻塞在队列上，
+        # 比每次用wait()检查全部进行中的Future开销小得多
+        completed = queue.SimpleQueue()
+        # 校验完成、加入新任务组时放入None唤醒主线程
+        run.wakeup = lambda: completed.put(None)
+        
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            running = {}
+            while True:
+                run.collect_verified()
+                # 在并发上限内尽量多地分发任务
+                for host, task in run.start_ready():
+                    future = executor.submit(self._run_task, task, run.scheduler)
+                    running[future] = (host, task)
+                    future.add_done_callback(completed.put)
+                
+                if not running and not run.verifying:
+                    # 只剩等待重试的任务时，等到最早的一个到期；持续接收任务时等待新的任务组
+                    delay = run.wait_time()
+                    if delay is None and not run.open:
+                        break
+                    try:
+                        completed.get(timeout=delay)
+                    except queue.Empty:
+                        pass
+                    continue
+                
+                # 处理完成的任务（有等待重试的任务时最多等到它到期）
                 try:
-                    success, result = future.result()
-                    if success:
-                        self.success_count += 1
-                    else:
-                        self.failed_count += 1
-                        self.failed_urls.append(url)
-                except Exception as e:
-                    self.failed_count += 1
-                    self.failed_urls.append(url)
-                    print(f"任务执行异常 {url}: {str(e)}")
+                    done = [completed.get(timeout=run.wait_time())]
+                except queue.Empty:
+                    continue
+                while not completed.empty():
+                    done.append(completed.get())
+                for future in done:
+                    if future is not None:
+                        host, task = running.pop(future)
+                        run.finish(host, task, future.result)
         
-        self.print_summary()
+        run.close()
     
     def download_from_file(self, urls_file_path, encoding='utf-8'):
         """
-        从文件中读取URL列表并下载
+        从文件中逐行读取URL列表并下载，边读取边下载
         
         Args:
             urls_file_path (str): 包含URL列表的文件路径
             encoding (str): 文件编码
         """
         try:
-            with open(urls_file_path, 'r', encoding=encoding) as f:
-                urls = [line.strip() for line in f if line.strip()]
-            
-            print(f"从文件 {urls_file_path} 读取到 {len(urls)} 个URL")
+            urls = iter_text_lines(urls_file_path, encoding)
+            print(f"从文件 {urls_file_path} 读取URL")
             self.download_from_list(urls)
             
         except Exception as e:
             print(f"读取URL文件失败: {str(e)}")
     
+    def iter_named_tasks(self, rows):
+        """
+        把表格行转换为下载任务：第一列为文件名，第二列为URL，第三列（可选）为哈希值
+        
+        Args:
+            rows: (行号, 单元格值元组) 迭代器
+            
+        Yields:
+            (url, filename)
+        """
+        for row_number, row in rows:
+            filename_cell = row[0] if len(row) > 0 else None
+            url_cell = row[1] if len(row) > 1 else None
+            
+            # 检查URL是否有效
+            if url_cell is None or not str(url_cell).strip():
+                self._log(f"⚠️  跳过第{row_number}行：URL为空")
+                continue
+            url = str(url_cell).strip()
+            
+            # 处理文件名
+            if filename_cell is None or not str(filename_cell).strip():
+                # 如果文件名为空，从URL自动提取
+                filename = self.get_filename_from_url(url)
+                self._log(f"📝 第{row_number}行文件名为空，自动提取为: {filename}", EventLog.DEBUG)
+            else:
+                filename = str(filename_cell).strip()
+            
+            # 第三列（可选）：文件的哈希值，开启校验时下载后比对
+            hash_cell = row[2] if len(row) > 2 else None
+            if self.verify and hash_cell is not None and str(hash_cell).strip():
+                expected = self.parse_expected_hash(hash_cell)
+                if expected is None:
+                    self._log(f"⚠️  第{row_number}行的哈希值无法识别，不做哈希校验: {hash_cell}")
+                else:
+                    self.expected_hashes[url] = expected
+            
+            yield url, filename
+    
     def download_from_excel(self, excel_path):
         """
-        从Excel文件读取文件名和URL列表并下载
+        从Excel（或CSV）文件读取文件名和URL列表并下载
         第一列：文件名，第二列：URL
         
+        表格按行流式读取，读到的任务立即进入下载队列，不需要先把整个表格读入内存。
+        
         Args:
-            excel_path (str): Excel文件路径
+            excel_path (str): Excel文件路径（.xlsx），也支持.csv
         """
         try:
-            # 读取Excel文件，不将第一行作为表头，指定引擎
-            df = pd.read_excel(excel_path, header=None, engine='openpyxl')
+            rows = iter_spreadsheet_rows(excel_path)
             
             # 检查数据是否有效
-            if len(df) == 0:
+            first_row = next(rows, None)
+            if first_row is None:
                 print("❌ 错误: Excel文件为空")
                 return
             
-            # 第一列为文件名，第二列为URL
-            urls = []
-            filenames = []
-            
-            # 处理每一行数据
-            for index, row in df.iterrows():
-                filename_cell = row[0] if 0 in row else None
-                url_cell = row[1] if 1 in row else None
-                
-                # 检查URL是否有效
-                if pd.isna(url_cell) or not str(url_cell).strip():
-                    print(f"⚠️  跳过第{index+1}行：URL为空")
-                    continue
-                
-                # 处理文件名
-                if pd.isna(filename_cell) or not str(filename_cell).strip():
-                    # 如果文件名为空，从URL自动提取
-                    filename = self.get_filename_from_url(str(url_cell).strip())
-                    print(f"📝 第{index+1}行文件名为空，自动提取为: {filename}")
-                else:
-                    filename = str(filename_cell).strip()
-                    # 注释掉强制添加扩展名的逻辑，保持原有扩展名
-                    # if not filename.lower().endswith(('.pdf', '.doc', '.docx', '.txt', '.jpg', '.png', '.gif')):
-                    #     filename += '.pdf'
-                
-                urls.append(str(url_cell).strip())
-                filenames.append(filename)
-            
-            print(f"从Excel文件 {excel_path} 读取到 {len(urls)} 个下载任务")
+            print(f"从Excel文件 {excel_path} 读取下载任务")
             print("📝 文件命名: 使用Excel第一列指定的文件名")
             print("📝 重复文件: 自动添加-1、-2、-3等后缀")
             
             # 开始下载
-            self.download_from_list_with_names(urls, filenames)
+            rows = itertools.chain([first_row], rows)
+            self.download_batch(self.iter_named_tasks(rows), "使用指定的文件名")
             
         except Exception as e:
             print(f"读取Excel文件失败: {str(e)}")
@@ -426,120 +3922,517 @@ class PDFDownloader:
         从URL列表和文件名列表批量下载
         
         Args:
-            url_list (list): PDF下载链接列表
-            filename_list (list): 对应的文件名列表
+            url_list: PDF下载链接列表（或迭代器）
+            filename_list: 对应的文件名列表（或迭代器）
         """
-        print(f"开始批量下载 {len(url_list)} 个文件...")
-        print(f"保存目录: {self.download_folder.absolute()}")
-        print(f"文件命名: 使用指定的文件名")
-        print(f"并发数: {self.max_workers}")
-        print("-" * 50)
-        
-        # 使用线程池并发下载
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            future_to_task = {
-                executor.submit(self.download_single_pdf_with_name, url, filename): (url, filename)
-                for url, filename in zip(url_list, filename_list)
-            }
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_task):
-                url, filename = future_to_task[future]
-                try:
-                    success, result = future.result()
-                    if success:
-                        self.success_count += 1
-                    else:
-                        self.failed_count += 1
-                        self.failed_urls.append(url)
-                except Exception as e:
-                    self.failed_count += 1
-                    self.failed_urls.append(url)
-                    print(f"任务执行异常 {url}: {str(e)}")
-        
-        self.print_summary()
+        self.download_batch(zip(url_list, filename_list), "使用指定的文件名",
+                            total=len(url_list) if hasattr(url_list, '__len__') else None)
     
-    def download_single_pdf_with_name(self, url, filename):
+    def download_single_pdf_with_name(self, url, filename, job_key=None):
         """
         下载单个文件，使用指定的文件名，并智能检测文件类型
         
         Args:
             url (str): 文件下载链接
             filename (str): 指定的文件名
+            job_key (str): 断点续传日志中的任务键，为None时不记录日志
         
         Returns:
             tuple: (成功标志, 文件路径或错误信息)
         """
-        try:
-            print(f"正在下载: {url}")
+        return self._download(url, filename, job_key)
+
+    def record_result(self, url, success, reason=None):
+        """记录单个下载任务的最终结果"""
+        with self._stats_lock:
+            if success:
+                self.success_count += 1
+            else:
+                self.failed_count += 1
+                self.failed_urls.append(url)
+                self.failure_reasons[reason or "未知错误"] += 1
+    
+    def record_retry(self, reason):
+        """记录一次失败重试"""
+        with self._stats_lock:
+            self.retry_reasons[reason] += 1
+    
+    @staticmethod
+    def _format_reasons(counter):
+        return ", ".join(f"{reason} ×{count}" for reason, count in counter.most_common())
+    
+    def print_summary(self):
+        """打印下载统计信息"""
+        print("\n" + "=" * 50)
+        print("下载完成统计:")
+        print(f"成功: {self.success_count}")
+        print(f"失败: {self.failed_count}")
+        total = self.success_count + self.failed_count
+        print(f"总计: {total}")
+        if self.skipped_count or self.resumed_count:
+            print(f"断点续传: 跳过已完成 {self.skipped_count} 个, 续传 {self.resumed_count} 个")
+        if self.dedup_url_count or self.dedup_content_count:
+            print(f"去重: 重复链接 {self.dedup_url_count} 个, 相同内容 {self.dedup_content_count} 个, "
+                  f"节省空间 {self.dedup_bytes_saved / (1024 * 1024):.1f} MB")
+        if self.cache_hit_count:
+            print(f"下载缓存: {self.cache_hit_count} 个文件未变化, "
+                  f"节省传输 {self.cache_hit_bytes / (1024 * 1024):.1f} MB")
+        if total:
+            print(f"HTTP请求数: {self.request_count} (平均每个文件 {self.request_count / total:.2f} 次)")
+        if self._batch_started and self.bytes_downloaded:
+            elapsed = time.monotonic() - self._batch_started
+            print(f"下载量: {self.bytes_downloaded / (1024 * 1024):.1f} MB, 用时 {format_duration(elapsed)}, "
+                  f"平均 {self.bytes_downloaded / elapsed / (1024 * 1024):.2f} MB/秒")
+        if self.timed_files:
+            average = {phase: self.phase_seconds[phase] / self.timed_files for phase in self.PHASES}
+            print(f"平均耗时: DNS解析 {average['dns']:.3f}秒, 建立连接 {average['connect']:.3f}秒, "
+                  f"首字节 {average['ttfb']:.3f}秒, 传输 {average['transfer']:.3f}秒")
+        if self.retry_reasons:
+            print(f"重试: 共 {sum(self.retry_reasons.values())} 次 ({self._format_reasons(self.retry_reasons)})")
+        if self.failure_reasons:
+            print(f"失败原因: {self._format_reasons(self.failure_reasons)}")
+        if self.verified_count or self.verify_failed_count:
+            print(f"校验: 通过 {self.verified_count} 个, 未通过 {self.verify_failed_count} 次")
+        if self.sink.is_archive:
+            print(f"归档: {self.sink.describe()} ({self.sink.entries} 个文件, "
+                  f"{self.sink.bytes_written / (1024 * 1024):.1f} MB)")
+        limits = self.rate_limiter.describe()
+        if limits or self.throttled_seconds:
+            print(f"限速: {limits or '不限制'}, 各下载累计等待 {self.throttled_seconds:.1f}秒")
+        if self.adaptive_limits:
+            limits = sorted(self.adaptive_limits.items(), key=lambda item: -item[1])
+            shown = ", ".join(f"{host}={limit}" for host, limit in limits[:5])
+            more = f" 等{len(limits)}个主机" if len(limits) > 5 else ""
+            print(f"自适应并发: {shown}{more}")
+        stats = self.connection_stats
+        if stats.checkouts:
+            print(f"连接: 新建 {stats.opened}, 复用 {stats.reused} "
+                  f"(复用率 {stats.reused / stats.checkouts:.0%})")
+        if self.dns_cache and (self.dns_cache.hits or self.dns_cache.lookups):
+            print(f"DNS缓存: 命中 {self.dns_cache.hits} 次, 解析 {self.dns_cache.lookups} 次, "
+                  f"解析累计 {self.dns_cache.lookup_seconds:.2f}秒")
+        report = self.warmup_report
+        if report:
+            failed = f"（{report['failed']} 个解析失败）" if report['failed'] else ""
+            print(f"预热: 解析 {report['hosts']} 个主机{failed}, 为 {report['busy_hosts']} 个主机预先建立 "
+                  f"{report['connections']} 个连接, 用时 {report['seconds']:.2f}秒")
+        
+        if self.failed_urls:
+            print("\n失败的URL:")
+            for url in self.failed_urls:
+                print(f"  - {url}")
+
+
+def _import_aiohttp():
+    """按需导入aiohttp，只有使用异步引擎时才需要安装"""
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError("异步下载引擎需要aiohttp，请先执行: pip install aiohttp")
+    return aiohttp
+
+
+class AsyncPDFDownloader(PDFDownloader):
+    """
+    基于asyncio + aiohttp的下载引擎
+    
+    与PDFDownloader的文件类型检测、文件命名和统计输出完全一致，
+    区别在于所有下载都在单个线程的事件循环中进行，max_workers表示
+    同时进行的下载数，可以设置到成百上千而不需要对应数量的系统线程。
+    """
+    
+    ENGINE_LABEL = " (异步引擎)"
+    
+    def __init__(self, download_folder="downloads", max_workers=100, **kwargs):
+        """
+        初始化异步下载器
+        
+        Args:
+            download_folder (str): 下载文件保存的文件夹路径
+            max_workers (int): 最大并发下载数（协程数）
+            **kwargs: 其余参数与PDFDownloader相同
+        """
+        super().__init__(download_folder=download_folder, max_workers=max_workers, **kwargs)
+    
+    def run_batch(self, tasks, on_result=None, total=None):
+        """
+        在事件循环中执行一批下载任务，分发规则与线程引擎相同
+        
+        Args:
+            tasks: (url, filename) 迭代器，filename为None时从URL提取文件名
+            on_result: 每个任务完成时调用的函数 on_result(url, 成功标志, 文件路径或错误信息)
+            total (int): 任务总数，用于进度和预计剩余时间，未知时为None
+        """
+        self.execute_run(self.create_run(tasks, on_result, total))
+    
+    def create_run(self, tasks=None, on_result=None, total=None):
+        """创建一批任务的调度状态（协程没有线程池队列，分发数就是并发数）"""
+        return BatchRun(self, tasks, on_result, total=total)
+    
+    def execute_run(self, run):
+        """在事件循环中执行create_run()创建的一批任务"""
+        import asyncio
+        self._active_run = run
+        asyncio.run(self._execute_run_async(run))
+    
+    def _trace_config(self, aiohttp):
+        """
+        把aiohttp的连接新建/复用事件计入connection_stats，
+        解析主机名和建立连接的耗时计入请求的timing（建立连接的时间包含解析）
+        """
+        stats = self.connection_stats
+        
+        def started(context, key):
+            if isinstance(context.trace_request_ctx, dict):
+                context.trace_request_ctx[key] = time.perf_counter()
+        
+        def elapsed(context, key):
+            timing = context.trace_request_ctx
+            if isinstance(timing, dict) and key in timing:
+                return time.perf_counter() - timing.pop(key)
+            return None
+        
+        async def on_create_start(session, context, params):
+            started(context, 'connect_start')
+        
+        async def on_create(session, context, params):
+            stats.record_checkout()
+            stats.record_open()
+            seconds = elapsed(context, 'connect_start')
+            if seconds is not None:
+                context.trace_request_ctx['connect'] += seconds
+        
+        async def on_reuse(session, context, params):
+            stats.record_checkout()
+        
+        async def on_dns_start(session, context, params):
+            started(context, 'dns_start')
+        
+        async def on_dns_end(session, context, params):
+            seconds = elapsed(context, 'dns_start')
+            if seconds is not None:
+                context.trace_request_ctx['dns'] += seconds
+        
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        trace_config.on_dns_resolvehost_start.append(on_dns_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_end)
+        return trace_config
+    
+    def _resolver(self, aiohttp):
+        """通过dns_cache解析主机名的aiohttp解析器，和线程引擎共用缓存及预热的解析结果"""
+        import asyncio
+        dns_cache = self.dns_cache
+        
+        class CachedResolver(aiohttp.abc.AbstractResolver):
+            async def resolve(self, host, port=0, family=socket.AF_INET):
+                infos = dns_cache.cached(host, port, family)
+                if infos is None:
+                    # 缓存中没有时在线程池中解析，不阻塞事件循环
+                    infos = await asyncio.get_running_loop().run_in_executor(
+                        None, dns_cache.getaddrinfo, host, port, family)
+                return [{'hostname': host, 'host': sockaddr[0], 'port': sockaddr[1], 'family': family,
+                         'proto': proto, 'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}
+                        for family, _, proto, _, sockaddr in infos]
             
-            # 发送请求下载文件
-            response = self.session.get(url, stream=True, timeout=30)
+            async def close(self):
+                pass
+        
+        return CachedResolver()
+    
+    def _open_warm_connections(self, origins):
+        """aiohttp的连接只能在下载时的事件循环中建立，预热时只预先解析主机名"""
+        return 0
+    
+    async def _execute_run_async(self, run):
+        import asyncio
+        aiohttp = _import_aiohttp()
+        
+        connector_options = {}
+        if self.dns_cache:
+            # 使用进程内的DNS缓存，不再使用aiohttp自带的缓存
+            connector_options.update(resolver=self._resolver(aiohttp), use_dns_cache=False)
+        connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                         limit_per_host=self.max_per_host or 0, **connector_options)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+        async with aiohttp.ClientSession(headers=dict(self.session.headers), connector=connector,
+                                         timeout=timeout,
+                                         trace_configs=[self._trace_config(aiohttp)]) as session:
+            running = {}
+            # 校验在线程池中完成、新的任务组由其他线程加入，都通过事件唤醒事件循环
+            loop = asyncio.get_running_loop()
+            woken = asyncio.Event()
+            run.wakeup = lambda: loop.call_soon_threadsafe(woken.set)
+            woken_waiter = None
+            while True:
+                run.collect_verified()
+                for host, task in run.start_ready():
+                    future = asyncio.ensure_future(self._run_task_async(session, task))
+                    running[future] = (host, task)
+                
+                if not running and not run.verifying and not run.open:
+                    delay = run.wait_time()
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    continue
+                
+                waiting = set(running)
+                if run.verifying or run.open:
+                    if woken_waiter is None:
+                        woken_waiter = asyncio.ensure_future(woken.wait())
+                    waiting.add(woken_waiter)
+                done, _ = await asyncio.wait(waiting, timeout=run.wait_time(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future is woken_waiter:
+                        woken.clear()
+                        woken_waiter = None
+                    else:
+                        host, task = running.pop(future)
+                        run.finish(host, task, future.result)
+            if woken_waiter is not None:
+                woken_waiter.cancel()
+        
+        run.close()
+    
+    @staticmethod
+    def _run_in_thread(loop, func, *args):
+        """在默认线程池中执行文件操作，带上当前任务的上下文（所属的任务组等）"""
+        return loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+    
+    async def _open_stream_async(self, session, url, headers=None):
+        """
+        发起请求并计入请求统计（与_open_stream()对应）
+        
+        Returns:
+            tuple: (响应, timing)，响应由调用方用async with释放。timing的内容与_open_stream()记录的相同
+        """
+        import asyncio
+        wait = self._request_wait(url)
+        if wait:
+            self._record_throttle(wait)
+            await asyncio.sleep(wait)
+        with self._stats_lock:
+            self.request_count += 1
+        # 解析主机名和建立连接的耗时由_trace_config中的回调累加到timing
+        timing = {'dns': 0.0, 'connect': 0.0}
+        start = time.perf_counter()
+        response = await session.get(url, headers=headers, trace_request_ctx=timing)
+        headers_at = time.perf_counter()
+        timing.update(connect=max(timing['connect'] - timing['dns'], 0.0),
+                      ttfb=max(headers_at - start - timing['connect'], 0.0), headers_at=headers_at)
+        return response, timing
+    
+    async def _write_body_async(self, response, url, f, written=0, hasher=None, job_key=None):
+        """把剩余的响应体写入已打开的文件，定期在断点续传日志中记录进度，返回写入后的总字节数"""
+        import asyncio
+        next_checkpoint = written + self.JOURNAL_PROGRESS_INTERVAL
+        # 每次取出已经收到的全部数据，不按固定的小块切分
+        limiter = self.rate_limiter
+        host = HostScheduler.host_of(url)
+        async for chunk in response.content.iter_any():
+            f.write(chunk)
+            written += len(chunk)
+            if hasher:
+                hasher.update(chunk)
+            if job_key and self.journal and written >= next_checkpoint:
+                self.journal.update_progress(job_key, written)
+                next_checkpoint = written + self.JOURNAL_PROGRESS_INTERVAL
+            if limiter.limits_bandwidth:
+                wait = limiter.reserve_bytes(host, len(chunk))
+                if wait:
+                    self._record_throttle(wait)
+                    await asyncio.sleep(wait)
+        return written
+    
+    async def _check_journal_async(self, session, url, job_key):
+        """
+        根据断点续传日志处理已完成或未完成的任务（与_check_journal()对应）
+        
+        Returns:
+            tuple: 任务已处理完时返回 (成功标志, 文件路径)，需要正常下载时返回None
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        # 计算已有部分的哈希要读整个文件，放到线程池中，不阻塞事件循环
+        result, resume = await self._run_in_thread(loop, self._resume_plan, url, job_key)
+        if resume is None:
+            return result
+        entry, file_path, offset, headers = resume
+        part_file = self.part_path(file_path)
+        
+        response, timing = await self._open_stream_async(session, url, headers)
+        async with response:
+            if response.status == 416:
+                if self._range_exhausted(416, response.headers, offset):
+                    return await self._run_in_thread(loop, self._finish_part, url, entry, job_key, offset)
+                # 服务器上的文件比 .part 还短，已经变化，从头下载
+                self._log(f"🔄 无法续传，重新下载: {entry['filename']}")
+                self._release_name(file_path)
+                return None
             response.raise_for_status()
             
-            # 智能检测文件类型
-            detected_extension = self.detect_file_type_from_response(response, url)
-            
-            # 处理用户指定的文件名
-            if '.' in filename:
-                # 用户指定的文件名有扩展名，检查是否与检测到的一致
-                current_ext = '.' + filename.split('.')[-1].lower()
-                if current_ext != detected_extension:
-                    # 扩展名不匹配，给用户提示并使用检测到的扩展名
-                    base_name = filename.rsplit('.', 1)[0]
-                    filename = base_name + detected_extension
-                    print(f"🔄 文件扩展名已从 {current_ext} 更正为: {detected_extension}")
-                else:
-                    print(f"✅ 文件扩展名正确: {current_ext}")
+            hasher = self._new_hasher()
+            resumed_from = 0
+            content_range = response.headers.get('content-range', '')
+            if response.status == 206 and content_range.startswith(f'bytes {offset}-'):
+                self._log(f"🔁 断点续传: {entry['filename']} (已有 {offset:,} bytes)")
+                with self._stats_lock:
+                    self.resumed_count += 1
+                if hasher:
+                    await loop.run_in_executor(None, self._hash_file, part_file, hasher)
+                resumed_from = offset
             else:
-                # 用户指定的文件名没有扩展名，添加检测到的扩展名
-                filename = filename + detected_extension
-                print(f"➕ 已添加文件扩展名: {detected_extension}")
+                # 服务器不支持续传或文件已变化，直接用这个完整响应从头写入
+                self._log(f"🔄 无法续传，重新下载: {entry['filename']}")
+                self.journal.start(job_key, url, entry['filename'], response.headers.get('content-length'),
+                                   self._is_resumable(response), response.headers.get('etag'),
+                                   response.headers.get('last-modified'))
+            with open(part_file, 'ab' if resumed_from else 'wb') as f:
+                file_size = await self._write_body_async(response, url, f, resumed_from, hasher, job_key)
+            etag = response.headers.get('etag') or entry['etag']
+            last_modified = response.headers.get('last-modified') or entry['last_modified']
+        
+        self._finish_download(part_file, file_path, job_key, file_size)
+        await self._run_in_thread(loop, self._after_download, url, file_path, file_path.suffix, file_size,
+                                  hasher, etag, last_modified)
+        self._report_done(url, file_path, file_size, f"✅ 下载完成: {entry['filename']} ({file_size:,} bytes",
+                          'resume', timing, transferred=file_size - resumed_from)
+        return True, str(file_path)
+    
+    async def _download_async(self, session, url, filename=None, job_key=None):
+        """
+        异步下载单个文件，只发起一次请求
+        
+        Args:
+            session: aiohttp.ClientSession对象
+            url (str): 文件下载链接
+            filename (str): 指定的文件名，为None时从URL自动提取
+            job_key (str): 断点续传日志中的任务键，为None时不记录日志
+        
+        Returns:
+            tuple: (成功标志, 文件路径或错误信息)
+        """
+        import asyncio
+        aiohttp = _import_aiohttp()
+        loop = asyncio.get_running_loop()
+        with self._stats_lock:
+            self.in_progress += 1
+        file_path = None
+        try:
+            self._log(f"正在下载: {url}", EventLog.DEBUG)
             
-            # 获取唯一文件名（处理重复）
-            unique_filename = self.get_unique_filename(filename)
-            file_path = self.download_folder / unique_filename
+            if job_key and self.journal:
+                result = await self._check_journal_async(session, url, job_key)
+                if result is not None:
+                    return result
             
-            print(f"保存为: {unique_filename}")
+            # 同一批中已经下载过的URL直接链接，不再发起请求（不支持硬链接时要复制文件）
+            if self.dedup:
+                result = await self._run_in_thread(loop, self._link_duplicate_url, url, filename, job_key)
+                if result is not None:
+                    return result
             
-            # 重新发起请求（因为之前的流可能已经被消费了）
-            response = self.session.get(url, stream=True, timeout=30)
-            response.raise_for_status()
+            # 有缓存时带上条件请求头，服务器返回304表示文件未变化
+            cached = self.cache.lookup(url) if self.cache else None
+            headers = DownloadCache.conditional_headers(cached) if cached else None
             
-            # 保存文件
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            response, timing = await self._open_stream_async(session, url, headers)
+            async with response:
+                if cached and response.status == 304:
+                    # 从缓存复制文件可能较慢，放到线程池中执行
+                    return await self._run_in_thread(loop, self._use_cached, url, filename, cached, job_key)
+                response.raise_for_status()
+                
+                # 预读开头字节，智能检测文件类型
+                sample = b''
+                while len(sample) < self.SNIFF_SIZE:
+                    chunk = await response.content.read(self.SNIFF_SIZE - len(sample))
+                    if not chunk:
+                        break
+                    sample += chunk
+                detected_extension = self._detect_extension(response, url, sample)
+                
+                filename = self.apply_detected_extension(url, filename, detected_extension)
+                unique_filename = self.get_unique_filename(filename)
+                file_path = self.sink.location(unique_filename)
+                part_file = self.part_path(file_path)
+                
+                self._log(f"保存为: {unique_filename}", EventLog.DEBUG)
+                
+                etag = response.headers.get('etag')
+                last_modified = response.headers.get('last-modified')
+                if job_key and self.journal:
+                    self.journal.start(job_key, url, unique_filename, response.headers.get('content-length'),
+                                       self._is_resumable(response), etag, last_modified)
+                
+                # 保存文件（预读的字节 + 剩余的数据流），写完后再改为正式文件名；
+                # 归档模式写入条目的临时缓冲
+                hasher = self._new_hasher()
+                f = self.sink.open_entry() if self.sink.is_archive else open(part_file, 'wb')
+                try:
+                    f.write(sample)
+                    if hasher:
+                        hasher.update(sample)
+                    file_size = await self._write_body_async(response, url, f, len(sample), hasher, job_key)
+                    self._check_size(response, file_size)
+                except BaseException:
+                    f.close()
+                    raise
             
-            file_size = file_path.stat().st_size
-            print(f"✅ 下载完成: {unique_filename} ({file_size:,} bytes)")
+            if self.sink.is_archive:
+                # 归档队列满时会等待写入线程，不能阻塞事件循环
+                file_size = await loop.run_in_executor(None, self.sink.commit, unique_filename, f)
+            else:
+                f.close()
+                self._finish_download(part_file, file_path, job_key, file_size)
+            if hasher:
+                # 内容去重和加入缓存都要操作文件
+                await self._run_in_thread(loop, self._after_download, url, file_path, detected_extension,
+                                          file_size, hasher, etag, last_modified)
+            self._report_done(url, file_path, file_size, f"✅ 下载完成: {unique_filename} ({file_size:,} bytes",
+                              'network', timing)
             
             return True, str(file_path)
             
-        except requests.exceptions.RequestException as e:
-            error_msg = f"下载失败 {url}: 网络错误 - {str(e)}"
-            print(error_msg)
-            return False, error_msg
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._discard_partial(file_path, job_key)
+            return False, self._failure(url, f"下载失败 {url}: 网络错误 - {str(e)}", e)
             
         except Exception as e:
-            error_msg = f"下载失败 {url}: {str(e)}"
-            print(error_msg)
-            return False, error_msg
-
-    def print_summary(self):
-        """打印下载统计信息"""
-        print("\n" + "=" * 50)
-        print("下载完成统计:")
-        print(f"成功: {self.success_count}")
-        print(f"失败: {self.failed_count}")
-        print(f"总计: {self.success_count + self.failed_count}")
+            self._discard_partial(file_path, job_key)
+            return False, self._failure(url, f"下载失败 {url}: {str(e)}", e)
         
-        if self.failed_urls:
-            print("\n失败的URL:")
-            for url in self.failed_urls:
-                print(f"  - {url}")
+        finally:
+            with self._stats_lock:
+                self.in_progress -= 1
+    
+    async def _run_task_async(self, session, task):
+        """执行一个批量任务，记录实际开始时间（每个任务在各自的上下文中运行，不需要恢复）"""
+        task.started = time.monotonic()
+        _prepaid_request.set(task.request_wait)
+        _task_group.set(task.group)
+        return await self._download_async(session, task.url, task.filename, task.job_key)
+    
+    def _classify_error(self, exc):
+        """在线程引擎分类的基础上识别aiohttp的异常"""
+        import asyncio
+        aiohttp = _import_aiohttp()
+        if isinstance(exc, aiohttp.ClientResponseError):
+            retry_after = RetryPolicy.parse_retry_after((exc.headers or {}).get('Retry-After'))
+            return f"HTTP {exc.status}", exc.status in self.retry_policy.retry_statuses, retry_after
+        if isinstance(exc, asyncio.TimeoutError):
+            return "超时", True, None
+        if isinstance(exc, aiohttp.ClientConnectionError):
+            return "连接错误", True, None
+        if isinstance(exc, aiohttp.ClientPayloadError):
+            return "传输中断", True, None
+        if isinstance(exc, aiohttp.ClientError):
+            return "网络错误", False, None
+        return super()._classify_error(exc)
 
 
 # 使用示例
@@ -563,9 +4456,14 @@ if __name__ == "__main__":
         if os.path.exists(test_file):
             urls_file = test_file
     
-    # 创建按时间戳命名的下载文件夹
-    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    download_folder = os.path.join(project_path, f"下载_{current_time}")
+    # 上次没有跑完时继续使用那次的文件夹（跳过已完成、续传未完成的文件），
+    # 否则创建按时间戳命名的下载文件夹
+    download_folder = find_unfinished_download_folder(project_path)
+    if download_folder:
+        print(f"🔁 检测到未完成的下载任务，继续下载到: {download_folder}")
+    else:
+        current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        download_folder = os.path.join(project_path, f"下载_{current_time}")
     
     # 检查必要文件是否存在
     if not os.path.exists(urls_file):
@@ -591,7 +4489,12 @@ if __name__ == "__main__":
     # 创建下载器实例
     downloader = PDFDownloader(
         download_folder=download_folder,
-        max_workers=3  # 并发下载数
+        max_workers=16,  # 并发下载数上限
+        adaptive=True,   # 按服务器的承受能力自动调整每个主机的并发数
+        resume=True,     # 中断后重新运行可跳过已完成的文件并断点续传
+        cache_dir=os.path.join(project_path, ".download_cache"),  # 未变化的文件不再重复下载
+        dedup=True,      # 重复的链接只下载一次，相同内容只保存一份
+        verify=True      # 检查文件是否完整（大小、结构，Excel第三列的哈希值），不完整的重新下载
     )
     
     # 直接使用Excel文件下载
@@ -0,0 +1,526 @@
+"""
+分片批量下载
+
+单个Python进程受GIL和单块网卡的限制，任务特别多时可以把同一张下载表
+分给多个进程、或者多台机器同时下载。
+
+本机多进程:
+    每个分片进程都读取同一张下载表，只下载按行哈希（或按主机）分给自己的任务。
+    文件都保存到同一个下载文件夹，文件名通过独占创建 .part 文件协调，不会互相
+    覆盖；每个分片使用各自的断点续传日志，中断后用同样的参数重新运行即可续传。
+
+多台机器:
+    先用 init 把下载表导入共享目录中的SQLite任务队列，再在每台机器上运行 work，
+    worker按需从队列领取任务，运行期间定期为领取的任务续租。超过 --lease 秒没有
+    续租的任务（比如那台机器掉线了）会被其他worker重新领取。worker的断点续传日志
+    按主机名、队列和分片命名，重启后用同样的参数运行即可续传。
+
+每个分片（worker）结束时把统计写入 shard-*.json，merge 读取同一目录下全部分片
+的统计，输出合并后的统计，并把失败的任务写入 失败列表.csv（文件名、下载链接、
+失败原因），这个文件可以直接作为下一次的下载表重新下载失败的任务。
+
+用法:
+    python sharded_runner.py run urls.xlsx --shards 4 -o 下载目录 [--by host]
+    python sharded_runner.py init urls.xlsx --queue /共享目录/queue.sqlite3 [--shards 4 --by host]
+    python sharded_runner.py work --queue /共享目录/queue.sqlite3 -o 下载目录 [--shard 0]
+    python sharded_runner.py merge /共享目录
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+from pdf_downloader import (PDFDownloader, AsyncPDFDownloader, KeyedTasks, iter_spreadsheet_rows,
+                            iter_text_lines, format_duration)
+
+# 本机多进程模式下，分片统计和日志保存在下载文件夹中的这个子文件夹
+SHARD_DIR = ".shards"
+FAILURES_FILENAME = "失败列表.csv"
+
+ENGINES = {
+    'thread': PDFDownloader,
+    'async': AsyncPDFDownloader,
+}
+
+
+def shard_of(url, filename, shards, by='hash'):
+    """
+    任务属于哪个分片（结果只取决于任务内容，重新运行时分片不变）
+
+    by='host' 时同一主机的任务都在一个分片中，每个主机的并发上限和自适应并发
+    仍然只由一个进程控制；by='hash' 按整行哈希，任务分布最均匀。
+    """
+    if shards <= 1:
+        return 0
+    if by == 'host':
+        key = urlparse(url).netloc.lower()
+    else:
+        key = f"{url}\t{filename or ''}"
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+def iter_input_tasks(path):
+    """
+    读取下载表：.xlsx/.csv 第一列为文件名、第二列为URL，其他文件每行一个URL
+
+    文件名为空的任务保持为None，下载时再从URL提取（提取的文件名可能带随机后缀，
+    不能用来计算分片）。URL为空的行跳过。
+
+    Yields:
+        (url, 文件名或None)
+    """
+    if not str(path).lower().endswith(('.xlsx', '.xlsm', '.csv')):
+        yield from ((url, None) for url in iter_text_lines(path))
+        return
+    for _, row in iter_spreadsheet_rows(path):
+        filename = row[0] if len(row) > 0 else None
+        url = row[1] if len(row) > 1 else None
+        if url is None or not str(url).strip():
+            continue
+        filename = str(filename).strip() if filename is not None else ''
+        yield str(url).strip(), filename or None
+
+
+def make_downloader(folder, engine='thread', workers=16, journal_name=None, verbosity='normal', max_pending=None):
+    """创建分片使用的下载器（不使用跨批次缓存：多个进程共用一个缓存索引会互相等锁）"""
+    return ENGINES[engine](
+        download_folder=folder,
+        max_workers=workers,
+        max_pending=max_pending,
+        adaptive=True,
+        resume=True,
+        dedup=True,
+        journal_name=journal_name,
+        verbosity=verbosity,
+    )
+
+
+class WorkQueue:
+    """
+    多台机器共享的任务队列（SQLite文件，放在各台机器都能访问的共享目录中）
+
+    每个任务一行。worker每次领取一小批待下载的任务并记下领取时间，运行期间定期
+    续租，完成后写回结果；超过lease秒没有续租的任务视为那个worker已经退出，可以重新领取。
+    """
+
+    # 网络文件系统上的SQLite不能使用WAL，每次写入都会锁住整个文件，
+    # 因此按批领取任务，尽量减少写事务的次数
+    CLAIM_SIZE = 32
+
+    def __init__(self, path, lease=600.0):
+        """
+        Args:
+            path: 队列文件路径
+            lease (float): 任务领取（或最后一次续租）后多少秒仍未完成时允许其他worker重新领取
+        """
+        self.path = Path(path)
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY, url TEXT NOT NULL, filename TEXT, shard INTEGER NOT NULL DEFAULT 0,"
+            " state TEXT NOT NULL DEFAULT 'pending', worker TEXT, claimed_at REAL, reason TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, shard)")
+
+    def load(self, tasks, shards=1, by='hash', batch_size=1000):
+        """把 (url, filename) 任务导入队列，返回导入的任务数"""
+        count = 0
+        batch = []
+        with self._lock:
+            for url, filename in tasks:
+                batch.append((url, filename, shard_of(url, filename, shards, by)))
+                if len(batch) >= batch_size:
+                    count += self._insert(batch)
+                    batch = []
+            if batch:
+                count += self._insert(batch)
+        return count
+
+    def _insert(self, rows):
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.executemany("INSERT INTO tasks (url, filename, shard) VALUES (?, ?, ?)", rows)
+        self._conn.execute("COMMIT")
+        return len(rows)
+
+    def claim(self, worker, limit, shard=None):
+        """
+        领取最多limit个任务
+
+        Returns:
+            list: [(任务id, url, 文件名), ...]，没有可领取的任务时为空列表
+        """
+        now = time.time()
+        sql = ("SELECT id, url, filename FROM tasks"
+               " WHERE (state = 'pending' OR (state = 'claimed' AND claimed_at < ?))")
+        params = [now - self.lease]
+        if shard is not None:
+            sql += " AND shard = ?"
+            params.append(shard)
+        sql += " ORDER BY id LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            # BEGIN IMMEDIATE 立即取得写锁，两个worker不会领到同一批任务
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(sql, params).fetchall()
+                self._conn.executemany("UPDATE tasks SET state = 'claimed', worker = ?, claimed_at = ? WHERE id = ?",
+                                       [(worker, now, row[0]) for row in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def renew(self, worker):
+        """为这个worker领取后还没有完成的任务续租"""
+        with self._lock:
+            self._conn.execute("UPDATE tasks SET claimed_at = ? WHERE state = 'claimed' AND worker = ?",
+                               (time.time(), worker))
+
+    def complete(self, task_id, success, reason=None):
+        """写回任务结果"""
+        with self._lock:
+            self._conn.execute("UPDATE tasks SET state = ?, reason = ? WHERE id = ?",
+                               ('done' if success else 'failed', reason, task_id))
+
+    def iter_tasks(self, worker, shard=None, claim_size=None):
+        """
+        按需领取任务，直到队列中没有可领取的任务
+
+        Args:
+            claim_size (int): 每次领取的任务数，不超过CLAIM_SIZE。领取的任务在下载器读入之前
+                别的worker也拿不到，应当不超过下载器预读的任务数
+        """
+        claim_size = min(claim_size or self.CLAIM_SIZE, self.CLAIM_SIZE)
+        while True:
+            rows = self.claim(worker, claim_size, shard)
+            if not rows:
+                return
+            yield from rows
+
+    def counts(self):
+        """各状态的任务数"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ShardRecorder:
+    """
+    记录一个分片的下载结果，结束时写入 shard-*.json
+
+    批量下载的完成回调只给出URL，这里在任务进入下载器时记下URL对应的文件名
+    （和队列中的任务id），用于生成失败列表和写回队列。
+    """
+
+    def __init__(self, name, queue=None):
+        self.name = name
+        self.queue = queue
+        self.failures = []
+        self.started_at = time.time()
+        self._tasks = {}
+
+    def track(self, tasks, keyed=False):
+        """
+        Args:
+            tasks: (任务id, url, 文件名) 迭代器，不使用队列时任务id为None
+            keyed (bool): 是否带上任务id，供KeyedTasks用作断点续传的任务序号
+
+        Yields:
+            (url, filename)，keyed为True时为 (任务id, (url, filename))
+        """
+        for task_id, url, filename in tasks:
+            self._tasks.setdefault(url, deque()).append((task_id, filename))
+            yield (task_id, (url, filename)) if keyed else (url, filename)
+
+    def on_result(self, url, success, result):
+        waiting = self._tasks.get(url)
+        task_id, filename = waiting.popleft() if waiting else (None, None)
+        if not waiting:
+            self._tasks.pop(url, None)
+        reason = None if success else (getattr(result, 'reason', None) or str(result))
+        if not success:
+            self.failures.append((filename, url, reason))
+        if self.queue is not None and task_id is not None:
+            self.queue.complete(task_id, success, reason)
+
+    def write(self, path, downloader):
+        """把分片统计写入JSON文件（先写临时文件再重命名，merge不会读到写了一半的文件）"""
+        summary = {
+            'shard': self.name,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'finished_at': time.time(),
+            'succeeded': downloader.success_count,
+            'failed': downloader.failed_count,
+            'skipped': downloader.skipped_count,
+            'resumed': downloader.resumed_count,
+            'requests': downloader.request_count,
+            'bytes': downloader.bytes_downloaded,
+            'retry_reasons': dict(downloader.retry_reasons),
+            'failure_reasons': dict(downloader.failure_reasons),
+            'failures': self.failures,
+        }
+        temp_file = Path(f"{path}.tmp")
+        temp_file.write_text(json.dumps(summary, ensure_ascii=False), encoding='utf-8')
+        os.replace(temp_file, path)
+        return summary
+
+
+def _redirect_output(log_path):
+    """分片进程的输出写入各自的日志文件，不和其他分片的输出混在一起"""
+    log = open(log_path, 'a', encoding='utf-8', buffering=1)
+    sys.stdout = sys.stderr = log
+    print(f"\n===== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} =====")
+
+
+def run_shard(input_path, folder, shard, shards, by='hash', engine='thread', workers=16, verbosity='normal'):
+    """本机多进程模式下一个分片进程的入口"""
+    summary_dir = Path(folder) / SHARD_DIR
+    _redirect_output(summary_dir / f"shard-{shard}.log")
+
+    downloader = make_downloader(folder, engine, workers, f".download_journal.shard{shard}.sqlite3", verbosity)
+    recorder = ShardRecorder(f"{shard + 1}/{shards}")
+    tasks = ((None, url, filename) for url, filename in iter_input_tasks(input_path)
+             if shard_of(url, filename, shards, by) == shard)
+    downloader.download_batch(recorder.track(tasks), f"分片 {shard + 1}/{shards}（按{by}分片）",
+                              on_result=recorder.on_result)
+    recorder.write(summary_dir / f"shard-{shard}.json", downloader)
+
+
+def run_local(input_path, folder, shards, by='hash', engine='thread', workers=16, verbosity='normal'):
+    """
+    在本机启动shards个进程分片下载，全部结束后合并统计
+
+    Returns:
+        dict: 合并后的统计，见merge_summaries
+    """
+    folder = Path(folder)
+    summary_dir = folder / SHARD_DIR
+    summary_dir.mkdir(parents=True, exist_ok=True)
+    for old in summary_dir.glob("shard-*.json"):
+        old.unlink()
+
+    print(f"分片下载: {shards} 个进程, 每个进程并发 {workers}, 按{by}分片")
+    print(f"下载表: {input_path}")
+    print(f"保存目录: {folder.absolute()}")
+    print(f"分片日志: {summary_dir.absolute()}")
+    print("-" * 50)
+
+    # spawn方式启动，各平台行为一致，也不会把父进程中的连接池等状态复制到子进程
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_shard, args=(str(input_path), str(folder), shard, shards, by, engine,
+                                                workers, verbosity))
+        for shard in range(shards)
+    ]
+    start = time.monotonic()
+    for process in processes:
+        process.start()
+    for shard, process in enumerate(processes):
+        process.join()
+        if process.exitcode:
+            print(f"❌ 分片 {shard + 1}/{shards} 异常退出 (退出码 {process.exitcode})，"
+                  f"详见 {summary_dir / f'shard-{shard}.log'}")
+        else:
+            print(f"✅ 分片 {shard + 1}/{shards} 完成 ({format_duration(time.monotonic() - start)})")
+
+    return merge_summaries(summary_dir, folder / FAILURES_FILENAME)
+
+
+def worker_journal_name(queue_path, shard=None):
+    """
+    worker的断点续传日志文件名
+
+    由主机名、队列文件和分片决定，不含进程号，worker重启后仍能找到上次的日志继续
+    未完成的任务。任务键使用队列中的任务id，同一台机器上的多个worker共用一个日志也不会冲突；
+    包含主机名是因为网络文件系统上的SQLite不能在多台机器之间共用。
+    """
+    queue_id = zlib.crc32(str(Path(queue_path).resolve()).encode('utf-8'))
+    suffix = f".shard{shard}" if shard is not None else ""
+    return f".download_journal.{socket.gethostname()}-{queue_id:08x}{suffix}.sqlite3"
+
+
+def run_worker(queue_path, folder, shard=None, engine='thread', workers=16, lease=600.0, verbosity='normal'):
+    """多台机器模式下的worker：从共享队列领取任务下载，直到队列中没有可领取的任务"""
+    queue = WorkQueue(queue_path, lease)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    # 预先读入的任务都已从队列领取，其他worker拿不到，因此只预读并发数这么多，
+    # 每次也只领取这么多（下载器读入之前，领取的任务还在生成器中等待）
+    downloader = make_downloader(folder, engine, workers, worker_journal_name(queue_path, shard), verbosity,
+                                 max_pending=workers)
+    recorder = ShardRecorder(worker, queue)
+    label = f"共享队列 {queue_path}" + (f"（分片 {shard}）" if shard is not None else "")
+    tasks = KeyedTasks(recorder.track(queue.iter_tasks(worker, shard, downloader.max_pending), keyed=True))
+
+    # 大文件可能下载得比lease还久，运行期间定期续租，只有worker退出后任务才会被重新领取
+    stopped = threading.Event()
+
+    def renew_leases():
+        while not stopped.wait(lease / 3):
+            queue.renew(worker)
+
+    renewer = threading.Thread(target=renew_leases, name="lease-renewer", daemon=True)
+    renewer.start()
+    try:
+        downloader.download_batch(tasks, label, on_result=recorder.on_result)
+        recorder.write(Path(queue_path).parent / f"shard-{worker}.json", downloader)
+    finally:
+        stopped.set()
+        renewer.join()
+        queue.close()
+
+
+def merge_summaries(summary_dir, failures_path=None, queue_path=None):
+    """
+    合并目录中全部 shard-*.json 的统计，打印合并后的统计并写出失败列表
+
+    Args:
+        summary_dir: 分片统计所在的目录
+        failures_path: 失败列表的保存路径，默认为summary_dir中的 失败列表.csv
+        queue_path: 共享任务队列文件，用于显示还没有完成的任务数，默认为summary_dir中的 queue.sqlite3
+
+    Returns:
+        dict: 合并后的统计
+    """
+    summary_dir = Path(summary_dir)
+    failures_path = Path(failures_path) if failures_path else summary_dir / FAILURES_FILENAME
+
+    shards = []
+    for path in sorted(summary_dir.glob("shard-*.json")):
+        with open(path, encoding='utf-8') as f:
+            shards.append(json.load(f))
+
+    total = {
+        'shards': len(shards),
+        'succeeded': sum(shard['succeeded'] for shard in shards),
+        'failed': sum(shard['failed'] for shard in shards),
+        'skipped': sum(shard['skipped'] for shard in shards),
+        'resumed': sum(shard['resumed'] for shard in shards),
+        'requests': sum(shard['requests'] for shard in shards),
+        'bytes': sum(shard['bytes'] for shard in shards),
+        'retry_reasons': sum((Counter(shard['retry_reasons']) for shard in shards), Counter()),
+        'failure_reasons': sum((Counter(shard['failure_reasons']) for shard in shards), Counter()),
+        'failures': [failure for shard in shards for failure in shard['failures']],
+        'elapsed_seconds': (max(shard['finished_at'] for shard in shards) -
+                            min(shard['started_at'] for shard in shards)) if shards else 0.0,
+    }
+
+    queue_path = Path(queue_path) if queue_path else summary_dir / "queue.sqlite3"
+    if queue_path.exists():
+        queue = WorkQueue(queue_path)
+        try:
+            total['queue'] = queue.counts()
+        finally:
+            queue.close()
+
+    print("\n" + "=" * 50)
+    print(f"分片下载合并统计 ({total['shards']} 个分片):")
+    for shard in shards:
+        print(f"  分片 {shard['shard']} @ {shard['host']}: 成功 {shard['succeeded']}, 失败 {shard['failed']}, "
+              f"{shard['bytes'] / (1024 * 1024):.1f} MB, 用时 {format_duration(shard['finished_at'] - shard['started_at'])}")
+    print(f"成功: {total['succeeded']}")
+    print(f"失败: {total['failed']}")
+    print(f"总计: {total['succeeded'] + total['failed']}")
+    if total['skipped'] or total['resumed']:
+        print(f"断点续传: 跳过已完成 {total['skipped']} 个, 续传 {total['resumed']} 个")
+    print(f"HTTP请求数: {total['requests']}")
+    if total['elapsed_seconds'] and total['bytes']:
+        print(f"下载量: {total['bytes'] / (1024 * 1024):.1f} MB, 用时 {format_duration(total['elapsed_seconds'])}, "
+              f"平均 {total['bytes'] / total['elapsed_seconds'] / (1024 * 1024):.2f} MB/秒")
+    if total['retry_reasons']:
+        print(f"重试: 共 {sum(total['retry_reasons'].values())} 次 "
+              f"({PDFDownloader._format_reasons(total['retry_reasons'])})")
+    if total['failure_reasons']:
+        print(f"失败原因: {PDFDownloader._format_reasons(total['failure_reasons'])}")
+    if 'queue' in total:
+        counts = total['queue']
+        print(f"队列: 待领取 {counts.get('pending', 0)}, 下载中 {counts.get('claimed', 0)}, "
+              f"完成 {counts.get('done', 0)}, 失败 {counts.get('failed', 0)}")
+
+    if total['failures']:
+        # 与下载表的格式相同（第一列文件名、第二列URL），可以直接用来重新下载
+        with open(failures_path, 'w', encoding='utf-8-sig', newline='') as f:
+            csv.writer(f).writerows(total['failures'])
+        print(f"\n失败列表已保存到: {failures_path}")
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片批量下载（本机多进程或多台机器共享任务队列）")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_download_options(command):
+        command.add_argument('-o', '--output', required=True, help="下载文件夹")
+        command.add_argument('--engine', choices=sorted(ENGINES), default='thread', help="每个进程使用的下载引擎")
+        command.add_argument('--workers', type=int, default=16, help="每个进程的并发下载数上限")
+        command.add_argument('--verbosity', choices=['quiet', 'normal', 'verbose'], default='normal',
+                             help="分片日志的详细程度")
+
+    run = commands.add_parser('run', help="在本机启动多个进程分片下载")
+    run.add_argument('input', help="下载表（.xlsx/.csv：文件名、URL两列；其他文件每行一个URL）")
+    run.add_argument('--shards', type=int, default=os.cpu_count() or 2, help="进程数，默认为CPU核数")
+    run.add_argument('--by', choices=['hash', 'host'], default='hash', help="按行哈希或按主机分片")
+    add_download_options(run)
+
+    init = commands.add_parser('init', help="把下载表导入共享任务队列")
+    init.add_argument('input', help="下载表")
+    init.add_argument('--queue', required=True, help="任务队列文件（放在各台机器都能访问的共享目录中）")
+    init.add_argument('--shards', type=int, default=1, help="预先分成几个分片，worker可以用--shard只领取其中一个")
+    init.add_argument('--by', choices=['hash', 'host'], default='hash', help="按行哈希或按主机分片")
+
+    work = commands.add_parser('work', help="从共享任务队列领取任务下载")
+    work.add_argument('--queue', required=True, help="任务队列文件")
+    work.add_argument('--shard', type=int, help="只领取这个分片的任务，默认领取任意任务")
+    work.add_argument('--lease', type=float, default=600.0,
+                      help="worker每隔lease/3秒续租一次，超过这么多秒没有续租的任务允许其他worker重新领取")
+    add_download_options(work)
+
+    merge = commands.add_parser('merge', help="合并分片统计，输出失败列表")
+    merge.add_argument('directory', help="shard-*.json 所在目录（本机模式为 下载文件夹/.shards，队列模式为队列所在目录）")
+    merge.add_argument('--failures', help=f"失败列表的保存路径，默认为目录中的 {FAILURES_FILENAME}")
+    merge.add_argument('--queue', help="共享任务队列文件，默认为目录中的 queue.sqlite3")
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_local(args.input, args.output, args.shards, args.by, args.engine, args.workers, args.verbosity)
+    elif args.command == 'init':
+        queue = WorkQueue(args.queue)
+        try:
+            if sum(queue.counts().values()):
+                print(f"❌ 错误: 队列 {args.queue} 中已有任务，请使用新的队列文件")
+                sys.exit(1)
+            count = queue.load(iter_input_tasks(args.input), args.shards, args.by)
+        finally:
+            queue.close()
+        print(f"✅ 已导入 {count} 个任务到 {args.queue}")
+    elif args.command == 'work':
+        run_worker(args.queue, args.output, args.shard, args.engine, args.workers, args.lease, args.verbosity)
+    else:
+        merge_summaries(args.directory, args.failures, args.queue)
+
+
+if __name__ == "__main__":
+    # 打包为exe后用spawn启动子进程需要
+    multiprocessing.freeze_support()
+    main()